@@ -0,0 +1,150 @@
+import json
+import random
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+from smart_docx.llm.prompts import CONVERTER_SCHEMA_LABEL
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+def example_value(schema: dict, rng: random.Random, root: typing.Optional[dict] = None) -> typing.Any:
+    root = root or schema
+    if "$ref" in schema:
+        # prompts reference repeated schemas from #/$defs
+        return example_value(root["$defs"][schema["$ref"].rsplit("/", 1)[-1]], rng, root)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+
+    schema_type = schema.get("type", "string")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+
+    if schema_type == "object":
+        return {name: example_value(property_schema, rng, root) for name, property_schema in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        items = schema.get("items") or {"type": "string"}
+        count = max(schema.get("minItems", 0), min(schema.get("maxItems", 3), 3))
+        return [example_value(items, rng, root) for _ in range(count)]
+    if schema_type == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+    if schema_type == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 100)), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    if schema_type == "null":
+        return None
+    return f"text {rng.randint(0, 10_000)}"
+
+
+def _converter_schema(prompt: str) -> typing.Optional[dict]:
+    start = prompt.find(CONVERTER_SCHEMA_LABEL)
+    if start < 0:
+        return None
+
+    try:
+        schema, _ = json.JSONDecoder().raw_decode(prompt, start + len(CONVERTER_SCHEMA_LABEL))
+        return schema if isinstance(schema, dict) else None
+    except json.JSONDecodeError:
+        return None
+
+
+@dataclass
+class FakeLLMStats:
+    calls: int = 0
+    failures: int = 0
+    invalid_replies: int = 0
+    intervals: typing.List[typing.Tuple[float, float]] = field(default_factory=list)
+
+    @property
+    def busy_time(self) -> float:
+        # cumulative time spent in calls, concurrent calls are counted separately
+        return sum(end - start for start, end in self.intervals)
+
+    @property
+    def wall_time(self) -> float:
+        # wall clock time during which at least one call was in flight
+        total = 0.0
+        current_start, current_end = None, None
+        for start, end in sorted(self.intervals):
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            total += current_end - current_start
+        return total
+
+
+# deterministic stand-in for an LLM, used as PipelinePool(llm=FakeLLM(...)), replies only depend on the seed,
+# the prompt and how many times the prompt was already seen, so runs are reproducible regardless of thread scheduling
+class FakeLLM:
+    def __init__(self,
+                 latency: float = 0.05,
+                 jitter: float = 0.0,
+                 failure_rate: float = 0.0,
+                 invalid_json_rate: float = 0.0,
+                 structured_output: bool = True,
+                 seed: int = 0):
+        self.model = "fake-llm"
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.invalid_json_rate = invalid_json_rate
+        self.structured_output = structured_output
+        self.seed = seed
+        self.stats = FakeLLMStats()
+        self._attempts: typing.Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.stats = FakeLLMStats()
+            self._attempts = {}
+
+    def _rng(self, prompt: str) -> random.Random:
+        with self._lock:
+            attempt = self._attempts.get(prompt, 0)
+            self._attempts[prompt] = attempt + 1
+        return random.Random(f"{self.seed}:{attempt}:{prompt}")
+
+    def _call(self, prompt: str, schema: typing.Optional[dict]) -> typing.Dict[str, typing.List[str]]:
+        rng = self._rng(prompt)
+        start = time.perf_counter()
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+
+        failed = rng.random() < self.failure_rate
+        invalid = rng.random() < self.invalid_json_rate
+        if schema is None:
+            reply = f"Answer {rng.randint(0, 10_000)}"
+        elif invalid:
+            # truncated JSON can not be parsed or repaired locally, so it costs another call
+            reply = json.dumps(example_value(schema, rng))[:-1] + ' ...'
+        else:
+            reply = json.dumps(example_value(schema, rng), ensure_ascii=False)
+
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.failures += failed
+            self.stats.invalid_replies += invalid and schema is not None
+            self.stats.intervals.append((start, time.perf_counter()))
+
+        if failed:
+            raise FakeLLMError("Simulated provider error")
+        return {"replies": [reply]}
+
+    def run(self, prompt: str) -> typing.Dict[str, typing.List[str]]:
+        # free text answers for questions, JSON for json converter prompts
+        return self._call(prompt, _converter_schema(prompt))
+
+    def supports_structured_output(self, schema: dict) -> bool:
+        return self.structured_output
+
+    def run_structured(self, prompt: str, schema: dict) -> typing.Dict[str, typing.List[str]]:
+        return self._call(prompt, schema)
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import typing
+from dataclasses import dataclass, asdict
+
+from fake_llm import FakeLLM
+from synthetic import SyntheticTemplate, SchemaComplexity, create_template_definition, create_template_file, create_inputs
+
+from smart_docx.llm.json_answer_generator import PipelinePool
+from smart_docx.smart_docx import SmartDocx, DocumentRenderedEvent
+
+
+@dataclass(frozen=True)
+class Scenario:
+    template: SyntheticTemplate
+    max_workers: int = 1
+    batch_size: typing.Optional[int] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.template.name}-x{self.max_workers}" + (f"-b{self.batch_size}" if self.batch_size else "")
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    fields: int
+    depth: int
+    width: int
+    complexity: str
+    max_workers: int
+    batch_size: typing.Optional[int]
+    renders: int
+    failed_renders: int
+    total_s: float  # median end-to-end render time
+    llm_s: float  # mean wall clock time with at least one LLM call in flight
+    pipeline_s: float  # mean wall clock time spent in smart-docx itself, outside of LLM calls and docx rendering
+    docx_s: float  # mean time spent rendering the docx template
+    llm_calls_per_field: float
+    retries_per_field: float
+
+
+def _scenarios(quick: bool) -> typing.List[Scenario]:
+    shapes = [(10, 1), (10, 5)] if quick else [(10, 1), (10, 5), (50, 1), (50, 10)]
+    complexities = [SchemaComplexity.SIMPLE, SchemaComplexity.COMPLEX] if quick else list(SchemaComplexity)
+
+    scenarios = []
+    for fields, depth in shapes:
+        for complexity in complexities:
+            template = SyntheticTemplate(fields=fields, depth=depth, complexity=complexity)
+            scenarios.append(Scenario(template))
+            scenarios.append(Scenario(template, max_workers=8))
+            scenarios.append(Scenario(template, max_workers=8, batch_size=5))
+    return scenarios
+
+
+def run_scenario(scenario: Scenario, llm: FakeLLM, repeat: int, directory: str) -> ScenarioResult:
+    template_definition = create_template_definition(scenario.template)
+    template_file = os.path.join(directory, f"{scenario.template.name}.docx")
+    if not os.path.exists(template_file):
+        create_template_file(template_definition, template_file)
+
+    smart_docx = SmartDocx(template_definition=template_definition,
+                           template_file=template_file,
+                           max_workers=scenario.max_workers,
+                           pool=PipelinePool(llm=llm, max_size=scenario.max_workers),
+                           batch_size=scenario.batch_size)
+
+    totals, llm_times, pipeline_times, docx_times, calls, retries = [], [], [], [], [], []
+    failed_renders = 0
+    for inputs in create_inputs(repeat):
+        llm.reset()
+        start = time.perf_counter()
+        last_field_at = start
+        field_retries = []
+        try:
+            for event in smart_docx.render_stream(inputs):
+                if isinstance(event, DocumentRenderedEvent):
+                    totals.append(event.elapsed)
+                    docx_times.append(time.perf_counter() - last_field_at)
+                else:
+                    field_retries.append(event.retries)
+                    last_field_at = time.perf_counter()
+        except Exception as e:
+            print(f"{scenario.name}: render failed: {e}", file=sys.stderr)
+            failed_renders += 1
+            continue
+
+        llm_times.append(llm.stats.wall_time)
+        pipeline_times.append(totals[-1] - docx_times[-1] - llm.stats.wall_time)
+        calls.append(llm.stats.calls / scenario.template.fields)
+        retries.append(statistics.fmean(field_retries))
+
+    def mean(values: typing.List[float]) -> float:
+        return statistics.fmean(values) if values else float("nan")
+
+    return ScenarioResult(scenario=scenario.name,
+                          fields=scenario.template.fields,
+                          depth=scenario.template.depth,
+                          width=scenario.template.width,
+                          complexity=scenario.template.complexity.value,
+                          max_workers=scenario.max_workers,
+                          batch_size=scenario.batch_size,
+                          renders=repeat,
+                          failed_renders=failed_renders,
+                          total_s=statistics.median(totals) if totals else float("nan"),
+                          llm_s=mean(llm_times),
+                          pipeline_s=mean(pipeline_times),
+                          docx_s=mean(docx_times),
+                          llm_calls_per_field=mean(calls),
+                          retries_per_field=mean(retries))
+
+
+def print_results(results: typing.List[ScenarioResult]):
+    header = f"{'scenario':<32} {'total s':>8} {'llm s':>8} {'pipeline s':>10} {'docx s':>8} {'calls/f':>8} {'retries/f':>9} {'failed':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r.scenario:<32} {r.total_s:>8.3f} {r.llm_s:>8.3f} {r.pipeline_s:>10.3f} {r.docx_s:>8.3f} "
+              f"{r.llm_calls_per_field:>8.2f} {r.retries_per_field:>9.2f} {r.failed_renders:>6}")
+
+
+def main(args: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark smart-docx rendering against a fake, latency simulating LLM.")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds every LLM call takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random deviation of the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of LLM calls raising an error")
+    parser.add_argument("--invalid-json-rate", type=float, default=0.0, help="share of replies with malformed JSON")
+    parser.add_argument("--two-stage", action="store_true", help="disable structured output of the fake LLM")
+    parser.add_argument("--repeat", type=int, default=3, help="renders per scenario")
+    parser.add_argument("--quick", action="store_true", help="only run a small set of scenarios")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parsed_args = parser.parse_args(args)
+
+    llm = FakeLLM(latency=parsed_args.latency,
+                  jitter=parsed_args.jitter,
+                  failure_rate=parsed_args.failure_rate,
+                  invalid_json_rate=parsed_args.invalid_json_rate,
+                  structured_output=not parsed_args.two_stage,
+                  seed=parsed_args.seed)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in _scenarios(parsed_args.quick):
+            results.append(run_scenario(scenario, llm, parsed_args.repeat, directory))
+
+    print_results(results)
+    if parsed_args.json:
+        with open(parsed_args.json, "w", encoding="utf-8") as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import random
+import typing
+from dataclasses import dataclass
+from enum import Enum
+
+from docx import Document
+
+from smart_docx.templates.definitions import TemplateDefinition, FieldDefinition, SourceType
+
+INPUT_FIELD_ID = "topic"
+
+
+class SchemaComplexity(Enum):
+    SIMPLE = "simple"  # strings, numbers and booleans
+    ARRAY = "array"  # arrays of primitive values
+    COMPLEX = "complex"  # nested objects and arrays of objects
+
+
+_SIMPLE_SCHEMAS = [
+    {"type": "string"},
+    {"type": "integer", "minimum": 0, "maximum": 1000},
+    {"type": "number"},
+    {"type": "boolean"},
+    {"type": "string", "enum": ["low", "medium", "high"]},
+]
+
+
+def _schema(complexity: SchemaComplexity, rng: random.Random) -> dict:
+    if complexity is SchemaComplexity.SIMPLE:
+        return rng.choice(_SIMPLE_SCHEMAS)
+
+    if complexity is SchemaComplexity.ARRAY:
+        return {"type": "array", "items": rng.choice(_SIMPLE_SCHEMAS), "minItems": 1, "maxItems": 5}
+
+    item = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "amount": {"type": "number"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["name", "amount"]
+    }
+    return {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "count": {"type": "integer", "minimum": 0},
+            "items": {"type": "array", "items": item, "minItems": 1},
+            "details": {"type": "object", "properties": {"summary": {"type": "string"}, "valid": {"type": "boolean"}}},
+        },
+        "required": ["title", "items"]
+    }
+
+
+@dataclass(frozen=True)
+class SyntheticTemplate:
+    fields: int  # number of generated fields
+    depth: int  # number of dependency levels
+    fan_in: int = 1  # number of fields from the previous level every field depends on
+    complexity: SchemaComplexity = SchemaComplexity.SIMPLE
+    seed: int = 0
+
+    @property
+    def width(self) -> int:
+        return -(-self.fields // self.depth)
+
+    @property
+    def name(self) -> str:
+        return f"f{self.fields}-d{self.depth}-w{self.width}-{self.complexity.value}"
+
+
+def create_template_definition(template: SyntheticTemplate) -> TemplateDefinition:
+    if template.fields < 1 or not 1 <= template.depth <= template.fields:
+        raise ValueError("A synthetic template needs at least one field per level")
+
+    rng = random.Random(template.seed)
+    fields = [FieldDefinition(id=INPUT_FIELD_ID, source=SourceType.INPUT, value={"type": "string"}, instructions="Topic")]
+
+    previous_level = [INPUT_FIELD_ID]
+    for level in range(template.depth):
+        level_size = template.fields // template.depth + (level < template.fields % template.depth)
+        current_level = []
+        for index in range(level_size):
+            field_id = f"field_{level}_{index}"
+            dependencies = rng.sample(previous_level, min(template.fan_in, len(previous_level)))
+            instructions = f"Write {field_id} about " + ", ".join(f"{{{{ {dep_id} }}}}" for dep_id in dependencies)
+            fields.append(FieldDefinition(id=field_id,
+                                          source=SourceType.AUTO,
+                                          value=_schema(template.complexity, rng),
+                                          instructions=instructions))
+            current_level.append(field_id)
+        previous_level = current_level
+
+    return TemplateDefinition(name=template.name,
+                              description=f"Synthetic benchmark template {template.name}",
+                              instructions="Answer the questions for a synthetic benchmark document.",
+                              fields=fields)
+
+
+def create_template_file(template_definition: TemplateDefinition, filename: str):
+    document = Document()
+    for field_def in template_definition.fields:
+        document.add_paragraph(f"{field_def.id}: {{{{ {field_def.id} }}}}")
+    document.save(filename)
+
+
+def create_inputs(count: int) -> typing.List[typing.Dict[str, str]]:
+    return [{INPUT_FIELD_ID: f"topic {i}"} for i in range(count)]
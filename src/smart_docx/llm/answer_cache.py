@@ -0,0 +1,163 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import typing
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from os import PathLike
+
+
+def schema_fingerprint(schema: dict) -> str:
+    return hashlib.sha256(json.dumps(schema, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def answer_cache_key(model: str, system_prompt: str, question: str, schema: dict) -> str:
+    key = json.dumps([model, system_prompt, question, schema_fingerprint(schema)], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# stores validated answers keyed by answer_cache_key, a None value is never cached and means a miss
+class AnswerCache(ABC):
+    def __init__(self, max_size: typing.Optional[int] = None, ttl: typing.Optional[float] = None):
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> typing.Any:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: typing.Any):
+        if value is not None:
+            self._set(key, value)
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _expires_at(self) -> typing.Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    @abstractmethod
+    def _get(self, key: str) -> typing.Any:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: typing.Any):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class InMemoryAnswerCache(AnswerCache):
+    def __init__(self, max_size: typing.Optional[int] = 1024, ttl: typing.Optional[float] = None):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self._entries: typing.OrderedDict[str, typing.Tuple[typing.Optional[float], typing.Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> typing.Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: typing.Any):
+        with self._lock:
+            self._entries[key] = (self._expires_at(), value)
+            self._entries.move_to_end(key)
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteAnswerCache(AnswerCache):
+    def __init__(self,
+                 path: typing.Union[str, PathLike],
+                 max_size: typing.Optional[int] = 100_000,
+                 ttl: typing.Optional[float] = None):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at)")
+
+    def _get(self, key: str) -> typing.Any:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value, expires_at FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._connection.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+
+            self._connection.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(value)
+
+    def _set(self, key: str, value: typing.Any):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO answers (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), self._expires_at(), now)
+            )
+            self._connection.execute("DELETE FROM answers WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            if self.max_size is not None:
+                # drop least recently used answers above the size limit
+                self._connection.execute(
+                    "DELETE FROM answers WHERE key IN "
+                    "(SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,)
+                )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM answers")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
@@ -0,0 +1,77 @@
+import threading
+import time
+import typing
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+
+class DeadlineExceededError(TimeoutError):
+    pass
+
+
+class RetryBudgetExceededError(ValueError):
+    pass
+
+
+class Deadline:
+    def __init__(self, timeout: typing.Optional[float] = None):
+        # without a timeout the deadline never expires, but it can still be cancelled
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> typing.Optional[float]:
+        if self._cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise DeadlineExceededError("Render was cancelled")
+        if self.expired:
+            raise DeadlineExceededError("Render deadline exceeded")
+
+
+@dataclass
+class AnswerBudget:
+    deadline: typing.Optional[Deadline] = None
+    max_retries: typing.Optional[int] = None  # LLM retries after invalid replies, None leaves it to the pipeline
+
+    def check(self):
+        if self.deadline is not None:
+            self.deadline.check()
+
+    def remaining(self) -> typing.Optional[float]:
+        return self.deadline.remaining() if self.deadline is not None else None
+
+
+_current_answer_budget: ContextVar[typing.Optional[AnswerBudget]] = ContextVar("smart_docx_answer_budget", default=None)
+
+
+def current_answer_budget() -> typing.Optional[AnswerBudget]:
+    return _current_answer_budget.get()
+
+
+def check_answer_budget():
+    # called before every LLM call and retry, so cancelled or expired renders stop at the next step
+    budget = current_answer_budget()
+    if budget is not None:
+        budget.check()
+
+
+@contextmanager
+def answer_budget(budget: typing.Optional[AnswerBudget]) -> typing.Iterator[typing.Optional[AnswerBudget]]:
+    token = _current_answer_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_answer_budget.reset(token)
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import logging
+import math
+import queue
+import threading
+import time
+import typing
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class CallCancelledError(Exception):
+    pass
+
+
+class HedgingPolicy:
+    def __init__(self,
+                 percentile: float = 95.0,
+                 initial_delay: float = 10.0,
+                 min_delay: float = 0.5,
+                 window: int = 200,
+                 min_samples: int = 20):
+        if not 0 < percentile <= 100:
+            raise ValueError("percentile must be between 0 and 100")
+        if window < 1 or min_samples < 1:
+            raise ValueError("window and min_samples must be at least 1")
+
+        # a call is hedged once it takes longer than this percentile of the latencies of its model
+        self.percentile = percentile
+        self.initial_delay = initial_delay  # used until enough latencies are recorded
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: typing.Dict[str, typing.Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: float):
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def delay(self, model: str) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies.get(model) or [])
+        if len(latencies) < self.min_samples:
+            return self.initial_delay
+
+        index = min(len(latencies) - 1, math.ceil(self.percentile / 100 * len(latencies)) - 1)
+        return max(self.min_delay, latencies[index])
+
+
+def _run_sequentially(calls: typing.List[typing.Tuple[str, typing.Callable[[threading.Event], T]]],
+                      is_valid: typing.Callable[[T], bool]) -> T:
+    error = None
+    never_cancelled = threading.Event()
+    for model, call in calls:
+        try:
+            result = call(never_cancelled)
+        except Exception as e:
+            logger.debug(f"Call to {model} failed, failing over: {e}")
+            error = e
+            continue
+
+        if is_valid(result):
+            return result
+        error = ValueError(f"{model} returned no valid reply")
+    raise error
+
+
+def run_hedged(calls: typing.List[typing.Tuple[str, typing.Callable[[threading.Event], T]]],
+               hedging: typing.Optional[HedgingPolicy] = None,
+               is_valid: typing.Callable[[T], bool] = lambda result: True) -> T:
+    # calls are (model, call) pairs in order of preference, every call gets an event which is set once another call
+    # won, so calls still waiting for their turn (e.g. in a scheduler) can give up before reaching the provider.
+    # Failed or invalid calls fail over to the next one, with hedging the next one is also started
+    # when the running calls take longer than the hedging delay. The first valid result wins.
+    if not calls:
+        raise ValueError("At least one call is required")
+    if hedging is None:
+        return _run_sequentially(calls, is_valid)
+
+    results: queue.Queue = queue.Queue()
+    cancelled = threading.Event()
+    pending = iter(calls)
+
+    def start(model: str, call: typing.Callable[[threading.Event], T]) -> float:
+        # calls run in their own threads, with the caller's context, so stats and scheduler queues still apply
+        context = contextvars.copy_context()
+
+        def target():
+            start_time = time.perf_counter()
+            try:
+                if cancelled.is_set():
+                    raise CallCancelledError(f"Call to {model} was cancelled")
+                result = context.run(call, cancelled)
+            except Exception as e:
+                results.put((model, None, e))
+                return
+            hedging.record(model, time.perf_counter() - start_time)
+            results.put((model, result, None))
+
+        threading.Thread(target=target, name=f"smart-docx-hedge-{model}", daemon=True).start()
+        return time.monotonic() + hedging.delay(model)
+
+    deadline = start(*next(pending))
+    running = 1
+    error = None
+    while running:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            model, result, call_error = results.get(timeout=timeout)
+        except queue.Empty:
+            next_call = next(pending, None)
+            if next_call is None:
+                deadline = None
+                continue
+            logger.debug(f"No reply within the hedging delay, also calling {next_call[0]}")
+            deadline = start(*next_call)
+            running += 1
+            continue
+
+        running -= 1
+        if call_error is None and is_valid(result):
+            # calls that are still running can't be interrupted, their results are discarded
+            cancelled.set()
+            return result
+
+        error = call_error or ValueError(f"{model} returned no valid reply")
+        logger.debug(f"Call to {model} failed, failing over: {error}")
+        next_call = next(pending, None)
+        if next_call is not None:
+            deadline = start(*next_call)
+            running += 1
+
+    raise error
+
+
+async def arun_hedged(calls: typing.List[typing.Tuple[str, typing.Callable[[], typing.Awaitable[T]]]],
+                      hedging: typing.Optional[HedgingPolicy] = None,
+                      is_valid: typing.Callable[[T], bool] = lambda result: True) -> T:
+    # same as run_hedged, for coroutines, calls that lost are cancelled even when they are already in flight
+    if not calls:
+        raise ValueError("At least one call is required")
+
+    pending = iter(calls)
+    tasks: typing.Dict[asyncio.Future, typing.Tuple[str, float]] = {}
+
+    def start(model: str, call: typing.Callable[[], typing.Awaitable[T]]) -> typing.Optional[float]:
+        tasks[asyncio.ensure_future(call())] = (model, time.perf_counter())
+        return time.monotonic() + hedging.delay(model) if hedging is not None else None
+
+    deadline = start(*next(pending))
+    error = None
+    try:
+        while tasks:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            finished, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not finished:
+                next_call = next(pending, None)
+                if next_call is None:
+                    deadline = None
+                    continue
+                logger.debug(f"No reply within the hedging delay, also calling {next_call[0]}")
+                deadline = start(*next_call)
+                continue
+
+            for task in finished:
+                model, start_time = tasks.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    error = e
+                else:
+                    if hedging is not None:
+                        hedging.record(model, time.perf_counter() - start_time)
+                    if is_valid(result):
+                        return result
+                    error = ValueError(f"{model} returned no valid reply")
+
+                logger.debug(f"Call to {model} failed, failing over: {error}")
+                next_call = next(pending, None)
+                if next_call is not None:
+                    deadline = start(*next_call)
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,44 +1,227 @@
-import os
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
 import typing
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import Enum
 
-from haystack import Pipeline, component
+import jsonschema
+from haystack import AsyncPipeline, Pipeline, component
+from haystack.core.errors import PipelineMaxComponentRuns, PipelineRuntimeError
 from haystack.components.converters import OutputAdapter
-from haystack.components.generators import OpenAIGenerator
-from haystack.utils import Secret
-from haystack_integrations.components.generators.google_ai import GoogleAIGeminiGenerator
 
+from .answer_cache import AnswerCache, answer_cache_key
+from .budget import DeadlineExceededError, RetryBudgetExceededError, check_answer_budget
+from .hedging import CallCancelledError, HedgingPolicy, arun_hedged, run_hedged
 from .json_converter import JsonConverter
-from .jsonschema_output_validator import OutputValidator
+from .jsonschema_output_validator import OutputValidator, compile_schema
+from .prompts import build_answer_prompt, build_chunk_question, record_prompt
+from .providers import create_llm, provider_for
+from .scheduler import LLMScheduler, estimate_tokens, get_default_scheduler
+from .stats import current_answer_stats
 
+logger = logging.getLogger(__name__)
 
-def _get_llm_generator():
-    openai_api_token = os.getenv("OPENAI_API_TOKEN")
-    gemini_api_token = os.getenv("GOOGLE_API_KEY")
+# providers only accept an object at the root of a structured output schema, other schemas are wrapped into one
+STRUCTURED_OUTPUT_VALUE_KEY = "value"
 
-    if openai_api_token:
-        return AnswerGenerator(generator=OpenAIGenerator(api_key=Secret.from_token(openai_api_token), model="gpt-4o"))
-    elif gemini_api_token:
-        return AnswerGenerator(generator=GoogleAIGeminiGenerator(api_key=Secret.from_token(gemini_api_token), model="gemini-2.0-flash"))
-    else:
-        raise ValueError("No valid API key found in environment variables.")
+# arrays without maxItems are requested page after page, until a page is not full, longer arrays are an error
+MAX_SEQUENTIAL_CHUNKS = 20
+
+# models which replied while an answer was generated, answers of fallback models are not cached under the pool's model
+_replying_models: ContextVar[typing.Optional[typing.Set[str]]] = ContextVar("smart_docx_replying_models", default=None)
+
+
+class GenerationMode(Enum):
+    TWO_STAGE = "two_stage"  # free text answer, converted to JSON by a second LLM call
+    STRUCTURED = "structured"  # JSON constrained by the provider's structured output, single LLM call
+
+
+def _wrap_structured_output_schema(schema: dict) -> typing.Tuple[dict, bool]:
+    if schema.get("type") == "object":
+        return schema, False
+
+    return {
+        "type": "object",
+        "properties": {STRUCTURED_OUTPUT_VALUE_KEY: schema},
+        "required": [STRUCTURED_OUTPUT_VALUE_KEY],
+        "additionalProperties": False
+    }, True
+
+
+def _get_usage(result: typing.Dict[str, typing.Any]) -> typing.Optional[typing.Tuple[int, int]]:
+    # openai reports token usage in the reply metadata, the gemini provider adds its usage in the same format
+    usages = [meta.get("usage") for meta in result.get("meta") or [] if meta.get("usage")]
+    if not usages:
+        return None
+    return (sum(usage.get("prompt_tokens") or 0 for usage in usages),
+            sum(usage.get("completion_tokens") or 0 for usage in usages))
+
+
+def _count_tokens(result: typing.Dict[str, typing.Any]) -> typing.Optional[int]:
+    usage = _get_usage(result)
+    return sum(usage) if usage else None
+
+
+def _record_llm_call(result: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    stats = current_answer_stats()
+    if stats is None:
+        return result
+
+    prompt_tokens, completion_tokens = _get_usage(result) or (0, 0)
+    stats.record_llm_call(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return result
+
+
+@contextmanager
+def _collect_replying_models() -> typing.Iterator[typing.Set[str]]:
+    models = set()
+    token = _replying_models.set(models)
+    try:
+        yield models
+    finally:
+        _replying_models.reset(token)
+
+
+def _get_llm_generator(provider_name: typing.Optional[str] = None):
+    return AnswerGenerator(generator=create_llm(provider_name))
+
+
+def _has_reply(result: typing.Dict[str, typing.Any]) -> bool:
+    return bool(result.get("replies"))
 
 
 @component
 class AnswerGenerator:
 
-    def __init__(self, generator: typing.Union[OpenAIGenerator, GoogleAIGeminiGenerator]):
+    def __init__(self,
+                 generator: typing.Any,
+                 scheduler: typing.Optional[LLMScheduler] = None,
+                 fallbacks: typing.Optional[typing.List["AnswerGenerator"]] = None,
+                 hedging: typing.Optional[HedgingPolicy] = None):
         self.generator = generator
+        self.provider = provider_for(generator)
+        self.scheduler = scheduler
+        # fallbacks are called when this generator fails or, with hedging, when it is slower than usual
+        self.fallbacks = list(fallbacks or [])
+        self.hedging = hedging
+
+    def _call(self,
+              prompt: str,
+              call: typing.Callable[[], typing.Dict[str, typing.Any]],
+              cancelled: typing.Optional[threading.Event] = None) -> typing.Dict[str, typing.Any]:
+        def checked_call() -> typing.Dict[str, typing.Any]:
+            # a hedged call waiting in the scheduler is dropped once another provider already replied
+            if cancelled is not None and cancelled.is_set():
+                raise CallCancelledError(f"Call to {self.model} was cancelled")
+            check_answer_budget()
+            return call()
+
+        if self.scheduler is None:
+            return self._record_reply(checked_call())
+        return self._record_reply(self.scheduler.call(checked_call, estimated_tokens=estimate_tokens(prompt), count_tokens=_count_tokens))
+
+    async def _acall(self,
+                     prompt: str,
+                     call: typing.Callable[[], typing.Awaitable[typing.Dict[str, typing.Any]]]) -> typing.Dict[str, typing.Any]:
+        async def checked_call() -> typing.Dict[str, typing.Any]:
+            check_answer_budget()
+            return await call()
+
+        if self.scheduler is None:
+            return self._record_reply(await checked_call())
+        return self._record_reply(await self.scheduler.acall(checked_call, estimated_tokens=estimate_tokens(prompt), count_tokens=_count_tokens))
+
+    def _record_reply(self, result: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        models = _replying_models.get()
+        if models is not None and _has_reply(result):
+            models.add(self.model)
+        return _record_llm_call(result)
+
+    def _run_once(self, prompt: str, cancelled: typing.Optional[threading.Event] = None) -> typing.Dict[str, typing.Any]:
+        return self._call(prompt, lambda: self.provider.run(self.generator, prompt), cancelled)
+
+    def _run_structured_once(self,
+                             prompt: str,
+                             schema: dict,
+                             cancelled: typing.Optional[threading.Event] = None) -> typing.Dict[str, typing.Any]:
+        return self._call(prompt, lambda: self.provider.run_structured(self.generator, prompt, schema), cancelled)
+
+    async def _arun_once(self, prompt: str) -> typing.Dict[str, typing.Any]:
+        return await self._acall(prompt, lambda: self.provider.run_async(self.generator, prompt))
+
+    async def _arun_structured_once(self, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        return await self._acall(prompt, lambda: self.provider.run_structured_async(self.generator, prompt, schema))
 
     @component.output_types(replies=typing.List[str])
     def run(self, prompt: str):
-        if isinstance(self.generator, OpenAIGenerator):
-            return self.generator.run(prompt=prompt)
-        if isinstance(self.generator, GoogleAIGeminiGenerator):
-            return self.generator.run(parts=[prompt])
-
-def _init_pipeline():
-    pipeline = Pipeline(max_runs_per_component=5)
-    generator = _get_llm_generator()
+        if not self.fallbacks:
+            return self._run_once(prompt)
+        return run_hedged([(generator.model, functools.partial(generator._run_once, prompt))
+                           for generator in [self] + self.fallbacks],
+                          hedging=self.hedging,
+                          is_valid=_has_reply)
+
+    @component.output_types(replies=typing.List[str])
+    async def run_async(self, prompt: str):
+        if not self.fallbacks:
+            return await self._arun_once(prompt)
+        return await arun_hedged([(generator.model, functools.partial(generator._arun_once, prompt))
+                                  for generator in [self] + self.fallbacks],
+                                 hedging=self.hedging,
+                                 is_valid=_has_reply)
+
+    def _supports_structured_output(self, schema: dict) -> bool:
+        return self.provider.supports_structured_output(self.generator, schema)
+
+    def supports_structured_output(self, schema: dict) -> bool:
+        return any(generator._supports_structured_output(schema) for generator in [self] + self.fallbacks)
+
+    def is_schema_error(self, error: Exception) -> bool:
+        # expired renders and exhausted budgets are never answered in two stages instead
+        if isinstance(error, (DeadlineExceededError, RetryBudgetExceededError, CallCancelledError)):
+            return False
+        return any(generator.provider.is_schema_error(generator.generator, error) for generator in [self] + self.fallbacks)
+
+    def _structured_output_generators(self, schema: dict) -> typing.List["AnswerGenerator"]:
+        # only generators supporting structured output for this schema take part
+        generators = [generator for generator in [self] + self.fallbacks if generator._supports_structured_output(schema)]
+        if not generators:
+            raise ValueError(f"Structured output is not supported by {type(self.generator).__name__}")
+        return generators
+
+    def run_structured(self, prompt: str, schema: dict) -> typing.Dict[str, typing.List[str]]:
+        generators = self._structured_output_generators(schema)
+        if len(generators) == 1:
+            return generators[0]._run_structured_once(prompt, schema)
+        return run_hedged([(generator.model, functools.partial(generator._run_structured_once, prompt, schema))
+                           for generator in generators],
+                          hedging=self.hedging,
+                          is_valid=_has_reply)
+
+    async def run_structured_async(self, prompt: str, schema: dict) -> typing.Dict[str, typing.List[str]]:
+        generators = self._structured_output_generators(schema)
+        if len(generators) == 1:
+            return await generators[0]._arun_structured_once(prompt, schema)
+        return await arun_hedged([(generator.model, functools.partial(generator._arun_structured_once, prompt, schema))
+                                  for generator in generators],
+                                 hedging=self.hedging,
+                                 is_valid=_has_reply)
+
+    @property
+    def model(self) -> str:
+        return self.provider.model(self.generator)
+
+
+def _init_pipeline(generator: AnswerGenerator, pipeline_class: typing.Type[typing.Union[Pipeline, AsyncPipeline]] = Pipeline):
+    pipeline = pipeline_class(max_runs_per_component=5)
     json_converter = JsonConverter(generator)
 
     output_validator = OutputValidator()
@@ -57,17 +240,588 @@ def _init_pipeline():
     return pipeline
 
 
+class PipelinePool:
+    def __init__(self,
+                 llm: typing.Optional[typing.Any] = None,
+                 max_size: int = 16,
+                 scheduler: typing.Optional[LLMScheduler] = None,
+                 fallback_llms: typing.Optional[typing.List[typing.Any]] = None,
+                 hedging: typing.Optional[HedgingPolicy] = None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        # a single llm (and its HTTP client) is shared by all pipelines, so connections are kept alive between renders
+        self.llm = llm or create_llm()
+        # calls to the same provider are paced by one scheduler, even across pools
+        self.scheduler = scheduler or get_default_scheduler(type(self.llm).__name__)
+        # e.g. other providers, called in order when the llm fails or, with hedging, doesn't reply in time
+        self.fallback_llms = list(fallback_llms or [])
+        self.hedging = hedging
+        # answers are cached under this model, it is resolved once since every cache lookup needs it
+        self.model = provider_for(self.llm).model(self.llm)
+        self.max_size = max_size
+        self._idle_pipelines: typing.List[Pipeline] = []
+        self._idle_async_pipelines: typing.List[AsyncPipeline] = []
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(max_size)
+        # asyncio semaphores belong to one event loop, so every loop gets its own
+        self._async_available: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @contextmanager
+    def pipeline(self) -> typing.Iterator[Pipeline]:
+        # pipeline components keep per-run state, so a pipeline is only ever used by one caller at a time
+        with self._available:
+            with self._lock:
+                pipeline = self._idle_pipelines.pop() if self._idle_pipelines else None
+
+            if pipeline is None:
+                pipeline = _init_pipeline(self._create_answer_generator())
+
+            try:
+                yield pipeline
+            finally:
+                with self._lock:
+                    self._idle_pipelines.append(pipeline)
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._async_available.get(loop)
+            if semaphore is None:
+                semaphore = self._async_available[loop] = asyncio.Semaphore(self.max_size)
+        return semaphore
+
+    @asynccontextmanager
+    async def async_pipeline(self) -> typing.AsyncIterator[AsyncPipeline]:
+        # same as pipeline, async callers wait for a pipeline without blocking the event loop
+        async with self._async_semaphore():
+            with self._lock:
+                pipeline = self._idle_async_pipelines.pop() if self._idle_async_pipelines else None
+
+            if pipeline is None:
+                pipeline = _init_pipeline(self._create_answer_generator(), pipeline_class=AsyncPipeline)
+
+            try:
+                yield pipeline
+            finally:
+                with self._lock:
+                    # with several event loops more pipelines can be in use, at most max_size are kept
+                    if len(self._idle_async_pipelines) < self.max_size:
+                        self._idle_async_pipelines.append(pipeline)
+
+    def _create_answer_generator(self) -> AnswerGenerator:
+        # haystack components can only be part of one pipeline, so every pipeline gets its own wrapper
+        fallbacks = [AnswerGenerator(generator=llm, scheduler=get_default_scheduler(type(llm).__name__))
+                     for llm in self.fallback_llms]
+        return AnswerGenerator(generator=self.llm, scheduler=self.scheduler, fallbacks=fallbacks, hedging=self.hedging)
+
+
+_default_pipeline_pool: typing.Optional[PipelinePool] = None
+_default_pipeline_pool_lock = threading.Lock()
+
+
+def get_default_pipeline_pool() -> PipelinePool:
+    global _default_pipeline_pool
+
+    with _default_pipeline_pool_lock:
+        if _default_pipeline_pool is None:
+            _default_pipeline_pool = PipelinePool()
+        return _default_pipeline_pool
+
+
+def _get_chunk_ranges(schema: dict, chunk_size: int) -> typing.Optional[typing.List[typing.Tuple[int, int]]]:
+    # (start, end) of every page, None if the length of the array is unknown
+    max_items = schema.get("maxItems")
+    if max_items is None:
+        return None
+    return [(start, min(start + chunk_size, max_items)) for start in range(0, max_items, chunk_size)]
+
+
+def _get_chunk_schema(schema: dict, start: int, end: int) -> dict:
+    # every page is validated against the items schema, constraints on the whole array are checked once joined
+    return {"type": "array", "items": schema.get("items", {}), "maxItems": end - start}
+
+
+def _join_chunks(chunk_ranges: typing.List[typing.Tuple[int, int]], chunks: typing.List[list]) -> list:
+    items = []
+    for (start, end), chunk in zip(chunk_ranges, chunks):
+        items.extend(chunk)
+        if len(chunk) < end - start:
+            # the array ended within this page, later pages should be empty
+            break
+    return items
+
+
+def _is_last_chunk(chunk: list, start: int, end: int) -> bool:
+    return len(chunk) < end - start
+
+
+def _too_many_chunks_error(chunk_size: int) -> ValueError:
+    # the array may go on, returning the pages read so far would silently drop the rest of it
+    return ValueError(f"Array is longer than {MAX_SEQUENTIAL_CHUNKS} pages of {chunk_size} items, "
+                      f"set maxItems in its schema or a larger chunk_size")
+
+
+def _combine_questions(questions: typing.Dict[str, str]) -> str:
+    combined_question = "Odgovori na vsa spodnja vprašanja. Odgovor na vsako vprašanje vrni pod ključem, ki je naveden pred vprašanjem.\n"
+    for answer_id, question in questions.items():
+        combined_question += f"\n{answer_id}:\n{question}\n"
+    return combined_question
+
+
 class JsonAnswerGenerator:
-    def __init__(self, system_prompt: str):
+    def __init__(self,
+                 system_prompt: str = "",
+                 cache: typing.Optional[AnswerCache] = None,
+                 pool: typing.Optional[PipelinePool] = None,
+                 mode: GenerationMode = GenerationMode.STRUCTURED,
+                 max_chunk_workers: int = 4):
+        if max_chunk_workers < 1:
+            raise ValueError("max_chunk_workers must be at least 1")
+
         self.system_prompt = system_prompt
-        self.pipeline = _init_pipeline()
+        self.cache = cache
+        self.pool = pool or get_default_pipeline_pool()
+        self.mode = mode
+        self.max_chunk_workers = max_chunk_workers  # pages of one array which are generated at the same time
+
+    def answer(self, question: str, schema: dict, system_prompt: typing.Optional[str] = None) -> typing.Union[dict, str]:
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        if self.cache is None:
+            return self._answer(question, schema, system_prompt)
+
+        # only validated answers are cached, so a hit skips both the generator and the json converter
+        key = answer_cache_key(self.pool.model, system_prompt, question, schema)
+        cached_answer = self.cache.get(key)
+        if cached_answer is not None:
+            return cached_answer
+
+        with _collect_replying_models() as models:
+            valid_answer = self._answer(question, schema, system_prompt)
+        if self._is_cacheable(models):
+            self.cache.set(key, valid_answer)
+        return valid_answer
+
+    async def aanswer(self, question: str, schema: dict, system_prompt: typing.Optional[str] = None) -> typing.Union[dict, str]:
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        if self.cache is None:
+            return await self._aanswer(question, schema, system_prompt)
+
+        key = answer_cache_key(self.pool.model, system_prompt, question, schema)
+        cached_answer = self.cache.get(key)
+        if cached_answer is not None:
+            return cached_answer
+
+        with _collect_replying_models() as models:
+            valid_answer = await self._aanswer(question, schema, system_prompt)
+        if self._is_cacheable(models):
+            self.cache.set(key, valid_answer)
+        return valid_answer
+
+    def answer_array(self, question: str, schema: dict, chunk_size: int, system_prompt: typing.Optional[str] = None) -> list:
+        # long arrays are asked for in pages, every page is validated and retried on its own,
+        # so a cut off or invalid reply only repeats its page instead of the whole array
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        chunk_ranges = _get_chunk_ranges(schema, chunk_size)
+        if chunk_ranges is None:
+            items = self._answer_chunks_sequentially(question, schema, chunk_size, system_prompt)
+        else:
+            items = _join_chunks(chunk_ranges, self._answer_chunks(question, schema, chunk_ranges, system_prompt))
+        if not self._is_valid_array(schema, items):
+            return self.answer(question, schema, system_prompt=system_prompt)
+        return items
+
+    async def aanswer_array(self, question: str, schema: dict, chunk_size: int, system_prompt: typing.Optional[str] = None) -> list:
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        chunk_ranges = _get_chunk_ranges(schema, chunk_size)
+        if chunk_ranges is None:
+            items = await self._aanswer_chunks_sequentially(question, schema, chunk_size, system_prompt)
+        else:
+            items = _join_chunks(chunk_ranges, await self._aanswer_chunks(question, schema, chunk_ranges, system_prompt))
+        if not self._is_valid_array(schema, items):
+            return await self.aanswer(question, schema, system_prompt=system_prompt)
+        return items
+
+    def _answer_chunk(self, question: str, schema: dict, start: int, end: int, system_prompt: str) -> list:
+        return self.answer(build_chunk_question(question, start, end, schema.get("maxItems")),
+                           _get_chunk_schema(schema, start, end),
+                           system_prompt=system_prompt)
+
+    async def _aanswer_chunk(self, question: str, schema: dict, start: int, end: int, system_prompt: str) -> list:
+        return await self.aanswer(build_chunk_question(question, start, end, schema.get("maxItems")),
+                                  _get_chunk_schema(schema, start, end),
+                                  system_prompt=system_prompt)
+
+    def _answer_chunks(self,
+                       question: str,
+                       schema: dict,
+                       chunk_ranges: typing.List[typing.Tuple[int, int]],
+                       system_prompt: str) -> typing.List[list]:
+        # maxItems is only an upper bound, so pages are requested as earlier pages come back full,
+        # at most max_chunk_workers ahead, and pages not started yet are cancelled once one is short
+        if len(chunk_ranges) == 1 or self.max_chunk_workers == 1:
+            chunks = []
+            for start, end in chunk_ranges:
+                chunks.append(self._answer_chunk(question, schema, start, end, system_prompt))
+                if _is_last_chunk(chunks[-1], start, end):
+                    break
+            return chunks
+
+        # pages run in their own threads, with the caller's context, so stats, budgets and scheduler queues still apply
+        executor = ThreadPoolExecutor(max_workers=min(self.max_chunk_workers, len(chunk_ranges)),
+                                      thread_name_prefix="smart-docx-chunk")
+        remaining_ranges = iter(chunk_ranges)
+        pending = deque()
+
+        def submit_next():
+            chunk_range = next(remaining_ranges, None)
+            if chunk_range is not None:
+                future = executor.submit(contextvars.copy_context().run, self._answer_chunk, question, schema, *chunk_range, system_prompt)
+                pending.append((chunk_range, future))
+
+        try:
+            for _ in range(self.max_chunk_workers):
+                submit_next()
+            chunks = []
+            while pending:
+                (start, end), future = pending.popleft()
+                chunks.append(future.result())
+                if _is_last_chunk(chunks[-1], start, end):
+                    break
+                submit_next()
+            return chunks
+        finally:
+            # pages already sent to the llm can not be stopped, their replies are discarded
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _aanswer_chunks(self,
+                              question: str,
+                              schema: dict,
+                              chunk_ranges: typing.List[typing.Tuple[int, int]],
+                              system_prompt: str) -> typing.List[list]:
+        remaining_ranges = iter(chunk_ranges)
+        pending = deque()
+
+        def start_next():
+            chunk_range = next(remaining_ranges, None)
+            if chunk_range is not None:
+                pending.append((chunk_range, asyncio.ensure_future(self._aanswer_chunk(question, schema, *chunk_range, system_prompt))))
+
+        try:
+            for _ in range(self.max_chunk_workers):
+                start_next()
+            chunks = []
+            while pending:
+                (start, end), task = pending.popleft()
+                chunks.append(await task)
+                if _is_last_chunk(chunks[-1], start, end):
+                    break
+                start_next()
+            return chunks
+        finally:
+            # pages after the last one, or after a failed one, are cancelled even when they are already in flight
+            for _, task in pending:
+                task.cancel()
+
+    def _answer_chunks_sequentially(self, question: str, schema: dict, chunk_size: int, system_prompt: str) -> list:
+        items = []
+        for start in range(0, chunk_size * MAX_SEQUENTIAL_CHUNKS, chunk_size):
+            chunk = self._answer_chunk(question, schema, start, start + chunk_size, system_prompt)
+            items.extend(chunk)
+            if _is_last_chunk(chunk, start, start + chunk_size):
+                return items
+        raise _too_many_chunks_error(chunk_size)
+
+    async def _aanswer_chunks_sequentially(self, question: str, schema: dict, chunk_size: int, system_prompt: str) -> list:
+        items = []
+        for start in range(0, chunk_size * MAX_SEQUENTIAL_CHUNKS, chunk_size):
+            chunk = await self._aanswer_chunk(question, schema, start, start + chunk_size, system_prompt)
+            items.extend(chunk)
+            if _is_last_chunk(chunk, start, start + chunk_size):
+                return items
+        raise _too_many_chunks_error(chunk_size)
+
+    @staticmethod
+    def _is_valid_array(schema: dict, items: list) -> bool:
+        try:
+            compile_schema(schema).validate(items)
+        except jsonschema.ValidationError as e:
+            # e.g. minItems or uniqueItems across pages, the whole array is asked for at once instead
+            logger.debug(f"Joined pages do not match the array schema, generating the array at once: {e.message}")
+            return False
+        return True
+
+    def _is_cacheable(self, models: typing.Set[str]) -> bool:
+        # the cache key has the pool's model, so answers from fallback models would later be served as its answers
+        if models <= {self.pool.model}:
+            return True
+        logger.debug(f"Answer was generated by fallback models {', '.join(sorted(models))}, it is not cached")
+        return False
+
+    def _get_cached_answers(self,
+                            questions: typing.Dict[str, str],
+                            schemas: typing.Dict[str, dict],
+                            system_prompt: str) -> typing.Dict[str, typing.Any]:
+        answers = {}
+        if self.cache is not None:
+            for answer_id, question in questions.items():
+                cached_answer = self.cache.get(answer_cache_key(self.pool.model, system_prompt, question, schemas[answer_id]))
+                if cached_answer is not None:
+                    answers[answer_id] = cached_answer
+        return answers
+
+    def _cache_answers(self,
+                       answers: typing.Dict[str, typing.Any],
+                       questions: typing.Dict[str, str],
+                       schemas: typing.Dict[str, dict],
+                       system_prompt: str,
+                       models: typing.Set[str]):
+        if self.cache is not None and self._is_cacheable(models):
+            for answer_id, valid_answer in answers.items():
+                self.cache.set(answer_cache_key(self.pool.model, system_prompt, questions[answer_id], schemas[answer_id]), valid_answer)
+
+    def answer_many(self,
+                    questions: typing.Dict[str, str],
+                    schemas: typing.Dict[str, dict],
+                    system_prompt: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        answers = self._get_cached_answers(questions, schemas, system_prompt)
+
+        pending_ids = [answer_id for answer_id in questions if answer_id not in answers]
+        if len(pending_ids) > 1:
+            with _collect_replying_models() as models:
+                combined_answers = self._answer_combined({answer_id: questions[answer_id] for answer_id in pending_ids},
+                                                         {answer_id: schemas[answer_id] for answer_id in pending_ids},
+                                                         system_prompt)
+            self._cache_answers(combined_answers, questions, schemas, system_prompt, models)
+            answers.update(combined_answers)
+
+        # answers missing from the combined reply or not matching their schema are retried on their own
+        for answer_id in questions:
+            if answer_id not in answers:
+                logger.debug(f"Answer {answer_id} is missing from the combined reply, generating it separately")
+                answers[answer_id] = self.answer(questions[answer_id], schemas[answer_id], system_prompt=system_prompt)
 
-    def answer(self, question: str, schema: dict) -> typing.Union[dict, str]:
-        task = f"{self.system_prompt} \n {question}"
-        result = self.pipeline.run(
-            {
-                "llm": {"prompt": task},
+        return {answer_id: answers[answer_id] for answer_id in questions}
+
+    async def aanswer_many(self,
+                           questions: typing.Dict[str, str],
+                           schemas: typing.Dict[str, dict],
+                           system_prompt: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+        system_prompt = self.system_prompt if system_prompt is None else system_prompt
+        answers = self._get_cached_answers(questions, schemas, system_prompt)
+
+        pending_ids = [answer_id for answer_id in questions if answer_id not in answers]
+        if len(pending_ids) > 1:
+            with _collect_replying_models() as models:
+                combined_answers = await self._aanswer_combined({answer_id: questions[answer_id] for answer_id in pending_ids},
+                                                                {answer_id: schemas[answer_id] for answer_id in pending_ids},
+                                                                system_prompt)
+            self._cache_answers(combined_answers, questions, schemas, system_prompt, models)
+            answers.update(combined_answers)
+
+        # missing answers are generated concurrently, they don't depend on each other
+        missing_ids = [answer_id for answer_id in questions if answer_id not in answers]
+        if missing_ids:
+            logger.debug(f"Answers {', '.join(missing_ids)} are missing from the combined reply, generating them separately")
+            missing_answers = await asyncio.gather(*(self.aanswer(questions[answer_id], schemas[answer_id], system_prompt=system_prompt)
+                                                     for answer_id in missing_ids))
+            answers.update(zip(missing_ids, missing_answers))
+
+        return {answer_id: answers[answer_id] for answer_id in questions}
+
+    @staticmethod
+    def _build_task(system_prompt: str, question: str) -> str:
+        check_answer_budget()
+        prompt = build_answer_prompt(system_prompt, question)
+        record_prompt(prompt)
+        return prompt.text
+
+    @staticmethod
+    def _validate_structured_reply(output_validator: OutputValidator,
+                                   structured_reply: typing.Any,
+                                   schema: dict) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        # the validation if the reply is valid, None if two stage generation should be tried instead
+        validation = output_validator.run(structured_reply, schema)
+        if "valid_reply" in validation:
+            return validation
+        if "error_message" not in validation:
+            raise RetryBudgetExceededError(f"No valid answer after {output_validator.iteration_counter} attempts")
+        logger.debug(f"Structured output reply does not match the schema, falling back to two stage "
+                      f"generation: {validation.get('error_message')}")
+        return None
+
+    @staticmethod
+    def _get_valid_reply(result: typing.Dict[str, typing.Any], attempts: int) -> typing.Union[dict, str]:
+        validation = result.get("output_validator") or {}
+        if "valid_reply" not in validation:
+            raise RetryBudgetExceededError(f"No valid answer after {attempts} attempts")
+        return validation["valid_reply"]
+
+    @staticmethod
+    def _pipeline_data(task: str, question: str, schema: dict, validated_schema: dict) -> typing.Dict[str, typing.Any]:
+        return {"llm": {"prompt": task},
                 "json_converter": {"schema": schema, "question": question},
-                "output_validator": {"schema": schema}}
-        )
-        return result.get("output_validator").get("valid_reply")
+                "output_validator": {"schema": validated_schema}}
+
+    def _answer(self, question: str, schema: dict, system_prompt: str) -> typing.Union[dict, str]:
+        task = self._build_task(system_prompt, question)
+        with self.pool.pipeline() as pipeline:
+            output_validator = pipeline.get_component("output_validator")
+            output_validator.reset()
+            if self.mode is GenerationMode.STRUCTURED:
+                structured_reply = self._run_structured(pipeline, task, schema)
+                if structured_reply is not None:
+                    validation = self._validate_structured_reply(output_validator, structured_reply, schema)
+                    if validation is not None:
+                        return validation["valid_reply"]
+
+            result = self._run_pipeline(pipeline, self._pipeline_data(task, question, schema, schema))
+            attempts = output_validator.iteration_counter
+
+        return self._get_valid_reply(result, attempts)
+
+    async def _aanswer(self, question: str, schema: dict, system_prompt: str) -> typing.Union[dict, str]:
+        task = self._build_task(system_prompt, question)
+        async with self.pool.async_pipeline() as pipeline:
+            output_validator = pipeline.get_component("output_validator")
+            output_validator.reset()
+            if self.mode is GenerationMode.STRUCTURED:
+                structured_reply = await self._arun_structured(pipeline, task, schema)
+                if structured_reply is not None:
+                    validation = self._validate_structured_reply(output_validator, structured_reply, schema)
+                    if validation is not None:
+                        return validation["valid_reply"]
+
+            result = await self._arun_pipeline(pipeline, self._pipeline_data(task, question, schema, schema))
+            attempts = output_validator.iteration_counter
+
+        return self._get_valid_reply(result, attempts)
+
+    @staticmethod
+    def _unwrap_pipeline_error(error: PipelineRuntimeError) -> Exception:
+        # haystack wraps component errors, an expired or cancelled render is reported as such
+        if isinstance(error.__cause__, DeadlineExceededError):
+            return error.__cause__
+        return error
+
+    @classmethod
+    def _run_pipeline(cls, pipeline: Pipeline, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        try:
+            return pipeline.run(data)
+        except PipelineRuntimeError as e:
+            raise cls._unwrap_pipeline_error(e)
+        except PipelineMaxComponentRuns as e:
+            # without a retry budget the pipeline's own run limit ends the retries
+            raise RetryBudgetExceededError(f"No valid answer within the pipeline's run limit: {e}") from e
+
+    @classmethod
+    async def _arun_pipeline(cls, pipeline: AsyncPipeline, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        try:
+            return await pipeline.run_async(data)
+        except PipelineRuntimeError as e:
+            raise cls._unwrap_pipeline_error(e)
+        except PipelineMaxComponentRuns as e:
+            raise RetryBudgetExceededError(f"No valid answer within the pipeline's run limit: {e}") from e
+
+    @staticmethod
+    def _validate_combined_reply(output_validator: OutputValidator,
+                                 reply: typing.Any,
+                                 schemas: typing.Dict[str, dict]) -> typing.Dict[str, typing.Any]:
+        if not isinstance(reply, dict):
+            return {}
+
+        answers = {}
+        for answer_id, schema in schemas.items():
+            if answer_id not in reply:
+                continue
+            validation = output_validator.run(reply[answer_id], schema)
+            if "valid_reply" in validation:
+                answers[answer_id] = validation["valid_reply"]
+        return answers
+
+    def _answer_combined(self,
+                         questions: typing.Dict[str, str],
+                         schemas: typing.Dict[str, dict],
+                         system_prompt: str) -> typing.Dict[str, typing.Any]:
+        combined_schema = {"type": "object", "properties": schemas, "required": list(schemas)}
+        combined_question = _combine_questions(questions)
+        task = self._build_task(system_prompt, combined_question)
+
+        with self.pool.pipeline() as pipeline:
+            output_validator = pipeline.get_component("output_validator")
+            output_validator.reset()
+            reply = None
+            if self.mode is GenerationMode.STRUCTURED:
+                reply = self._run_structured(pipeline, task, combined_schema)
+
+            if reply is None:
+                # the combined reply only has to be an object, every answer is validated against its own schema below
+                result = self._run_pipeline(pipeline, self._pipeline_data(task, combined_question, combined_schema, {"type": "object"}))
+                reply = (result.get("output_validator") or {}).get("valid_reply")
+
+            return self._validate_combined_reply(output_validator, reply, schemas)
+
+    async def _aanswer_combined(self,
+                                questions: typing.Dict[str, str],
+                                schemas: typing.Dict[str, dict],
+                                system_prompt: str) -> typing.Dict[str, typing.Any]:
+        combined_schema = {"type": "object", "properties": schemas, "required": list(schemas)}
+        combined_question = _combine_questions(questions)
+        task = self._build_task(system_prompt, combined_question)
+
+        async with self.pool.async_pipeline() as pipeline:
+            output_validator = pipeline.get_component("output_validator")
+            output_validator.reset()
+            reply = None
+            if self.mode is GenerationMode.STRUCTURED:
+                reply = await self._arun_structured(pipeline, task, combined_schema)
+
+            if reply is None:
+                result = await self._arun_pipeline(pipeline, self._pipeline_data(task, combined_question, combined_schema, {"type": "object"}))
+                reply = (result.get("output_validator") or {}).get("valid_reply")
+
+            return self._validate_combined_reply(output_validator, reply, schemas)
+
+    @staticmethod
+    def _parse_structured_reply(result: typing.Dict[str, typing.Any], wrapped: bool) -> typing.Union[dict, str, list, None]:
+        replies = result.get("replies")
+        if not replies:
+            return None
+
+        try:
+            reply = json.loads(replies[0])
+            return reply[STRUCTURED_OUTPUT_VALUE_KEY] if wrapped else reply
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.debug(f"Invalid structured output reply: {e}")
+            return None
+
+    @classmethod
+    def _run_structured(cls, pipeline: Pipeline, task: str, schema: dict) -> typing.Union[dict, str, list, None]:
+        llm: AnswerGenerator = pipeline.get_component("llm")
+        structured_schema, wrapped = _wrap_structured_output_schema(schema)
+        if not llm.supports_structured_output(structured_schema):
+            return None
+        try:
+            result = llm.run_structured(task, structured_schema)
+        except Exception as e:
+            if not llm.is_schema_error(e):
+                raise
+            logger.warning(f"Structured output schema was rejected, generating the answer in two stages: {e}")
+            return None
+        return cls._parse_structured_reply(result, wrapped)
+
+    @classmethod
+    async def _arun_structured(cls, pipeline: AsyncPipeline, task: str, schema: dict) -> typing.Union[dict, str, list, None]:
+        llm: AnswerGenerator = pipeline.get_component("llm")
+        structured_schema, wrapped = _wrap_structured_output_schema(schema)
+        if not llm.supports_structured_output(structured_schema):
+            return None
+        try:
+            result = await llm.run_structured_async(task, structured_schema)
+        except Exception as e:
+            if not llm.is_schema_error(e):
+                raise
+            logger.warning(f"Structured output schema was rejected, generating the answer in two stages: {e}")
+            return None
+        return cls._parse_structured_reply(result, wrapped)
@@ -2,7 +2,9 @@ import re
 import typing
 
 from haystack import component
-from jinja2 import Template
+
+from .prompts import build_converter_prompt, record_prompt
+from .stats import current_answer_stats
 
 
 def clean_json_string(json_string: str) -> str:
@@ -14,40 +16,30 @@ def clean_json_string(json_string: str) -> str:
 class JsonConverter:
     def __init__(self, generator):
         self.generator = generator
-        self.prompt_template = Template("""
-               Si strokovnjak na področju pretvarjanja teksta v JSON obliko.Spodaj sta navedena vprašanje ter odovor.
-               Tvoja naloga je pretvoriti dani odgovor v veljaven JSON objekt, ki mora biti popolnoma skladen s podano JSON shemo.
-
-               - Upoštevaj strukturo sheme – JSON objekt mora strogo slediti shemi {{ schema | tojson }}. Vsi zahtevani atributi morajo biti prisotni in pravilno oblikovani.
-               - Vrni samo JSON – ne dodajaj uvodnih ali zaključnih oznak (npr. ```json), opisov ali razlag
-               - Primitivne vrednosti – če je shema definirana le s tipom (npr. "type": "string" ali "type": "integer"), vrni samo ustrezno primitivno vrednost in ne JSON objekta.
-
-               {% if invalid_reply and error_message %}  
-               Prejšnji JSON objekt, ki si ga ustvaril, je bil: 
-               **{{ invalid_reply }}**  
-               in ni ustrezal shemi.
-
-               Struktura JSON odgovora je napačna in je povzročila napako: **{{ error_message }}**  
-               Popravi odgovor in poskusi znova. Vrni samo popravljen JSON, brez dodatnih razlag.  
 
-               {% else %}
-               Vprašanje:
-               {{ question }}
-
-               Odgovor:
-               {{ answer }}
-               {% endif %} 
-               """)
+    @staticmethod
+    def _build_prompt(question: str, schema: dict, answer: typing.Optional[str], invalid_reply: typing.Optional[str], error_message: typing.Optional[str]) -> str:
+        stats = current_answer_stats()
+        if stats is not None:
+            stats.converter_calls += 1
+
+        prompt = build_converter_prompt(schema,
+                                        question,
+                                        answer=answer,
+                                        invalid_reply=invalid_reply,
+                                        error_message=error_message)
+        record_prompt(prompt)
+        return prompt.text
+
+    # the answer is only received on the first run, retries get the invalid reply and error message instead
+    @component.output_types(json_str=str)
+    def run(self, question: str, schema: dict, answer: typing.Optional[str] = None, invalid_reply: typing.Optional[str] = None, error_message: typing.Optional[str] = None):
+        run_result = self.generator.run(self._build_prompt(question, schema, answer, invalid_reply, error_message))
+        json_str = run_result.get("replies")[0]
+        return {"json_str": clean_json_string(json_str)}
 
     @component.output_types(json_str=str)
-    def run(self, question: str, answer: str, schema: dict, invalid_reply: typing.Optional[str] = None, error_message: typing.Optional[str] = None):
-        prompt = self.prompt_template.render(
-            schema=schema,
-            question=question,
-            answer=answer,
-            invalid_reply=invalid_reply,
-            error_message=error_message)
-
-        run_result = self.generator.run(prompt)
+    async def run_async(self, question: str, schema: dict, answer: typing.Optional[str] = None, invalid_reply: typing.Optional[str] = None, error_message: typing.Optional[str] = None):
+        run_result = await self.generator.run_async(self._build_prompt(question, schema, answer, invalid_reply, error_message))
         json_str = run_result.get("replies")[0]
         return {"json_str": clean_json_string(json_str)}
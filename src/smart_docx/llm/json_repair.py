@@ -0,0 +1,164 @@
+import ast
+import json
+import re
+import typing
+
+_CODE_FENCE_PATTERN = re.compile(r'```[a-zA-Z0-9_-]*\s*(.*?)\s*```', re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+
+
+def _schema_types(schema: dict) -> typing.Set[str]:
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        return set(schema_type)
+    return {schema_type} if schema_type else set()
+
+
+# only a fence around the whole reply is stripped, a fence inside prose is part of the text
+def strip_code_fences(text: str) -> str:
+    match = _CODE_FENCE_PATTERN.fullmatch(text.strip())
+    return match.group(1).strip() if match else text.strip()
+
+
+def remove_trailing_commas(text: str) -> str:
+    return _TRAILING_COMMA_PATTERN.sub(r'\1', text)
+
+
+def _extract_json_span(text: str) -> str:
+    # drop prose around the first object or array in the text
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else text
+
+
+def parse_lenient(text: str, fixes: typing.List[str]) -> typing.Any:
+    candidate = strip_code_fences(text)
+    if candidate == text.strip():
+        # objects and arrays are often fenced inside an explanation, the prose around them is dropped anyway
+        match = _CODE_FENCE_PATTERN.search(candidate)
+        if match:
+            candidate = match.group(1).strip()
+    if candidate != text.strip():
+        fixes.append("code_fence")
+
+    span = _extract_json_span(candidate)
+    if span != candidate:
+        fixes.append("surrounding_text")
+        candidate = span
+
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+
+    without_trailing_commas = remove_trailing_commas(candidate)
+    if without_trailing_commas != candidate:
+        try:
+            value = json.loads(without_trailing_commas)
+            fixes.append("trailing_comma")
+            return value
+        except json.JSONDecodeError:
+            pass
+
+    # single quotes, True/False/None and trailing commas are valid python literals
+    try:
+        value = ast.literal_eval(candidate)
+        fixes.append("python_literal")
+        return value
+    except (ValueError, SyntaxError, MemoryError, RecursionError) as e:
+        raise ValueError(f"Reply can not be parsed: {e}")
+
+
+def _coerce_str(value: str, types: typing.Set[str], fixes: typing.List[str]) -> typing.Any:
+    text = value.strip()
+    if "integer" in types or "number" in types:
+        try:
+            number = int(text) if text.lstrip("+-").isdigit() else float(text)
+            if "integer" in types and isinstance(number, float) and number.is_integer():
+                number = int(number)
+            fixes.append("string_to_number")
+            return number
+        except ValueError:
+            pass
+
+    if "boolean" in types and text.lower() in ("true", "false"):
+        fixes.append("string_to_boolean")
+        return text.lower() == "true"
+
+    if "null" in types and text.lower() in ("null", "none"):
+        fixes.append("string_to_null")
+        return None
+
+    return value
+
+
+def coerce_to_schema(value: typing.Any, schema: dict, fixes: typing.List[str]) -> typing.Any:
+    if not isinstance(schema, dict):
+        return value
+
+    types = _schema_types(schema)
+
+    # a lone value where an array is expected, unless the schema also accepts the value as it is
+    if "array" in types and value is not None and not isinstance(value, list):
+        if not (isinstance(value, dict) and "object" in types) and not (isinstance(value, str) and "string" in types):
+            fixes.append("wrapped_in_array")
+            value = [value]
+
+    if isinstance(value, list):
+        items = schema.get("items")
+        if isinstance(items, dict):
+            return [coerce_to_schema(item, items, fixes) for item in value]
+        return value
+
+    if isinstance(value, dict):
+        properties = schema.get("properties") or {}
+        return {key: coerce_to_schema(item, properties.get(key, {}), fixes) for key, item in value.items()}
+
+    if isinstance(value, str) and "string" not in types:
+        return _coerce_str(value, types, fixes)
+
+    if isinstance(value, float) and "integer" in types and "number" not in types and value.is_integer():
+        fixes.append("float_to_integer")
+        return int(value)
+
+    return value
+
+
+# a string is only unquoted if the whole reply is a single JSON string literal
+def _unquote(text: str) -> typing.Optional[str]:
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        return None
+    try:
+        unquoted = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return unquoted if isinstance(unquoted, str) else None
+
+
+# applies mechanical, schema guided fixes to an invalid reply, raises ValueError if the reply can not be parsed
+def repair_reply(reply: typing.Any, schema: dict) -> typing.Tuple[typing.Any, typing.List[str]]:
+    fixes = []
+    types = _schema_types(schema)
+
+    if not isinstance(reply, str):
+        return coerce_to_schema(reply, schema, fixes), fixes
+
+    if types & {"object", "array"}:
+        return coerce_to_schema(parse_lenient(reply, fixes), schema, fixes), fixes
+
+    # simple schemas, the reply text is the value itself
+    text = strip_code_fences(reply)
+    if text != reply.strip():
+        fixes.append("code_fence")
+
+    if "string" in types:
+        unquoted = _unquote(text)
+        if unquoted is not None:
+            fixes.append("unquoted_string")
+            return unquoted, fixes
+        return text, fixes
+
+    return coerce_to_schema(_unquote(text) or text, schema, fixes), fixes
@@ -1,11 +1,20 @@
 import ast
 import json
 import logging
+import threading
 import typing
+from collections import OrderedDict
+from dataclasses import dataclass
 from enum import Enum
 
 import jsonschema
 from haystack import component
+from jsonschema.exceptions import best_match
+
+from .answer_cache import schema_fingerprint
+from .budget import current_answer_budget
+from .json_repair import repair_reply
+from .stats import current_answer_stats
 
 logger = logging.getLogger(__name__)
 
@@ -27,38 +36,155 @@ def _determine_schema_type(schema: dict) -> SchemaType:
         return SchemaType.COMPLEX
 
     if "array" in types:
-        items_type = schema.get("items", {}).get("type")
-        if "object" in items_type:
+        items = schema.get("items")
+        items_type = items.get("type") if isinstance(items, dict) else None
+        if items_type is None or "object" in items_type or "array" in items_type:
             return SchemaType.COMPLEX
         return SchemaType.SIMPLE_ARRAY
 
     return SchemaType.SIMPLE
 
 
+@dataclass(frozen=True)
+class CompiledSchema:
+    schema: dict
+    schema_type: SchemaType
+    validator: jsonschema.protocols.Validator
+
+    def validate(self, instance: typing.Any):
+        error = best_match(self.validator.iter_errors(instance))
+        if error is not None:
+            raise error
+
+
+_COMPILED_SCHEMAS_MAX_SIZE = 1024
+_compiled_schemas: typing.OrderedDict[str, CompiledSchema] = OrderedDict()
+_compiled_schemas_lock = threading.Lock()
+
+
+def compile_schema(schema: dict) -> CompiledSchema:
+    fingerprint = schema_fingerprint(schema)
+    with _compiled_schemas_lock:
+        compiled_schema = _compiled_schemas.get(fingerprint)
+        if compiled_schema is not None:
+            _compiled_schemas.move_to_end(fingerprint)
+            return compiled_schema
+
+    # schemas were already checked against the metaschema when the field definitions were loaded
+    validator_class = jsonschema.validators.validator_for(schema, default=jsonschema.Draft7Validator)
+    compiled_schema = CompiledSchema(schema=schema,
+                                     schema_type=_determine_schema_type(schema),
+                                     validator=validator_class(schema))
+
+    with _compiled_schemas_lock:
+        _compiled_schemas[fingerprint] = compiled_schema
+        while len(_compiled_schemas) > _COMPILED_SCHEMAS_MAX_SIZE:
+            _compiled_schemas.popitem(last=False)
+
+    return compiled_schema
+
+
+def _parse_reply(reply: str, schema_type: SchemaType) -> typing.Any:
+    if schema_type is SchemaType.COMPLEX:
+        return json.loads(reply)
+
+    if schema_type is SchemaType.SIMPLE_ARRAY:
+        # json is parsed by the C parser, python literals (e.g. single quoted strings) are a slower fallback
+        try:
+            return json.loads(reply)
+        except json.JSONDecodeError:
+            try:
+                return ast.literal_eval(reply)
+            except SyntaxError as e:
+                raise ValueError(f"Invalid array: {e}")
+
+    return reply
+
+
+def _error_message(error: Exception) -> str:
+    # str() of a validation error includes the whole schema and reply, the LLM only needs what is wrong and where
+    if isinstance(error, jsonschema.ValidationError):
+        return f"{error.message} (at {error.json_path})" if error.path else error.message
+    return str(error)
+
+
 @component
 class OutputValidator:
-    def __init__(self):
+    def __init__(self, repair: bool = True):
         self.iteration_counter = 0
+        self.repair = repair
 
     @component.output_types(valid_reply=typing.Union[dict, str, list], invalid_reply=typing.Optional[str], error_message=typing.Optional[str])
     def run(self, reply: typing.Any, schema: dict):
         self.iteration_counter += 1
-        schema_type = _determine_schema_type(schema)
+        compiled_schema = compile_schema(schema)
+        stats = current_answer_stats()
+        if stats is not None:
+            stats.validations += 1
+
+        if isinstance(reply, str) and compiled_schema.schema_type is SchemaType.SIMPLE:
+            # a quoted or fenced string is still a valid string, so it is cleaned up before it is validated
+            repaired_reply = self._repair(reply, compiled_schema, fixes_required=True)
+            if repaired_reply is not None:
+                return repaired_reply
+
         try:
             parsed_reply = reply
             if isinstance(reply, str):
-                if schema_type is SchemaType.COMPLEX:
-                    parsed_reply = json.loads(reply)
-                elif schema_type is SchemaType.SIMPLE_ARRAY:
-                    parsed_reply = ast.literal_eval(reply)
+                parsed_reply = _parse_reply(reply, compiled_schema.schema_type)
 
-            jsonschema.validate(instance=parsed_reply, schema=schema)
+            compiled_schema.validate(parsed_reply)
             return {"valid_reply": parsed_reply}
 
         except (json.JSONDecodeError, jsonschema.ValidationError, ValueError) as e:
+            # mechanical errors are fixed locally, the LLM is only asked again if that does not help
+            repaired_reply = self._repair(reply, compiled_schema)
+            if repaired_reply is not None:
+                return repaired_reply
+
+            if stats is not None:
+                stats.record_validation_error(e)
+
+            budget = current_answer_budget()
+            if budget is not None and budget.max_retries is not None and self.iteration_counter > budget.max_retries:
+                # no outputs, so the json converter is not run again and the answer fails
+                logger.debug(f"OutputValidator at Iteration {self.iteration_counter}: Retry budget exhausted: {e}")
+                return {}
+
             logger.debug(
                 f"OutputValidator at Iteration {self.iteration_counter}: Invalid response from LLM - Let's try again.\n"
                 f"Output from LLM:\n {reply} \n"
                 f"Error from OutputValidator: {e}"
             )
-            return {"invalid_reply": reply, "error_message": str(e)}
+            return {"invalid_reply": reply, "error_message": _error_message(e)}
+
+    @component.output_types(valid_reply=typing.Union[dict, str, list], invalid_reply=typing.Optional[str], error_message=typing.Optional[str])
+    async def run_async(self, reply: typing.Any, schema: dict):
+        # validation is cheap and has to see the stats and budget of the caller, so it runs on the event loop
+        return self.run(reply, schema)
+
+    def reset(self):
+        # the validator is reused by pooled pipelines, iterations are counted per answer
+        self.iteration_counter = 0
+
+    def _repair(self,
+                reply: typing.Any,
+                compiled_schema: CompiledSchema,
+                fixes_required: bool = False) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        if not self.repair:
+            return None
+
+        try:
+            repaired_reply, fixes = repair_reply(reply, compiled_schema.schema)
+            compiled_schema.validate(repaired_reply)
+        except (jsonschema.ValidationError, ValueError) as e:
+            logger.debug(f"OutputValidator at Iteration {self.iteration_counter}: Local repair failed: {e}")
+            return None
+        if fixes_required and not fixes:
+            return None
+
+        stats = current_answer_stats()
+        if stats is not None and fixes:
+            stats.record_repair(fixes)
+        logger.debug(f"OutputValidator at Iteration {self.iteration_counter}: Repaired reply locally, fixes: {', '.join(fixes)}")
+        return {"valid_reply": repaired_reply}
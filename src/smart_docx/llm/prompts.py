@@ -0,0 +1,180 @@
+import json
+import logging
+import typing
+from dataclasses import dataclass
+
+from .scheduler import estimate_tokens
+from .stats import current_answer_stats
+
+logger = logging.getLogger(__name__)
+
+# label right before the schema in json converter prompts
+CONVERTER_SCHEMA_LABEL = "JSON shema: "
+
+# keywords which only document a schema, they don't help the LLM to produce a valid reply
+_DOCUMENTATION_KEYWORDS = {"$schema", "$id", "$comment", "title", "examples"}
+# keywords whose values are schemas, lists of schemas or mappings of names to schemas
+_SCHEMA_KEYWORDS = {"items", "additionalProperties", "additionalItems", "not", "if", "then", "else", "contains",
+                    "propertyNames", "unevaluatedItems", "unevaluatedProperties"}
+_SCHEMA_LIST_KEYWORDS = {"anyOf", "oneOf", "allOf", "prefixItems"}
+_SCHEMA_MAP_KEYWORDS = {"properties", "patternProperties", "$defs", "definitions", "dependentSchemas"}
+
+# repeated sub-schemas shorter than this are left in place, a $ref would not be much shorter
+_MIN_REF_LENGTH = 40
+_REF_DEFINITIONS = "$defs"
+
+_CONVERTER_INSTRUCTIONS = (
+    "Si strokovnjak na področju pretvarjanja teksta v JSON obliko. "
+    "Tvoja naloga je pretvoriti dani odgovor v veljaven JSON, ki je popolnoma skladen s spodnjo JSON shemo.\n"
+    "- Vsi zahtevani atributi morajo biti prisotni in pravilno oblikovani.\n"
+    "- Vrni samo JSON – ne dodajaj uvodnih ali zaključnih oznak (npr. ```json), opisov ali razlag.\n"
+    "- Primitivne vrednosti – če je shema definirana le s tipom (npr. \"type\": \"string\" ali \"type\": \"integer\"), "
+    "vrni samo ustrezno primitivno vrednost in ne JSON objekta.\n"
+)
+
+
+@dataclass(frozen=True)
+class Prompt:
+    prefix: str  # static part, consecutive prompts share it, so providers can reuse a cached prefix
+    suffix: str  # the part that changes with every prompt
+
+    @property
+    def text(self) -> str:
+        if not self.prefix:
+            return self.suffix
+        return f"{self.prefix}\n\n{self.suffix}"
+
+    @property
+    def estimated_tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+    @property
+    def prefix_tokens(self) -> int:
+        return estimate_tokens(self.prefix) if self.prefix else 0
+
+
+def to_compact_json(value: typing.Any) -> str:
+    # no whitespace and no escaped non ascii characters, both only cost tokens
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _strip_documentation(schema: typing.Any, name: typing.Optional[str] = None) -> typing.Any:
+    if not isinstance(schema, dict):
+        return schema
+
+    minified = {}
+    for keyword, value in schema.items():
+        if keyword in _DOCUMENTATION_KEYWORDS:
+            continue
+        if keyword == "description":
+            # descriptions that are empty or only repeat the property name don't tell the LLM anything
+            if not isinstance(value, str) or not value.strip() or (name and value.strip().lower() == name.lower()):
+                continue
+            minified[keyword] = value
+        elif keyword in _SCHEMA_KEYWORDS:
+            minified[keyword] = _strip_documentation(value)
+        elif keyword in _SCHEMA_LIST_KEYWORDS and isinstance(value, list):
+            minified[keyword] = [_strip_documentation(sub_schema) for sub_schema in value]
+        elif keyword in _SCHEMA_MAP_KEYWORDS and isinstance(value, dict):
+            minified[keyword] = {sub_name: _strip_documentation(sub_schema, sub_name) for sub_name, sub_schema in value.items()}
+        else:
+            minified[keyword] = value
+    return minified
+
+
+def _sub_schemas(schema: dict) -> typing.Iterator[typing.Tuple[typing.Union[dict, list], typing.Union[str, int]]]:
+    # (container, key) of every schema directly nested in the given one
+    for keyword, value in schema.items():
+        if keyword in _SCHEMA_KEYWORDS and isinstance(value, dict):
+            yield schema, keyword
+        elif keyword in _SCHEMA_LIST_KEYWORDS and isinstance(value, list):
+            yield from ((value, index) for index, sub_schema in enumerate(value) if isinstance(sub_schema, dict))
+        elif keyword in _SCHEMA_MAP_KEYWORDS and isinstance(value, dict):
+            yield from ((value, name) for name, sub_schema in value.items() if isinstance(sub_schema, dict))
+
+
+def _count_sub_schemas(schema: dict, counts: typing.Dict[str, int]):
+    for container, key in _sub_schemas(schema):
+        encoded = to_compact_json(container[key])
+        counts[encoded] = counts.get(encoded, 0) + 1
+        _count_sub_schemas(container[key], counts)
+
+
+def _replace_sub_schemas(schema: dict, encoded: str, ref: str):
+    for container, key in list(_sub_schemas(schema)):
+        if to_compact_json(container[key]) == encoded:
+            container[key] = {"$ref": ref}
+        else:
+            _replace_sub_schemas(container[key], encoded, ref)
+
+
+def _reference_repeated(schema: dict) -> dict:
+    schema = json.loads(to_compact_json(schema))
+    existing_names = set(schema.get(_REF_DEFINITIONS) or {})
+    definitions: typing.Dict[str, dict] = {}
+
+    # the longest repeated schema is moved to the definitions first, so it is referenced as a whole
+    # instead of its repeated parts, then the remaining schemas are counted again
+    while True:
+        counts: typing.Dict[str, int] = {}
+        for counted_schema in [schema, *definitions.values()]:
+            _count_sub_schemas(counted_schema, counts)
+        repeated = [encoded for encoded, count in counts.items() if count > 1 and len(encoded) >= _MIN_REF_LENGTH]
+        if not repeated:
+            break
+
+        encoded = max(repeated, key=len)
+        name = f"s{len(definitions)}"
+        while name in existing_names:
+            name = f"_{name}"
+        ref = f"#/{_REF_DEFINITIONS}/{name}"
+        for replaced_schema in [schema, *definitions.values()]:
+            _replace_sub_schemas(replaced_schema, encoded, ref)
+        definitions[name] = json.loads(encoded)
+
+    if definitions:
+        schema[_REF_DEFINITIONS] = {**(schema.get(_REF_DEFINITIONS) or {}), **definitions}
+    return schema
+
+
+def minify_schema(schema: dict) -> dict:
+    # only used in prompts, replies are still validated against the original schema
+    return _reference_repeated(_strip_documentation(schema))
+
+
+def build_answer_prompt(system_prompt: str, question: str) -> Prompt:
+    # the system prompt is shared by all fields of a template, so it goes first
+    return Prompt(prefix=system_prompt.strip(), suffix=question)
+
+
+def build_chunk_question(question: str, start: int, end: int, max_items: typing.Optional[int] = None) -> str:
+    # positions are counted from 1 in the whole list, so pages requested separately fit together
+    length_hint = f" Celoten seznam ima največ {max_items} elementov." if max_items is not None else ""
+    return (f"{question}\n\nVrni samo elemente od {start + 1}. do {end}. celotnega seznama.{length_hint} "
+            f"Če ima seznam manj elementov, vrni samo preostale elemente ali prazen seznam.")
+
+
+def build_converter_prompt(schema: dict,
+                           question: str,
+                           answer: typing.Optional[str] = None,
+                           invalid_reply: typing.Optional[str] = None,
+                           error_message: typing.Optional[str] = None) -> Prompt:
+    # instructions are shared by every conversion and the schema by every retry of the same field,
+    # retries only add the invalid reply and its error instead of repeating the question and answer
+    prefix = f"{_CONVERTER_INSTRUCTIONS}\n{CONVERTER_SCHEMA_LABEL}{to_compact_json(minify_schema(schema))}"
+    if invalid_reply is not None and error_message:
+        suffix = (f"Prejšnji JSON, ki si ga ustvaril, ni ustrezal shemi:\n{invalid_reply}\n\n"
+                  f"Napaka: {error_message}\n"
+                  f"Popravi odgovor in vrni samo popravljen JSON, brez dodatnih razlag.")
+    else:
+        suffix = f"Vprašanje:\n{question}\n\nOdgovor:\n{answer}"
+    return Prompt(prefix=prefix, suffix=suffix)
+
+
+def record_prompt(prompt: Prompt):
+    estimated_tokens = prompt.estimated_tokens
+    prefix_tokens = prompt.prefix_tokens
+    stats = current_answer_stats()
+    if stats is not None:
+        stats.record_prompt(estimated_tokens=estimated_tokens, prefix_tokens=prefix_tokens)
+    logger.debug(f"Prompt with ~{estimated_tokens} tokens, ~{prefix_tokens} of them in the static prefix")
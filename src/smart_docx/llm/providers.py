@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import typing
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# provider packages are heavy, they are only imported once a provider is actually used
+
+# keywords which only constrain values, they are dropped for gemini and checked by the output validator instead
+_GEMINI_IGNORED_KEYWORDS = {
+    "$schema", "$id", "$comment", "title", "default", "examples", "format", "additionalProperties",
+    "minLength", "maxLength", "pattern", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum",
+    "multipleOf", "uniqueItems", "minProperties", "maxProperties",
+}
+
+
+def _to_gemini_schema(schema: dict) -> typing.Optional[dict]:
+    gemini_schema = {}
+    for keyword, value in schema.items():
+        if keyword in _GEMINI_IGNORED_KEYWORDS:
+            continue
+
+        if keyword == "type":
+            types = value if isinstance(value, list) else [value]
+            non_null_types = [t for t in types if t != "null"]
+            if len(non_null_types) != 1:
+                return None
+            gemini_schema["type"] = non_null_types[0]
+            if len(non_null_types) != len(types):
+                gemini_schema["nullable"] = True
+        elif keyword in ("description", "enum", "required"):
+            gemini_schema[keyword] = value
+        elif keyword in ("minItems", "maxItems"):
+            gemini_schema["min_items" if keyword == "minItems" else "max_items"] = value
+        elif keyword == "items" and isinstance(value, dict):
+            items = _to_gemini_schema(value)
+            if items is None:
+                return None
+            gemini_schema["items"] = items
+        elif keyword == "properties":
+            properties = {name: _to_gemini_schema(property_schema) for name, property_schema in value.items()}
+            if any(property_schema is None for property_schema in properties.values()):
+                return None
+            gemini_schema["properties"] = properties
+        else:
+            # $ref, anyOf, oneOf, allOf, ... can not be expressed in a gemini response schema
+            return None
+
+    if "type" not in gemini_schema:
+        return None
+    if gemini_schema["type"] == "object" and not gemini_schema.get("properties"):
+        # gemini rejects objects without properties, free form objects are generated in two stages
+        return None
+
+    return gemini_schema
+
+
+class Provider:
+    name: str = "generic"
+    env_var: typing.Optional[str] = None  # the provider is selected automatically if this variable is set
+    # module and name of the generator class, so generators are recognised without importing the module
+    generator_class: typing.Optional[typing.Tuple[str, str]] = None
+
+    def create(self, api_key: str) -> typing.Any:
+        raise ValueError(f"Provider {self.name} can not be created from an API key")
+
+    def is_provider_of(self, generator: typing.Any) -> bool:
+        if self.generator_class is None:
+            return False
+        module_name, class_name = self.generator_class
+        # if the module was never imported, the generator can't be an instance of its class
+        module = sys.modules.get(module_name)
+        generator_class = getattr(module, class_name, None) if module else None
+        return generator_class is not None and isinstance(generator, generator_class)
+
+    # any other generator (e.g. a fake one used for benchmarks) is called with the prompt
+    def run(self, generator: typing.Any, prompt: str) -> typing.Dict[str, typing.Any]:
+        return generator.run(prompt=prompt)
+
+    def supports_structured_output(self, generator: typing.Any, schema: dict) -> bool:
+        if hasattr(generator, "run_structured") and hasattr(generator, "supports_structured_output"):
+            return generator.supports_structured_output(schema)
+        return False
+
+    def run_structured(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        if self.supports_structured_output(generator, schema):
+            return generator.run_structured(prompt=prompt, schema=schema)
+        raise ValueError(f"Structured output is not supported by {type(generator).__name__}")
+
+    def is_schema_error(self, generator: typing.Any, error: Exception) -> bool:
+        # the provider rejected the structured output schema, the answer can still be generated in two stages
+        if hasattr(generator, "is_schema_error"):
+            return generator.is_schema_error(error)
+        return False
+
+    async def run_async(self, generator: typing.Any, prompt: str) -> typing.Dict[str, typing.Any]:
+        if hasattr(generator, "run_async"):
+            return await generator.run_async(prompt=prompt)
+        # blocking clients are called in a worker thread, with the caller's context
+        return await asyncio.to_thread(self.run, generator, prompt)
+
+    async def run_structured_async(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        if hasattr(generator, "run_structured_async") and self.supports_structured_output(generator, schema):
+            return await generator.run_structured_async(prompt=prompt, schema=schema)
+        return await asyncio.to_thread(self.run_structured, generator, prompt, schema)
+
+    def model(self, generator: typing.Any) -> str:
+        return getattr(generator, "model", type(generator).__name__)
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    env_var = "OPENAI_API_TOKEN"
+    generator_class = ("haystack.components.generators.openai", "OpenAIGenerator")
+
+    def create(self, api_key: str) -> typing.Any:
+        from haystack.components.generators import OpenAIGenerator
+        from haystack.utils import Secret
+
+        return OpenAIGenerator(api_key=Secret.from_token(api_key), model="gpt-4o")
+
+    def supports_structured_output(self, generator: typing.Any, schema: dict) -> bool:
+        return True
+
+    def is_schema_error(self, generator: typing.Any, error: Exception) -> bool:
+        # openai is imported once its generator was created
+        openai = sys.modules.get("openai")
+        return openai is not None and isinstance(error, openai.BadRequestError)
+
+    @staticmethod
+    def _response_format(schema: dict) -> typing.Dict[str, typing.Any]:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "answer", "schema": schema, "strict": False}
+        }
+
+    def run_structured(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        return generator.run(prompt=prompt, generation_kwargs={"response_format": self._response_format(schema)})
+
+    def _async_client(self, generator: typing.Any) -> typing.Any:
+        # created once per generator, with the settings of its blocking client
+        client = getattr(generator, "_smart_docx_async_client", None)
+        if client is None:
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(api_key=generator.client.api_key,
+                                 organization=generator.client.organization,
+                                 base_url=generator.client.base_url,
+                                 timeout=generator.client.timeout,
+                                 max_retries=generator.client.max_retries)
+            generator._smart_docx_async_client = client
+        return client
+
+    async def _run_async(self,
+                         generator: typing.Any,
+                         prompt: str,
+                         generation_kwargs: typing.Optional[typing.Dict[str, typing.Any]] = None) -> typing.Dict[str, typing.Any]:
+        # the same request OpenAIGenerator.run makes, with the async client
+        messages = [{"role": "user", "content": prompt}]
+        if generator.system_prompt:
+            messages.insert(0, {"role": "system", "content": generator.system_prompt})
+        completion = await self._async_client(generator).chat.completions.create(
+            model=generator.model,
+            messages=messages,
+            **{**generator.generation_kwargs, **(generation_kwargs or {})},
+        )
+
+        # replies and meta are built like OpenAIGenerator builds them
+        usage = completion.usage.model_dump() if completion.usage else {}
+        meta = [{"model": completion.model, "index": choice.index, "finish_reason": choice.finish_reason, "usage": usage}
+                for choice in completion.choices]
+        for choice in completion.choices:
+            if choice.finish_reason in ("length", "content_filter"):
+                logger.warning(f"Completion {choice.index} was stopped early, finish reason: {choice.finish_reason}")
+        return {"replies": [choice.message.content or "" for choice in completion.choices], "meta": meta}
+
+    async def run_async(self, generator: typing.Any, prompt: str) -> typing.Dict[str, typing.Any]:
+        return await self._run_async(generator, prompt)
+
+    async def run_structured_async(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        return await self._run_async(generator, prompt, {"response_format": self._response_format(schema)})
+
+    def model(self, generator: typing.Any) -> str:
+        return generator.model
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    env_var = "GOOGLE_API_KEY"
+    generator_class = ("haystack_integrations.components.generators.google_ai.gemini", "GoogleAIGeminiGenerator")
+
+    def create(self, api_key: str) -> typing.Any:
+        from haystack.utils import Secret
+        from haystack_integrations.components.generators.google_ai import GoogleAIGeminiGenerator
+
+        return GoogleAIGeminiGenerator(api_key=Secret.from_token(api_key), model="gemini-2.0-flash")
+
+    def run(self, generator: typing.Any, prompt: str) -> typing.Dict[str, typing.Any]:
+        if generator.streaming_callback is not None:
+            return generator.run(parts=[prompt])
+        # the generator's own run drops the usage metadata, the sdk is called directly so it is counted
+        response = self._model(generator).generate_content(**self._request(generator, prompt))
+        return self._result(response)
+
+    def supports_structured_output(self, generator: typing.Any, schema: dict) -> bool:
+        return _to_gemini_schema(schema) is not None
+
+    def is_schema_error(self, generator: typing.Any, error: Exception) -> bool:
+        exceptions = sys.modules.get("google.api_core.exceptions")
+        if exceptions is not None and isinstance(error, exceptions.InvalidArgument):
+            return True
+        # the sdk converts the response schema before the request is sent, unsupported schemas fail there
+        return isinstance(error, (ValueError, TypeError))
+
+    @staticmethod
+    def _model(generator: typing.Any) -> typing.Any:
+        # the generator configures the api key for the whole module, the sdk model is created once per generator
+        model = getattr(generator, "_smart_docx_model", None)
+        if model is None:
+            from google.generativeai import GenerativeModel
+
+            model = GenerativeModel(generator.model_name)
+            generator._smart_docx_model = model
+        return model
+
+    @staticmethod
+    def _request(generator: typing.Any, prompt: str, schema: typing.Optional[dict] = None) -> typing.Dict[str, typing.Any]:
+        from google.generativeai import GenerationConfig
+
+        generation_config = generator.generation_config
+        if schema is not None:
+            generation_config = GenerationConfig(response_mime_type="application/json",
+                                                 response_schema=_to_gemini_schema(schema))
+        return {"contents": prompt,
+                "generation_config": generation_config,
+                "safety_settings": generator.safety_settings}
+
+    @staticmethod
+    def _result(response: typing.Any) -> typing.Dict[str, typing.Any]:
+        # the text parts of every candidate, as GoogleAIGeminiGenerator returns them
+        replies = [part.text for candidate in response.candidates for part in candidate.content.parts if part.text]
+        # usage is reported like openai does, so it is counted the same way
+        usage = response.usage_metadata
+        meta = [{"usage": {"prompt_tokens": usage.prompt_token_count,
+                           "completion_tokens": usage.candidates_token_count}}] if usage else []
+        return {"replies": replies, "meta": meta}
+
+    def run_structured(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        response = self._model(generator).generate_content(**self._request(generator, prompt, schema))
+        return self._result(response)
+
+    async def run_async(self, generator: typing.Any, prompt: str) -> typing.Dict[str, typing.Any]:
+        response = await self._model(generator).generate_content_async(**self._request(generator, prompt))
+        return self._result(response)
+
+    async def run_structured_async(self, generator: typing.Any, prompt: str, schema: dict) -> typing.Dict[str, typing.Any]:
+        response = await self._model(generator).generate_content_async(**self._request(generator, prompt, schema))
+        return self._result(response)
+
+    def model(self, generator: typing.Any) -> str:
+        return generator.model_name
+
+
+_generic_provider = Provider()
+_providers: typing.OrderedDict[str, Provider] = OrderedDict()
+_providers_lock = threading.Lock()
+
+
+def register_provider(provider: Provider):
+    # providers are selected from environment variables in registration order
+    with _providers_lock:
+        _providers[provider.name] = provider
+
+
+def get_provider(name: str) -> Provider:
+    with _providers_lock:
+        provider = _providers.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    return provider
+
+
+def provider_for(generator: typing.Any) -> Provider:
+    with _providers_lock:
+        providers = list(_providers.values())
+    return next((provider for provider in providers if provider.is_provider_of(generator)), _generic_provider)
+
+
+def create_llm(provider_name: typing.Optional[str] = None) -> typing.Any:
+    if provider_name is not None:
+        provider = get_provider(provider_name)
+        api_key = os.getenv(provider.env_var) if provider.env_var else None
+        if not api_key:
+            raise ValueError(f"No API key found in environment variable {provider.env_var} for provider {provider_name}.")
+        return provider.create(api_key)
+
+    with _providers_lock:
+        providers = list(_providers.values())
+
+    for provider in providers:
+        api_key = os.getenv(provider.env_var) if provider.env_var else None
+        if api_key:
+            return provider.create(api_key)
+
+    raise ValueError("No valid API key found in environment variables.")
+
+
+register_provider(OpenAIProvider())
+register_provider(GeminiProvider())
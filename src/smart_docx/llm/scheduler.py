@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import typing
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .budget import current_answer_budget
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+_RATE_LIMIT_ERROR_NAMES = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+
+# waiting callers check their render deadline at least this often, cancelling a deadline does not wake them up
+_BUDGET_CHECK_INTERVAL = 0.5
+
+_current_queue_key: ContextVar[typing.Optional[typing.Hashable]] = ContextVar("smart_docx_scheduler_queue", default=None)
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token, good enough to pace requests before the provider reports real usage
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    # checked by name and status code, so provider packages don't have to be imported
+    if type(error).__name__ in _RATE_LIMIT_ERROR_NAMES:
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status_code == 429
+
+
+@contextmanager
+def scheduler_queue(key: typing.Hashable) -> typing.Iterator[None]:
+    # calls made within the context share a queue, queues are served round robin
+    token = _current_queue_key.set(key)
+    try:
+        yield
+    finally:
+        _current_queue_key.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: typing.Optional[float] = None):
+        if per_minute <= 0:
+            raise ValueError("per_minute must be positive")
+
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until_available(self, amount: float) -> float:
+        self._refill()
+        # requests larger than the bucket only wait for a full bucket
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        # negative refunds are debt, e.g. when a request used more tokens than estimated
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMScheduler:
+    def __init__(self,
+                 requests_per_minute: typing.Optional[float] = None,
+                 tokens_per_minute: typing.Optional[float] = None,
+                 max_in_flight: int = 16,
+                 max_retries: int = 5,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 60.0):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._queues: typing.OrderedDict[typing.Hashable, typing.Deque[object]] = OrderedDict()
+        self._condition = threading.Condition()
+        # async callers can't wait on the condition without blocking their event loop, they wait on an event instead
+        self._async_waiters: typing.Set[typing.Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def _notify_all(self):
+        # called with the condition held, whenever a waiting call may be able to start
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop was closed, its waiter is removed once the waiting task is cancelled
+                pass
+
+    def _time_until_ready(self, estimated_tokens: int) -> float:
+        wait = self._paused_until - time.monotonic()
+        if self.requests is not None:
+            wait = max(wait, self.requests.time_until_available(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until_available(estimated_tokens))
+        return wait
+
+    def _next_ticket(self) -> typing.Optional[object]:
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _remove_ticket(self, key: typing.Hashable, ticket: object):
+        queue = self._queues.get(key)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if queue:
+            # the queue was served, other queues go first next time
+            self._queues.move_to_end(key)
+        else:
+            del self._queues[key]
+
+    def _time_until_turn(self, ticket: object, estimated_tokens: int) -> typing.Optional[float]:
+        # 0 once the call may start, None while it waits for other calls to start or finish
+        if self._next_ticket() is not ticket or self.in_flight >= self.max_in_flight:
+            return None
+        return max(0.0, self._time_until_ready(estimated_tokens))
+
+    def _start(self, estimated_tokens: int):
+        self.in_flight += 1
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(estimated_tokens)
+
+    def _acquire(self, key: typing.Hashable, estimated_tokens: int):
+        ticket = object()
+        budget = current_answer_budget()
+        with self._condition:
+            self._queues.setdefault(key, deque()).append(ticket)
+            try:
+                while True:
+                    max_wait = None
+                    if budget is not None:
+                        budget.check()
+                        max_wait = _BUDGET_CHECK_INTERVAL
+                    wait = self._time_until_turn(ticket, estimated_tokens)
+                    if wait == 0:
+                        break
+                    if wait is not None and max_wait is not None:
+                        wait = min(wait, max_wait)
+                    self._condition.wait(wait if wait is not None else max_wait)
+            finally:
+                self._remove_ticket(key, ticket)
+                self._notify_all()
+
+            self._start(estimated_tokens)
+
+    async def _aacquire(self, key: typing.Hashable, estimated_tokens: int):
+        ticket = object()
+        budget = current_answer_budget()
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            self._queues.setdefault(key, deque()).append(ticket)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                if budget is not None:
+                    budget.check()
+                with self._condition:
+                    wait = self._time_until_turn(ticket, estimated_tokens)
+                    if wait == 0:
+                        self._start(estimated_tokens)
+                        return
+                    # cleared with the condition held, so a release after this check still wakes the caller
+                    waiter[1].clear()
+
+                # woken by releases, or once the rate limits allow the call to start
+                if budget is not None:
+                    wait = _BUDGET_CHECK_INTERVAL if wait is None else min(wait, _BUDGET_CHECK_INTERVAL)
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+                self._remove_ticket(key, ticket)
+                self._notify_all()
+
+    def _release(self, estimated_tokens: int, used_tokens: typing.Optional[int]):
+        with self._condition:
+            self.in_flight -= 1
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.refund(estimated_tokens - used_tokens)
+            self._notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter, so callers that were limited together don't retry together
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        with self._condition:
+            # every caller waits, not only the one that was limited
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._notify_all()
+        return delay
+
+    def call(self,
+             fn: typing.Callable[[], T],
+             estimated_tokens: int = 0,
+             count_tokens: typing.Optional[typing.Callable[[T], typing.Optional[int]]] = None) -> T:
+        key = _current_queue_key.get()
+        if key is None:
+            key = threading.get_ident()
+
+        attempt = 0
+        while True:
+            self._acquire(key, estimated_tokens)
+            used_tokens = None
+            try:
+                result = fn()
+                used_tokens = count_tokens(result) if count_tokens else None
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.debug(f"Rate limited by the provider, retrying in {delay:.2f}s (attempt {attempt + 1}): {e}")
+                attempt += 1
+            finally:
+                self._release(estimated_tokens, used_tokens)
+
+    async def acall(self,
+                    fn: typing.Callable[[], typing.Awaitable[T]],
+                    estimated_tokens: int = 0,
+                    count_tokens: typing.Optional[typing.Callable[[T], typing.Optional[int]]] = None) -> T:
+        # same as call, for coroutines, sync and async callers share the queues and limits
+        key = _current_queue_key.get()
+        if key is None:
+            key = id(asyncio.current_task())
+
+        attempt = 0
+        while True:
+            await self._aacquire(key, estimated_tokens)
+            used_tokens = None
+            try:
+                result = await fn()
+                used_tokens = count_tokens(result) if count_tokens else None
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.debug(f"Rate limited by the provider, retrying in {delay:.2f}s (attempt {attempt + 1}): {e}")
+                attempt += 1
+            finally:
+                self._release(estimated_tokens, used_tokens)
+
+
+_default_schedulers: typing.Dict[str, LLMScheduler] = {}
+_default_schedulers_lock = threading.Lock()
+
+
+def get_default_scheduler(provider: str) -> LLMScheduler:
+    # one scheduler per provider, shared by every pipeline pool talking to it
+    with _default_schedulers_lock:
+        scheduler = _default_schedulers.get(provider)
+        if scheduler is None:
+            scheduler = _default_schedulers[provider] = LLMScheduler()
+        return scheduler
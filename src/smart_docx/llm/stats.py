@@ -0,0 +1,63 @@
+import typing
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+
+@dataclass
+class AnswerStats:
+    validations: int = 0
+    validation_failures: int = 0
+    validation_errors: typing.Dict[str, int] = field(default_factory=dict)  # error class name -> failures
+    repairs: int = 0  # replies which were fixed locally instead of asking the LLM again
+    repair_fixes: typing.Dict[str, int] = field(default_factory=dict)  # fix name -> replies it was applied to
+    llm_calls: int = 0  # every call to the answer generator, including the ones made by the json converter
+    converter_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    prompts: int = 0
+    # estimated from the prompt text, so prompt changes can be compared without calling a provider
+    estimated_prompt_tokens: int = 0
+    estimated_prefix_tokens: int = 0  # static prompt prefixes, which providers can serve from their prompt cache
+
+    def record_validation_error(self, error: Exception):
+        self.validation_failures += 1
+        error_class = type(error).__name__
+        self.validation_errors[error_class] = self.validation_errors.get(error_class, 0) + 1
+
+    def record_repair(self, fixes: typing.List[str]):
+        self.repairs += 1
+        for fix in set(fixes):
+            self.repair_fixes[fix] = self.repair_fixes.get(fix, 0) + 1
+
+    def record_llm_call(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.llm_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def record_prompt(self, estimated_tokens: int, prefix_tokens: int = 0):
+        self.prompts += 1
+        self.estimated_prompt_tokens += estimated_tokens
+        self.estimated_prefix_tokens += prefix_tokens
+
+    @property
+    def retries(self) -> int:
+        # every reply that fails validation is followed by another attempt
+        return self.validation_failures
+
+
+_current_answer_stats: ContextVar[typing.Optional[AnswerStats]] = ContextVar("smart_docx_answer_stats", default=None)
+
+
+def current_answer_stats() -> typing.Optional[AnswerStats]:
+    return _current_answer_stats.get()
+
+
+@contextmanager
+def collect_answer_stats() -> typing.Iterator[AnswerStats]:
+    stats = AnswerStats()
+    token = _current_answer_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_answer_stats.reset(token)
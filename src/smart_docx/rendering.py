@@ -0,0 +1,84 @@
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import typing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from docxtpl import DocxTemplate
+
+from .templates.cache import CachedTemplate, TemplateCache
+
+_WORKER_TEMPLATES_MAX_SIZE = 32
+
+# parsed templates of a worker process, every template is read and parsed once per worker
+_worker_templates: typing.OrderedDict[str, CachedTemplate] = OrderedDict()
+
+
+def _render_in_worker(digest: str, template_path: str, context: typing.Dict[str, typing.Any]) -> bytes:
+    template = _worker_templates.get(digest)
+    if template is None:
+        template = TemplateCache(max_size=1).get(template_path)
+        _worker_templates[digest] = template
+        while len(_worker_templates) > _WORKER_TEMPLATES_MAX_SIZE:
+            _worker_templates.popitem(last=False)
+    else:
+        _worker_templates.move_to_end(digest)
+
+    docx = template.render_docx(context)
+    output = io.BytesIO()
+    docx.save(output)
+    return output.getvalue()
+
+
+def load_rendered_docx(content: bytes) -> DocxTemplate:
+    docx = DocxTemplate(io.BytesIO(content))
+    docx.init_docx()
+    # the content is already rendered, so it can be saved as it is
+    docx.is_rendered = True
+    return docx
+
+
+def write_docx_content(content: bytes, filename: typing.Union[typing.IO[bytes], str, os.PathLike]):
+    if hasattr(filename, "write"):
+        filename.write(content)
+        return
+
+    with open(filename, "wb") as file:
+        file.write(content)
+
+
+class ProcessPoolDocxRenderer:
+    def __init__(self, max_workers: typing.Optional[int] = None, mp_context: str = "spawn"):
+        # threads waiting on LLM replies are not blocked while templates are rendered in other processes,
+        # spawn is the default since forking a process with running threads is not safe
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(mp_context))
+        self._directory = tempfile.mkdtemp(prefix="smart-docx-templates-")
+        self._lock = threading.Lock()
+
+    def _template_path(self, template: CachedTemplate) -> str:
+        # template bytes are shared with workers through a file, so they are not sent with every render
+        path = os.path.join(self._directory, f"{template.digest}.docx")
+        with self._lock:
+            if not os.path.exists(path):
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as file:
+                    file.write(template.content)
+                os.replace(tmp_path, path)
+        return path
+
+    def render(self, template: CachedTemplate, context: typing.Dict[str, typing.Any]) -> bytes:
+        return self._executor.submit(_render_in_worker, template.digest, self._template_path(template), context).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self) -> "ProcessPoolDocxRenderer":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
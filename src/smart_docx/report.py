@@ -0,0 +1,104 @@
+import typing
+from dataclasses import dataclass, field, asdict
+
+from .llm.stats import AnswerStats
+from .templates.fields_generation import FieldEvent
+
+
+@dataclass
+class FieldReport:
+    id: str
+    elapsed: float  # seconds, shared by all fields of a batch
+    reused: bool
+    stats: AnswerStats  # shared by all fields of a batch
+
+    @classmethod
+    def from_event(cls, event: FieldEvent) -> "FieldReport":
+        return cls(id=event.id, elapsed=event.elapsed, reused=event.reused, stats=event.stats or AnswerStats())
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {"id": self.id, "elapsed": self.elapsed, "reused": self.reused, "retries": self.stats.retries, **asdict(self.stats)}
+
+
+@dataclass
+class RenderReport:
+    fields: typing.List[FieldReport] = field(default_factory=list)
+    template_validation_time: float = 0.0  # loading the template and validating it against the definition and inputs
+    generation_time: float = 0.0
+    docx_render_time: float = 0.0
+    total_time: float = 0.0
+
+    def _unique_stats(self) -> typing.List[AnswerStats]:
+        # fields generated in one batch share their stats, they are only counted once
+        unique_stats = {id(field_report.stats): field_report.stats for field_report in self.fields}
+        return list(unique_stats.values())
+
+    @property
+    def llm_calls(self) -> int:
+        return sum(stats.llm_calls for stats in self._unique_stats())
+
+    @property
+    def converter_calls(self) -> int:
+        return sum(stats.converter_calls for stats in self._unique_stats())
+
+    @property
+    def validation_failures(self) -> int:
+        return sum(stats.validation_failures for stats in self._unique_stats())
+
+    @property
+    def validation_errors(self) -> typing.Dict[str, int]:
+        validation_errors = {}
+        for stats in self._unique_stats():
+            for error_class, count in stats.validation_errors.items():
+                validation_errors[error_class] = validation_errors.get(error_class, 0) + count
+        return validation_errors
+
+    @property
+    def repairs(self) -> int:
+        return sum(stats.repairs for stats in self._unique_stats())
+
+    @property
+    def repair_fixes(self) -> typing.Dict[str, int]:
+        repair_fixes = {}
+        for stats in self._unique_stats():
+            for fix, count in stats.repair_fixes.items():
+                repair_fixes[fix] = repair_fixes.get(fix, 0) + count
+        return repair_fixes
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(stats.prompt_tokens for stats in self._unique_stats())
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(stats.completion_tokens for stats in self._unique_stats())
+
+    @property
+    def estimated_prompt_tokens(self) -> int:
+        return sum(stats.estimated_prompt_tokens for stats in self._unique_stats())
+
+    @property
+    def estimated_prefix_tokens(self) -> int:
+        return sum(stats.estimated_prefix_tokens for stats in self._unique_stats())
+
+    def slowest_fields(self, count: int = 5) -> typing.List[FieldReport]:
+        return sorted(self.fields, key=lambda field_report: field_report.elapsed, reverse=True)[:count]
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "template_validation_time": self.template_validation_time,
+            "generation_time": self.generation_time,
+            "docx_render_time": self.docx_render_time,
+            "total_time": self.total_time,
+            "llm_calls": self.llm_calls,
+            "converter_calls": self.converter_calls,
+            "validation_failures": self.validation_failures,
+            "validation_errors": self.validation_errors,
+            "repairs": self.repairs,
+            "repair_fixes": self.repair_fixes,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_prompt_tokens": self.estimated_prompt_tokens,
+            "estimated_prefix_tokens": self.estimated_prefix_tokens,
+            "fields": [field_report.to_dict() for field_report in self.fields],
+        }
@@ -1,32 +1,299 @@
+import asyncio
+import io
+import time
 import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
 from os import PathLike
 
 from docxtpl import DocxTemplate
 
+from .llm.answer_cache import AnswerCache
+from .llm.budget import Deadline
+from .rendering import load_rendered_docx, write_docx_content
+from .report import RenderReport, FieldReport
+from .templates.cache import TemplateCache, CachedTemplate, default_template_cache
 from .templates.definitions import TemplateDefinition
-from .templates.fields_generation import TemplateFieldsGenerator, Field
+from .templates.fields_generation import TemplateFieldsGenerator, Field, FieldEvent, TimeoutPolicy
+from .templates.manifest import RenderManifest
+
+if typing.TYPE_CHECKING:
+    from .llm.json_answer_generator import PipelinePool
+    from .rendering import ProcessPoolDocxRenderer
 
 
 def _fields_to_dict(fields: typing.List[Field]) -> typing.Dict[str, typing.Any]:
     return {field.id: field.value for field in fields}
 
 
+@dataclass
+class RenderResult:
+    inputs: typing.Dict[str, typing.Any]
+    docx: typing.Optional[DocxTemplate] = None
+    error: typing.Optional[Exception] = None
+    content: typing.Optional[bytes] = None  # rendered document, set instead of docx when rendered by a renderer
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class DocumentRenderedEvent:
+    docx: typing.Optional[DocxTemplate]  # None when the document was rendered by a renderer
+    elapsed: float  # seconds spent rendering the whole document, including field generation
+    content: typing.Optional[bytes] = None
+
+
 class SmartDocx:
-    def __init__(self, template_definition: TemplateDefinition, template_file: typing.Union[typing.IO[bytes], str, PathLike]):
+    def __init__(self,
+                 template_definition: TemplateDefinition,
+                 template_file: typing.Union[typing.IO[bytes], str, PathLike],
+                 max_workers: int = 1,
+                 template_cache: typing.Optional[TemplateCache] = None,
+                 answer_cache: typing.Optional[AnswerCache] = None,
+                 pool: typing.Optional["PipelinePool"] = None,
+                 batch_size: typing.Optional[int] = None,
+                 report_hooks: typing.Optional[typing.List[typing.Callable[[RenderReport], None]]] = None,
+                 renderer: typing.Optional["ProcessPoolDocxRenderer"] = None,
+                 timeout: typing.Optional[float] = None,
+                 max_retries: typing.Optional[int] = None,
+                 timeout_policy: TimeoutPolicy = TimeoutPolicy.FAIL):
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+
         self.template_definition = template_definition
         self.template_file = template_file
-        self.docx = None
+        self.max_workers = max_workers
+        self.template_cache = template_cache or default_template_cache
+        self.answer_cache = answer_cache
+        self.pool = pool
+        self.batch_size = batch_size
+        # if set, documents are rendered in worker processes, so templating does not hold the GIL
+        self.renderer = renderer
+        # seconds per render, fields that are not generated in time are left to the timeout policy
+        self.timeout = timeout
+        self.max_retries = max_retries  # LLM retries per field, fields can declare their own
+        self.timeout_policy = timeout_policy
+        self._docx: typing.Optional[DocxTemplate] = None
+        self.content: typing.Optional[bytes] = None
+        self.manifest: typing.Optional[RenderManifest] = None
+        # called with the report of every finished render, e.g. to export it to a metrics system
+        self.report_hooks = list(report_hooks or [])
+        self.report: typing.Optional[RenderReport] = None
+
+    @property
+    def docx(self) -> typing.Optional[DocxTemplate]:
+        # documents rendered by a renderer are only parsed when they are accessed
+        if self._docx is None and self.content is not None:
+            self._docx = load_rendered_docx(self.content)
+        return self._docx
+
+    def _load_template(self) -> CachedTemplate:
+        template = self.template_cache.get(self.template_file)
+        self.template_cache.validate(self.template_definition, template)
+        return template
+
+    def _create_deadline(self, deadline: typing.Optional[Deadline]) -> typing.Optional[Deadline]:
+        if deadline is None and self.timeout is not None:
+            return Deadline(self.timeout)
+        return deadline
+
+    def render(self,
+               inputs: typing.Dict[str, typing.Any],
+               manifest: typing.Optional[RenderManifest] = None,
+               deadline: typing.Optional[Deadline] = None):
+        for _ in self.render_stream(inputs, manifest=manifest, deadline=deadline):
+            pass
+
+    def render_stream(self,
+                      inputs: typing.Dict[str, typing.Any],
+                      manifest: typing.Optional[RenderManifest] = None,
+                      deadline: typing.Optional[Deadline] = None) -> typing.Iterator[typing.Union[FieldEvent, DocumentRenderedEvent]]:
+        # fields whose definition and dependency values match the given manifest are reused instead of regenerated.
+        # The given deadline replaces the one created from the timeout, it can be cancelled from another thread
+        deadline = self._create_deadline(deadline)
+        start = time.perf_counter()
+        report = RenderReport()
+        template = self._load_template()
+        self.template_definition._validate_inputs(inputs)
+        report.template_validation_time = time.perf_counter() - start
+
+        generator = self._create_fields_generator(inputs, manifest, deadline)
+        fields = list(generator.inputs.values())
+        for event in generator.iter_template_fields():
+            fields.append(event.field)
+            report.fields.append(FieldReport.from_event(event))
+            yield event
+        report.generation_time = time.perf_counter() - start - report.template_validation_time
+
+        self.manifest = generator.manifest
+        render_start = time.perf_counter()
+        self._render_document(template, _fields_to_dict(fields))
+        report.docx_render_time = time.perf_counter() - render_start
+        yield self._finish_render(report, start)
+
+    async def arender(self,
+                      inputs: typing.Dict[str, typing.Any],
+                      manifest: typing.Optional[RenderManifest] = None,
+                      deadline: typing.Optional[Deadline] = None):
+        async for _ in self.arender_stream(inputs, manifest=manifest, deadline=deadline):
+            pass
+
+    async def arender_stream(self,
+                             inputs: typing.Dict[str, typing.Any],
+                             manifest: typing.Optional[RenderManifest] = None,
+                             deadline: typing.Optional[Deadline] = None) -> typing.AsyncIterator[typing.Union[FieldEvent, DocumentRenderedEvent]]:
+        # same as render_stream, fields are generated on the running event loop,
+        # loading and rendering the docx are blocking, so they run in a worker thread
+        deadline = self._create_deadline(deadline)
+        start = time.perf_counter()
+        report = RenderReport()
+        template = await asyncio.to_thread(self._load_template)
+        self.template_definition._validate_inputs(inputs)
+        report.template_validation_time = time.perf_counter() - start
+
+        generator = self._create_fields_generator(inputs, manifest, deadline)
+        fields = list(generator.inputs.values())
+        async for event in generator.aiter_template_fields():
+            fields.append(event.field)
+            report.fields.append(FieldReport.from_event(event))
+            yield event
+        report.generation_time = time.perf_counter() - start - report.template_validation_time
+
+        self.manifest = generator.manifest
+        render_start = time.perf_counter()
+        await asyncio.to_thread(self._render_document, template, _fields_to_dict(fields))
+        report.docx_render_time = time.perf_counter() - render_start
+        yield self._finish_render(report, start)
 
-    def render(self, inputs: typing.Dict[str, typing.Any]):
-        self.template_definition.validate_template(template_file=self.template_file, inputs=inputs)
-        generator = TemplateFieldsGenerator(template_definition=self.template_definition, inputs=inputs)
-        fields = generator.generate_template_fields()
+    def _create_fields_generator(self,
+                                 inputs: typing.Dict[str, typing.Any],
+                                 manifest: typing.Optional[RenderManifest],
+                                 deadline: typing.Optional[Deadline]) -> TemplateFieldsGenerator:
+        return TemplateFieldsGenerator(template_definition=self.template_definition,
+                                       inputs=inputs,
+                                       max_workers=self.max_workers,
+                                       answer_cache=self.answer_cache,
+                                       pool=self.pool,
+                                       batch_size=self.batch_size,
+                                       previous_manifest=manifest,
+                                       deadline=deadline,
+                                       max_retries=self.max_retries,
+                                       timeout_policy=self.timeout_policy)
+
+    def _render_document(self, template: CachedTemplate, context: typing.Dict[str, typing.Any]):
+        if self.renderer:
+            self._docx = None
+            self.content = self.renderer.render(template, context)
+        else:
+            self.content = None
+            self._docx = template.render_docx(context)
+
+    def _finish_render(self, report: RenderReport, start: float) -> DocumentRenderedEvent:
+        report.total_time = time.perf_counter() - start
+        self.report = report
+        for hook in self.report_hooks:
+            hook(report)
+        return DocumentRenderedEvent(docx=self._docx, elapsed=report.total_time, content=self.content)
+
+    def render_to(self,
+                  inputs: typing.Dict[str, typing.Any],
+                  sink: typing.IO[bytes],
+                  manifest: typing.Optional[RenderManifest] = None,
+                  deadline: typing.Optional[Deadline] = None):
+        # the document is written straight into the sink (e.g. an HTTP response), without temporary files
+        self.render(inputs, manifest=manifest, deadline=deadline)
+        self.save(sink)
+
+    def render_to_bytes(self,
+                        inputs: typing.Dict[str, typing.Any],
+                        manifest: typing.Optional[RenderManifest] = None,
+                        deadline: typing.Optional[Deadline] = None) -> bytes:
+        self.render(inputs, manifest=manifest, deadline=deadline)
+        return self._to_bytes()
+
+    async def arender_to_bytes(self,
+                               inputs: typing.Dict[str, typing.Any],
+                               manifest: typing.Optional[RenderManifest] = None,
+                               deadline: typing.Optional[Deadline] = None) -> bytes:
+        await self.arender(inputs, manifest=manifest, deadline=deadline)
+        if self.content is not None:
+            return self.content
+        return await asyncio.to_thread(self._to_bytes)
+
+    def _to_bytes(self) -> bytes:
+        if self.content is not None:
+            return self.content
+
+        output = io.BytesIO()
+        self.save(output)
+        return output.getvalue()
+
+    def render_many(self,
+                    inputs: typing.Iterable[typing.Dict[str, typing.Any]],
+                    max_concurrent_renders: int = 4) -> typing.Iterator[RenderResult]:
+        if max_concurrent_renders < 1:
+            raise ValueError("max_concurrent_renders must be at least 1")
+
+        # template and definition work is shared by every document in the batch
+        from .llm.json_answer_generator import JsonAnswerGenerator
+
+        template = self._load_template()
+        answer_generator = JsonAnswerGenerator(cache=self.answer_cache, pool=self.pool)
+
+        def render_one(item_inputs: typing.Dict[str, typing.Any]) -> typing.Union[DocxTemplate, bytes]:
+            self.template_definition._validate_inputs(item_inputs)
+            generator = TemplateFieldsGenerator(template_definition=self.template_definition,
+                                                inputs=item_inputs,
+                                                answer_generator=answer_generator,
+                                                max_workers=self.max_workers,
+                                                batch_size=self.batch_size,
+                                                deadline=self._create_deadline(None),
+                                                max_retries=self.max_retries,
+                                                timeout_policy=self.timeout_policy)
+            context = _fields_to_dict(generator.generate_template_fields())
+            if self.renderer:
+                return self.renderer.render(template, context)
+
+            return template.render_docx(context)
+
+        def to_result(item_inputs: typing.Dict[str, typing.Any], future: Future) -> RenderResult:
+            try:
+                document = future.result()
+            except Exception as e:
+                return RenderResult(inputs=item_inputs, error=e)
+            if isinstance(document, bytes):
+                return RenderResult(inputs=item_inputs, content=document)
+            return RenderResult(inputs=item_inputs, docx=document)
+
+        # inputs are consumed lazily and results are yielded in input order,
+        # with at most max_concurrent_renders documents in flight
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max_concurrent_renders, thread_name_prefix="smart-docx-render") as executor:
+            for item_inputs in inputs:
+                pending.append((item_inputs, executor.submit(render_one, item_inputs)))
+                if len(pending) >= max_concurrent_renders:
+                    yield to_result(*pending.popleft())
+
+            while pending:
+                yield to_result(*pending.popleft())
+
+    def save_manifest(self, filename: typing.Union[str, PathLike]):
+        if self.manifest is None:
+            raise ValueError("Document has not yet been rendered")
+        self.manifest.save(filename)
 
-        context = _fields_to_dict(fields)
-        self.docx = DocxTemplate(self.template_file)
-        self.docx.render(context)
+    @staticmethod
+    def load_manifest(filename: typing.Union[str, PathLike]) -> RenderManifest:
+        # the manifest is not kept, it only applies to the render it is passed to
+        return RenderManifest.load(filename)
 
     def save(self, filename: typing.Union[typing.IO[bytes], str, PathLike]):
-        if not self.docx and not self.docx.is_rendered:
+        if self.content is not None:
+            write_docx_content(self.content, filename)
+            return
+        if self.docx is None or not self.docx.is_rendered:
             raise ValueError("Document has not yet been rendered")
         self.docx.save(filename)
@@ -0,0 +1,106 @@
+import copy
+import hashlib
+import io
+import threading
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from os import PathLike
+
+from docx.document import Document
+from docxtpl import DocxTemplate
+
+from .definitions import TemplateDefinition
+from .tables import RowLoop, detach_row_loops, fill_row_loops, find_row_loops
+
+
+def read_template_bytes(template_file: typing.Union[typing.IO[bytes], str, PathLike]) -> bytes:
+    if hasattr(template_file, "read"):
+        template_file.seek(0)
+        return template_file.read()
+
+    with open(template_file, "rb") as file:
+        return file.read()
+
+
+def _definition_fingerprint(template_definition: TemplateDefinition) -> str:
+    return hashlib.sha256(template_definition.model_dump_json().encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedTemplate:
+    digest: str
+    content: bytes
+    document: Document  # parsed package, never rendered
+    variables: typing.Set[str]
+    row_loops: typing.List[RowLoop] = field(default_factory=list)  # table loops filled without jinja
+    validated_definitions: typing.Set[str] = field(default_factory=set)
+
+    def new_docx(self) -> DocxTemplate:
+        # rendering mutates the document, so every render gets its own copy of the parsed package
+        docx = DocxTemplate(io.BytesIO(self.content))
+        docx.docx = copy.deepcopy(self.document)
+        return docx
+
+    def render_docx(self, context: typing.Dict[str, typing.Any]) -> DocxTemplate:
+        # rows of large table loops are cloned directly, jinja only renders the rest of the document
+        docx = self.new_docx()
+        detached_row_loops = detach_row_loops(docx.docx, self.row_loops, context)
+        docx.render(context)
+        fill_row_loops(docx.docx, detached_row_loops)
+        return docx
+
+
+class TemplateCache:
+    def __init__(self, max_size: int = 32):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self.max_size = max_size
+        self._templates: typing.OrderedDict[str, CachedTemplate] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_file: typing.Union[typing.IO[bytes], str, PathLike]) -> CachedTemplate:
+        content = read_template_bytes(template_file)
+        digest = hashlib.sha256(content).hexdigest()
+
+        with self._lock:
+            template = self._templates.get(digest)
+            if template:
+                self._templates.move_to_end(digest)
+                return template
+
+        docx = DocxTemplate(io.BytesIO(content))
+        docx.init_docx()
+        variables = docx.get_undeclared_template_variables()
+        template = CachedTemplate(digest=digest,
+                                  content=content,
+                                  document=docx.docx,
+                                  variables=variables,
+                                  row_loops=find_row_loops(docx.docx))
+
+        with self._lock:
+            self._templates[digest] = template
+            self._templates.move_to_end(digest)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+
+        return template
+
+    def validate(self, template_definition: TemplateDefinition, template: CachedTemplate):
+        definition_fingerprint = _definition_fingerprint(template_definition)
+        if definition_fingerprint in template.validated_definitions:
+            return
+
+        template_definition._validate_template_variables(template.variables)
+        template.validated_definitions.add(definition_fingerprint)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+
+default_template_cache = TemplateCache()
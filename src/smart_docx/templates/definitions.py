@@ -9,7 +9,10 @@ import yaml
 from docxtpl import DocxTemplate
 from jinja2 import Environment, meta
 from jsonschema.exceptions import SchemaError
-from pydantic import BaseModel, field_validator, ConfigDict
+from pydantic import BaseModel, field_validator, ConfigDict, ValidationInfo
+
+# shared by all definitions, so instructions are parsed and compiled by a single environment
+jinja_environment = Environment()
 
 
 class SaferDraft7Validator(jsonschema.Draft7Validator):
@@ -26,6 +29,9 @@ class FieldDefinition(BaseModel):
     source: SourceType
     value: dict  # JSON schema
     instructions: str
+    max_retries: typing.Optional[int] = None  # overrides the retry budget of the render for this field
+    fallback: typing.Optional[Any] = None  # used instead of a generated value when the field runs out of time
+    chunk_size: typing.Optional[int] = None  # array values are generated in pages of this many items
     _dependencies: typing.Set[str] = []
 
     @field_validator('value')
@@ -41,9 +47,39 @@ class FieldDefinition(BaseModel):
 
         return v
 
+    @field_validator('max_retries')
+    @classmethod
+    def validate_max_retries(cls, v: typing.Optional[int]) -> typing.Optional[int]:
+        if v is not None and v < 0:
+            raise ValueError("max_retries must not be negative")
+        return v
+
+    @field_validator('fallback')
+    @classmethod
+    def validate_fallback(cls, v: typing.Any, info: ValidationInfo) -> typing.Any:
+        schema = info.data.get("value")
+        if v is not None and schema:
+            try:
+                jsonschema.validate(v, schema)
+            except jsonschema.ValidationError as e:
+                raise ValueError(f"Fallback does not match the JSON schema: {e.message}")
+        return v
+
+    @field_validator('chunk_size')
+    @classmethod
+    def validate_chunk_size(cls, v: typing.Optional[int], info: ValidationInfo) -> typing.Optional[int]:
+        if v is None:
+            return v
+        if v < 1:
+            raise ValueError("chunk_size must be at least 1")
+        schema = info.data.get("value") or {}
+        schema_type = schema.get("type")
+        if "array" not in (schema_type if isinstance(schema_type, list) else [schema_type]) or not isinstance(schema.get("items", {}), dict):
+            raise ValueError("chunk_size can only be set for array values with a single items schema")
+        return v
+
     def model_post_init(self, _: Any) -> None:
-        env = Environment()
-        parsed_content = env.parse(self.instructions)
+        parsed_content = jinja_environment.parse(self.instructions)
         self._dependencies = meta.find_undeclared_variables(parsed_content)
 
     @property
@@ -80,8 +116,10 @@ class TemplateDefinition(BaseModel):
         return fields
 
     def _validate_template_file(self, template_file: typing.Union[typing.IO[bytes]]):
+        self._validate_template_variables(_get_template_variables(template_file))
+
+    def _validate_template_variables(self, fields_in_template: typing.Set[str]):
         defined_fields = set([f.id for f in self.fields])
-        fields_in_template = _get_template_variables(template_file)
         missing_variables = fields_in_template - defined_fields
         if missing_variables:
             raise ValueError(f"Missing defined fields, which are present in template: {', '.join(missing_variables)}")
@@ -101,10 +139,11 @@ class TemplateDefinition(BaseModel):
         self._validate_inputs(inputs)
 
 
-def load_template_definition(yaml_path: str) -> TemplateDefinition:
-    with open(yaml_path, 'r', encoding='utf-8') as file:
-        data = yaml.safe_load(file)
+# the libyaml based loader is several times faster, the pure python one is used if pyyaml was built without it
+yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
+
+def template_definition_from_dict(data: typing.Dict[str, Any]) -> TemplateDefinition:
     fields = [FieldDefinition(**field) for field in data.get("fields", [])]
 
     return TemplateDefinition(
@@ -115,6 +154,13 @@ def load_template_definition(yaml_path: str) -> TemplateDefinition:
     )
 
 
+def load_template_definition(yaml_path: str) -> TemplateDefinition:
+    with open(yaml_path, 'r', encoding='utf-8') as file:
+        data = yaml.load(file, Loader=yaml_loader)
+
+    return template_definition_from_dict(data)
+
+
 def _get_template_variables(file_path: typing.Union[typing.IO[bytes], str, PathLike]) -> typing.Set[str]:
     tpl = DocxTemplate(file_path)
     return tpl.get_undeclared_template_variables()
@@ -150,3 +196,38 @@ def sort_field_definitions(fields: typing.List[FieldDefinition]) -> typing.List[
         raise ValueError("Circular dependency between fields")
 
     return sorted_fields
+
+
+def group_field_definitions_by_level(fields: typing.List[FieldDefinition]) -> typing.List[typing.List[FieldDefinition]]:
+    graph = {field.id: field for field in fields}
+    in_degree = {field.id: 0 for field in fields}
+    adjacency_list = {field.id: [] for field in fields}
+
+    for field in fields:
+        for dep in field.dependencies:
+            if dep not in graph:
+                raise ValueError(f"Dependency {dep} not found among field definitions")
+            adjacency_list[dep].append(field.id)
+            in_degree[field.id] += 1
+
+    # every level holds fields whose dependencies are all in previous levels
+    level = [field_id for field_id, degree in in_degree.items() if degree == 0]
+    levels = []
+    visited = 0
+
+    while level:
+        levels.append([graph[field_id] for field_id in level])
+        visited += len(level)
+
+        next_level = []
+        for field_id in level:
+            for neighbor in adjacency_list[field_id]:
+                in_degree[neighbor] -= 1
+                if in_degree[neighbor] == 0:
+                    next_level.append(neighbor)
+        level = next_level
+
+    if visited != len(fields):
+        raise ValueError("Circular dependency between fields")
+
+    return levels
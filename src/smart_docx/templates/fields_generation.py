@@ -1,61 +1,422 @@
+import asyncio
 import logging
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dataclasses import dataclass
+from enum import Enum
 from typing import Any
 
-import jinja2
+from .definitions import TemplateDefinition, FieldDefinition, SourceType
+from .manifest import RenderManifest, ManifestEntry, field_fingerprint
+from .plan import get_execution_plan
+from ..llm.answer_cache import AnswerCache
+from ..llm.budget import AnswerBudget, Deadline, DeadlineExceededError, RetryBudgetExceededError, answer_budget
+from ..llm.scheduler import scheduler_queue
+from ..llm.stats import AnswerStats, collect_answer_stats
 
-from .definitions import TemplateDefinition, SourceType, sort_field_definitions
-from ..llm.json_answer_generator import JsonAnswerGenerator
+if typing.TYPE_CHECKING:
+    from ..llm.json_answer_generator import JsonAnswerGenerator, PipelinePool
 
 logger = logging.getLogger(__name__)
 
 
+class TimeoutPolicy(Enum):
+    FAIL = "fail"  # the render fails
+    DEFAULT = "default"  # the field gets the default of its JSON schema
+    FALLBACK = "fallback"  # the field gets its declared fallback, or the default of its JSON schema
+
+
 @dataclass
 class Field:
     id: str
     value: Any
 
 
+@dataclass
+class FieldEvent:
+    field: Field
+    elapsed: float  # seconds spent generating the field, shared by all fields of a batch
+    retries: int
+    reused: bool = False  # value was taken from the previous render manifest
+    stats: typing.Optional[AnswerStats] = None  # shared by all fields of a batch, None for reused fields
+    exhausted: bool = False  # ran out of time or retries, the value was set by the timeout policy
+
+    @property
+    def id(self) -> str:
+        return self.field.id
+
+    @property
+    def value(self) -> Any:
+        return self.field.value
+
+
 class TemplateFieldsGenerator:
     def __init__(self,
                  template_definition: TemplateDefinition,
-                 inputs: typing.Dict[str, Any]):
+                 inputs: typing.Dict[str, Any],
+                 answer_generator: typing.Optional["JsonAnswerGenerator"] = None,
+                 max_workers: int = 1,
+                 answer_cache: typing.Optional[AnswerCache] = None,
+                 pool: typing.Optional["PipelinePool"] = None,
+                 batch_size: typing.Optional[int] = None,
+                 previous_manifest: typing.Optional[RenderManifest] = None,
+                 deadline: typing.Optional[Deadline] = None,
+                 max_retries: typing.Optional[int] = None,
+                 timeout_policy: TimeoutPolicy = TimeoutPolicy.FAIL):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if max_retries is not None and max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+
         self.template_definition = template_definition
+        self.plan = get_execution_plan(template_definition)
         self.inputs = {k: Field(k, v) for k, v in inputs.items()}
-        self.answer_generator = JsonAnswerGenerator(system_prompt=template_definition.instructions)
+        if answer_generator is None:
+            # haystack and the providers are only imported once fields are actually generated
+            from ..llm.json_answer_generator import JsonAnswerGenerator
+            answer_generator = JsonAnswerGenerator(cache=answer_cache, pool=pool)
+        self.answer_generator = answer_generator
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.previous_manifest = previous_manifest
+        self.manifest = RenderManifest()
+        # generation stops once the deadline expires or is cancelled, unfinished fields are left to the timeout policy
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.timeout_policy = timeout_policy
+
+    def _generate_field_value(self,
+                              field_instructions: str,
+                              field_schema: dict,
+                              chunk_size: typing.Optional[int] = None) -> typing.Union[str, dict, list]:
+        if chunk_size and hasattr(self.answer_generator, "answer_array"):
+            return self.answer_generator.answer_array(field_instructions,
+                                                      field_schema,
+                                                      chunk_size,
+                                                      system_prompt=self.template_definition.instructions)
+        return self.answer_generator.answer(field_instructions,
+                                            field_schema,
+                                            system_prompt=self.template_definition.instructions)
+
+    async def _agenerate_field_value(self,
+                                     field_instructions: str,
+                                     field_schema: dict,
+                                     chunk_size: typing.Optional[int] = None) -> typing.Union[str, dict, list]:
+        aanswer = getattr(self.answer_generator, "aanswer", None)
+        if aanswer is None:
+            # answer generators without an async api are called in a worker thread, with the context of the field
+            return await asyncio.to_thread(self._generate_field_value, field_instructions, field_schema, chunk_size)
+        if chunk_size and hasattr(self.answer_generator, "aanswer_array"):
+            return await self.answer_generator.aanswer_array(field_instructions,
+                                                             field_schema,
+                                                             chunk_size,
+                                                             system_prompt=self.template_definition.instructions)
+        return await aanswer(field_instructions, field_schema, system_prompt=self.template_definition.instructions)
+
+    def _generate_field_values(self, questions: typing.Dict[str, str], schemas: typing.Dict[str, dict]) -> typing.Dict[str, Any]:
+        return self.answer_generator.answer_many(questions, schemas, system_prompt=self.template_definition.instructions)
+
+    async def _agenerate_field_values(self, questions: typing.Dict[str, str], schemas: typing.Dict[str, dict]) -> typing.Dict[str, Any]:
+        aanswer_many = getattr(self.answer_generator, "aanswer_many", None)
+        if aanswer_many is None:
+            return await asyncio.to_thread(self._generate_field_values, questions, schemas)
+        return await aanswer_many(questions, schemas, system_prompt=self.template_definition.instructions)
+
+    def _get_field_instructions(self, field_def: FieldDefinition, context: typing.Dict[str, Field]) -> str:
+        field_context = {dep_id: context[dep_id].value for dep_id in field_def.dependencies}
+        field_instructions = self.plan.render_instructions(field_def.id, field_context)
+
+        logger.debug(f"Generating value for field {field_def.id}, instructions: {field_instructions}, context: {field_context}")
+        return field_instructions
+
+    def _get_field_fingerprint(self, field_def: FieldDefinition, context: typing.Dict[str, Field]) -> str:
+        dependency_values = {dep_id: context[dep_id].value for dep_id in field_def.dependencies}
+        return field_fingerprint(field_def, self.template_definition.instructions, dependency_values)
+
+    def _reuse_field(self, field_def: FieldDefinition, fingerprint: str) -> typing.Optional[FieldEvent]:
+        if self.previous_manifest is None:
+            return None
+
+        entry = self.previous_manifest.get_entry(field_def.id, fingerprint)
+        if entry is None:
+            return None
+
+        logger.debug(f"Reusing value for field {field_def.id} from the previous render, value: {entry.value}")
+        self.manifest.entries[field_def.id] = entry
+        return FieldEvent(field=Field(id=field_def.id, value=entry.value), elapsed=0.0, retries=0, reused=True)
+
+    def _get_answer_budget(self, max_retries: typing.Optional[int]) -> typing.Optional[AnswerBudget]:
+        max_retries = self.max_retries if max_retries is None else max_retries
+        if self.deadline is None and max_retries is None:
+            return None
+        return AnswerBudget(deadline=self.deadline, max_retries=max_retries)
+
+    def _resolve_exhausted_field(self, field_def: FieldDefinition, error: Exception, elapsed: float = 0.0) -> FieldEvent:
+        if self.timeout_policy is TimeoutPolicy.FALLBACK and field_def.fallback is not None:
+            field_value = field_def.fallback
+        elif self.timeout_policy is not TimeoutPolicy.FAIL and "default" in field_def.value:
+            field_value = field_def.value["default"]
+        else:
+            raise error
+
+        # the value is not added to the manifest, so the field is generated again by the next render
+        logger.warning(f"Field {field_def.id} ran out of time or retries ({error}), using {field_value}")
+        return FieldEvent(field=Field(id=field_def.id, value=field_value), elapsed=elapsed, retries=0, exhausted=True)
+
+    def _field_generated(self,
+                         field_def: FieldDefinition,
+                         fingerprint: str,
+                         field_value: Any,
+                         start: float,
+                         stats: AnswerStats) -> FieldEvent:
+        logger.debug(f"Generated value for field {field_def.id}, value: {field_value}")
+        self.manifest.entries[field_def.id] = ManifestEntry(value=field_value, fingerprint=fingerprint)
+        return FieldEvent(field=Field(id=field_def.id, value=field_value),
+                          elapsed=time.perf_counter() - start,
+                          retries=stats.retries,
+                          stats=stats)
+
+    def _generate_field(self, field_def: FieldDefinition, context: typing.Dict[str, Field]) -> FieldEvent:
+        fingerprint = self._get_field_fingerprint(field_def, context)
+        reused_field = self._reuse_field(field_def, fingerprint)
+        if reused_field:
+            return reused_field
+
+        start = time.perf_counter()
+        # LLM calls of one render share a scheduler queue, so concurrent renders are served fairly
+        with collect_answer_stats() as stats, scheduler_queue(id(self)), answer_budget(self._get_answer_budget(field_def.max_retries)):
+            field_instructions = self._get_field_instructions(field_def, context)
+            try:
+                field_value = self._generate_field_value(field_instructions, field_def.value, field_def.chunk_size)
+            except (DeadlineExceededError, RetryBudgetExceededError) as e:
+                return self._resolve_exhausted_field(field_def, e, elapsed=time.perf_counter() - start)
+
+        return self._field_generated(field_def, fingerprint, field_value, start, stats)
+
+    async def _agenerate_field(self, field_def: FieldDefinition, context: typing.Dict[str, Field]) -> FieldEvent:
+        fingerprint = self._get_field_fingerprint(field_def, context)
+        reused_field = self._reuse_field(field_def, fingerprint)
+        if reused_field:
+            return reused_field
+
+        start = time.perf_counter()
+        # every field runs in its own task, so the context variables only apply to its own calls
+        with collect_answer_stats() as stats, scheduler_queue(id(self)), answer_budget(self._get_answer_budget(field_def.max_retries)):
+            field_instructions = self._get_field_instructions(field_def, context)
+            try:
+                field_value = await self._agenerate_field_value(field_instructions, field_def.value, field_def.chunk_size)
+            except (DeadlineExceededError, RetryBudgetExceededError) as e:
+                return self._resolve_exhausted_field(field_def, e, elapsed=time.perf_counter() - start)
+
+        return self._field_generated(field_def, fingerprint, field_value, start, stats)
+
+    def _split_reused_fields(self,
+                             field_defs: typing.List[FieldDefinition],
+                             fingerprints: typing.Dict[str, str]) -> typing.Tuple[typing.List[FieldEvent], typing.List[FieldDefinition]]:
+        events = []
+        pending_field_defs = []
+        for field_def in field_defs:
+            reused_field = self._reuse_field(field_def, fingerprints[field_def.id])
+            if reused_field:
+                events.append(reused_field)
+            else:
+                pending_field_defs.append(field_def)
+        return events, pending_field_defs
 
     @staticmethod
-    def _render_field_instructions(instructions: str, ctx: typing.Dict[str, typing.Any]) -> str:
-        return jinja2.Template(instructions).render(ctx)
+    def _split_chunked_fields(field_defs: typing.List[FieldDefinition]) -> typing.Tuple[typing.List[FieldDefinition], typing.List[FieldDefinition]]:
+        # chunked fields are asked for page by page, so they are never part of a combined request
+        chunked_field_defs = [field_def for field_def in field_defs if field_def.chunk_size]
+        return chunked_field_defs, [field_def for field_def in field_defs if not field_def.chunk_size]
+
+    def _fields_generated(self,
+                          field_values: typing.Dict[str, Any],
+                          fingerprints: typing.Dict[str, str],
+                          start: float,
+                          stats: AnswerStats) -> typing.List[FieldEvent]:
+        logger.debug(f"Generated values for fields {', '.join(field_values)}, values: {field_values}")
+        elapsed = time.perf_counter() - start
+        events = []
+        for field_id, field_value in field_values.items():
+            self.manifest.entries[field_id] = ManifestEntry(value=field_value, fingerprint=fingerprints[field_id])
+            events.append(FieldEvent(field=Field(id=field_id, value=field_value),
+                                     elapsed=elapsed,
+                                     retries=stats.retries,
+                                     stats=stats))
+        return events
+
+    def _generate_fields_batch(self, field_defs: typing.List[FieldDefinition], context: typing.Dict[str, Field]) -> typing.List[FieldEvent]:
+        fingerprints = {field_def.id: self._get_field_fingerprint(field_def, context) for field_def in field_defs}
+        events, pending_field_defs = self._split_reused_fields(field_defs, fingerprints)
+        single_field_defs, pending_field_defs = self._split_chunked_fields(pending_field_defs)
+        if len(pending_field_defs) <= 1:
+            single_field_defs += pending_field_defs
+            pending_field_defs = []
+        events += [self._generate_field(field_def, context) for field_def in single_field_defs]
+        if not pending_field_defs:
+            return events
 
-    def _generate_field_value(self, field_instructions: str, field_schema: dict) -> typing.Union[str, dict, list]:
-        return self.answer_generator.answer(field_instructions, field_schema)
+        start = time.perf_counter()
+        # a batch has the retry budget of the render, retry budgets of single fields only apply when generated alone
+        with collect_answer_stats() as stats, scheduler_queue(id(self)), answer_budget(self._get_answer_budget(None)):
+            # independent fields share the system prompt, so they are asked for in a single request
+            questions = {field_def.id: self._get_field_instructions(field_def, context) for field_def in pending_field_defs}
+            schemas = {field_def.id: field_def.value for field_def in pending_field_defs}
+            try:
+                field_values = self._generate_field_values(questions, schemas)
+            except (DeadlineExceededError, RetryBudgetExceededError) as e:
+                elapsed = time.perf_counter() - start
+                return events + [self._resolve_exhausted_field(field_def, e, elapsed=elapsed) for field_def in pending_field_defs]
+
+        return events + self._fields_generated(field_values, fingerprints, start, stats)
+
+    async def _agenerate_fields_batch(self, field_defs: typing.List[FieldDefinition], context: typing.Dict[str, Field]) -> typing.List[FieldEvent]:
+        fingerprints = {field_def.id: self._get_field_fingerprint(field_def, context) for field_def in field_defs}
+        events, pending_field_defs = self._split_reused_fields(field_defs, fingerprints)
+        single_field_defs, pending_field_defs = self._split_chunked_fields(pending_field_defs)
+        if len(pending_field_defs) <= 1:
+            single_field_defs += pending_field_defs
+            pending_field_defs = []
+        events += [await self._agenerate_field(field_def, context) for field_def in single_field_defs]
+        if not pending_field_defs:
+            return events
+
+        start = time.perf_counter()
+        with collect_answer_stats() as stats, scheduler_queue(id(self)), answer_budget(self._get_answer_budget(None)):
+            questions = {field_def.id: self._get_field_instructions(field_def, context) for field_def in pending_field_defs}
+            schemas = {field_def.id: field_def.value for field_def in pending_field_defs}
+            try:
+                field_values = await self._agenerate_field_values(questions, schemas)
+            except (DeadlineExceededError, RetryBudgetExceededError) as e:
+                elapsed = time.perf_counter() - start
+                return events + [self._resolve_exhausted_field(field_def, e, elapsed=elapsed) for field_def in pending_field_defs]
+
+        return events + self._fields_generated(field_values, fingerprints, start, stats)
 
     def generate_template_fields(self) -> typing.List[Field]:
-        context = self.inputs.copy()
-        template_fields = list(self.inputs.values())
+        return list(self.inputs.values()) + [event.field for event in self.iter_template_fields()]
+
+    def iter_template_fields(self) -> typing.Iterator[FieldEvent]:
+        # fields are yielded as soon as they are validated, closing the iterator skips fields that were not started yet
+        # with a deadline fields are generated in worker threads, so the caller can stop waiting once it expires
+        if self.max_workers > 1 or self.batch_size or self.deadline is not None:
+            yield from self._iter_template_fields_concurrently()
+            return
 
-        # sort them, since some may have dependencies on others
-        sorted_field_definitions = sort_field_definitions(self.template_definition.fields)
+        context = self.inputs.copy()
 
-        for field_def in sorted_field_definitions:
+        # fields are ordered so that dependencies are generated first
+        for field_def in self.plan.sorted_fields:
             if field_def.source != SourceType.AUTO:
                 continue
 
-            field_instructions = field_def.instructions
-            field_context = {dep_id: context[dep_id].value for dep_id in field_def.dependencies}
+            event = self._generate_field(field_def, context)
+            context[field_def.id] = event.field
+            yield event
+
+    def _get_ready_fields(self) -> typing.Tuple[typing.Dict[str, int], typing.List[FieldDefinition]]:
+        # a field is started as soon as all of its dependencies are generated, fields on the critical path go first
+        auto_fields = [field_def for field_def in self.plan.fields.values() if field_def.source == SourceType.AUTO]
+        auto_field_ids = {field_def.id for field_def in auto_fields}
+        remaining_dependencies = {field_def.id: len(field_def.dependencies & auto_field_ids) for field_def in auto_fields}
+        ready = [field_def for field_def in auto_fields if remaining_dependencies[field_def.id] == 0]
+        return remaining_dependencies, ready
+
+    def _field_done(self, event: FieldEvent, remaining_dependencies: typing.Dict[str, int], ready: typing.List[FieldDefinition]):
+        for dependent_id in self.plan.dependents[event.id]:
+            remaining_dependencies[dependent_id] -= 1
+            if remaining_dependencies[dependent_id] == 0:
+                ready.append(self.plan.fields[dependent_id])
+
+    def _resolve_remaining_fields(self, context: typing.Dict[str, Field]) -> typing.Iterator[FieldEvent]:
+        self.deadline.cancel()
+        error = DeadlineExceededError("Render deadline exceeded")
+        for field_def in self.plan.sorted_fields:
+            if field_def.source == SourceType.AUTO and field_def.id not in context:
+                event = self._resolve_exhausted_field(field_def, error)
+                context[field_def.id] = event.field
+                yield event
+
+    def _iter_template_fields_concurrently(self) -> typing.Iterator[FieldEvent]:
+        context = self.inputs.copy()
+        remaining_dependencies, ready = self._get_ready_fields()
+        batch_size = self.batch_size or 1
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="smart-docx-field")
+        futures = set()
+        completed = False
+        try:
+            while ready or futures:
+                if self.deadline is not None and self.deadline.expired:
+                    break
+
+                ready = self.plan.sort_by_priority(ready)
+                while ready and len(futures) < self.max_workers:
+                    batch, ready = ready[:batch_size], ready[batch_size:]
+                    futures.add(executor.submit(self._generate_fields_batch, batch, context))
+
+                timeout = self.deadline.remaining() if self.deadline is not None else None
+                finished, futures = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for event in future.result():
+                        context[event.id] = event.field
+                        yield event
+                        self._field_done(event, remaining_dependencies, ready)
+            else:
+                completed = True
 
-            if field_context:
-                field_instructions = self._render_field_instructions(field_def.instructions, field_context)
+            if not completed:
+                # calls still in flight can't be interrupted, they stop at their next step and their results are dropped
+                yield from self._resolve_remaining_fields(context)
+                completed = True
+        finally:
+            if not completed and self.deadline is not None:
+                # the caller stopped iterating or a field failed, calls of the remaining fields are cancelled
+                self.deadline.cancel()
+            # with a deadline nothing is left to wait for, unfinished calls were cancelled
+            executor.shutdown(wait=self.deadline is None, cancel_futures=True)
+
+    async def agenerate_template_fields(self) -> typing.List[Field]:
+        return list(self.inputs.values()) + [event.field async for event in self.aiter_template_fields()]
+
+    async def aiter_template_fields(self) -> typing.AsyncIterator[FieldEvent]:
+        # same as iter_template_fields, fields are generated as tasks on the running event loop, at most max_workers
+        # (batches) at a time, fields still in flight when the deadline expires or the caller stops are cancelled
+        context = self.inputs.copy()
+        remaining_dependencies, ready = self._get_ready_fields()
+        batch_size = self.batch_size or 1
 
-            logger.debug(f"Generating value for field {field_def.id}, instructions: {field_instructions}, context: {field_context}")
-            field_value = self.answer_generator.answer(field_instructions, field_def.value)
+        tasks = set()
+        completed = False
+        try:
+            while ready or tasks:
+                if self.deadline is not None and self.deadline.expired:
+                    break
 
-            logger.debug(f"Generated value for field {field_def.id}, value: {field_value}")
-            template_field = Field(id=field_def.id, value=field_value)
+                ready = self.plan.sort_by_priority(ready)
+                while ready and len(tasks) < self.max_workers:
+                    batch, ready = ready[:batch_size], ready[batch_size:]
+                    tasks.add(asyncio.ensure_future(self._agenerate_fields_batch(batch, context)))
 
-            context[field_def.id] = template_field
-            template_fields.append(template_field)
+                timeout = self.deadline.remaining() if self.deadline is not None else None
+                finished, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    for event in task.result():
+                        context[event.id] = event.field
+                        yield event
+                        self._field_done(event, remaining_dependencies, ready)
+            else:
+                completed = True
 
-        return template_fields
+            if not completed:
+                for event in self._resolve_remaining_fields(context):
+                    yield event
+                completed = True
+        finally:
+            if not completed and self.deadline is not None:
+                self.deadline.cancel()
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import typing
+from dataclasses import dataclass, field
+from os import PathLike
+
+from .definitions import FieldDefinition
+
+MANIFEST_VERSION = 1
+
+
+def field_fingerprint(field_def: FieldDefinition, system_prompt: str, dependency_values: typing.Dict[str, typing.Any]) -> str:
+    # a field only has to be regenerated if its definition or the values it depends on have changed
+    fingerprint = json.dumps([system_prompt, field_def.instructions, field_def.value, dependency_values],
+                             sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+    value: typing.Any
+    fingerprint: str
+
+
+@dataclass
+class RenderManifest:
+    entries: typing.Dict[str, ManifestEntry] = field(default_factory=dict)
+
+    def get_entry(self, field_id: str, fingerprint: str) -> typing.Optional[ManifestEntry]:
+        entry = self.entries.get(field_id)
+        if entry is not None and entry.fingerprint == fingerprint:
+            return entry
+        return None
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "version": MANIFEST_VERSION,
+            "fields": {field_id: {"value": entry.value, "fingerprint": entry.fingerprint}
+                       for field_id, entry in self.entries.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: typing.Dict[str, typing.Any]) -> "RenderManifest":
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported render manifest version: {data.get('version')}")
+
+        return cls(entries={field_id: ManifestEntry(value=entry["value"], fingerprint=entry["fingerprint"])
+                            for field_id, entry in data.get("fields", {}).items()})
+
+    def save(self, filename: typing.Union[str, PathLike]):
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, filename: typing.Union[str, PathLike]) -> "RenderManifest":
+        with open(filename, "r", encoding="utf-8") as file:
+            return cls.from_dict(json.load(file))
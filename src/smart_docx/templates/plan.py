@@ -0,0 +1,97 @@
+import threading
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import jinja2
+
+from .definitions import TemplateDefinition, FieldDefinition, SourceType, group_field_definitions_by_level, jinja_environment
+
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    fields: typing.Dict[str, FieldDefinition]
+    levels: typing.List[typing.List[FieldDefinition]]  # fields within a level are ordered by priority
+    dependents: typing.Dict[str, typing.List[str]]
+    # number of generated fields on the longest dependency chain starting at the field
+    priorities: typing.Dict[str, int]
+    critical_path: typing.List[str]
+    instruction_templates: typing.Dict[str, jinja2.Template]
+    order: typing.Dict[str, int]  # position of the field in the definition
+
+    def sort_by_priority(self, field_defs: typing.List[FieldDefinition]) -> typing.List[FieldDefinition]:
+        # longer chains are started first, fields with equal priority keep their definition order
+        return sorted(field_defs, key=lambda field_def: (-self.priorities[field_def.id], self.order[field_def.id]))
+
+    @property
+    def sorted_fields(self) -> typing.List[FieldDefinition]:
+        return [field_def for level in self.levels for field_def in level]
+
+    def render_instructions(self, field_id: str, context: typing.Dict[str, typing.Any]) -> str:
+        template = self.instruction_templates.get(field_id)
+        if template is None:
+            return self.fields[field_id].instructions
+        return template.render(context)
+
+
+def compile_execution_plan(template_definition: TemplateDefinition) -> ExecutionPlan:
+    fields = {field_def.id: field_def for field_def in template_definition.fields}
+    levels = group_field_definitions_by_level(template_definition.fields)
+
+    dependents = {field_id: [] for field_id in fields}
+    for field_def in template_definition.fields:
+        for dep_id in field_def.dependencies:
+            dependents[dep_id].append(field_def.id)
+
+    priorities = {}
+    for level in reversed(levels):
+        for field_def in level:
+            weight = 1 if field_def.source == SourceType.AUTO else 0
+            priorities[field_def.id] = weight + max((priorities[dep_id] for dep_id in dependents[field_def.id]), default=0)
+
+    order = {field_id: index for index, field_id in enumerate(fields)}
+    levels = [sorted(level, key=lambda field_def: (-priorities[field_def.id], order[field_def.id])) for level in levels]
+
+    critical_path = []
+    candidates = [field_id for field_id, field_def in fields.items() if field_def.source == SourceType.AUTO]
+    while candidates:
+        field_id = max(candidates, key=lambda candidate: (priorities[candidate], -order[candidate]))
+        critical_path.append(field_id)
+        candidates = [dep_id for dep_id in dependents[field_id] if fields[dep_id].source == SourceType.AUTO]
+
+    instruction_templates = {field_def.id: jinja_environment.from_string(field_def.instructions)
+                             for field_def in template_definition.fields
+                             if field_def.source == SourceType.AUTO and field_def.dependencies}
+
+    return ExecutionPlan(fields=fields,
+                         levels=levels,
+                         dependents=dependents,
+                         priorities=priorities,
+                         critical_path=critical_path,
+                         instruction_templates=instruction_templates,
+                         order=order)
+
+
+_EXECUTION_PLANS_MAX_SIZE = 64
+_execution_plans: typing.OrderedDict[int, typing.Tuple[TemplateDefinition, ExecutionPlan]] = OrderedDict()
+_execution_plans_lock = threading.Lock()
+
+
+def get_execution_plan(template_definition: TemplateDefinition) -> ExecutionPlan:
+    # plans are cached per definition instance, the definition is kept alongside so its id is not reused
+    key = id(template_definition)
+    with _execution_plans_lock:
+        cached = _execution_plans.get(key)
+        if cached is not None and cached[0] is template_definition:
+            _execution_plans.move_to_end(key)
+            return cached[1]
+
+    plan = compile_execution_plan(template_definition)
+
+    with _execution_plans_lock:
+        _execution_plans[key] = (template_definition, plan)
+        _execution_plans.move_to_end(key)
+        while len(_execution_plans) > _EXECUTION_PLANS_MAX_SIZE:
+            _execution_plans.popitem(last=False)
+
+    return plan
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from os import PathLike
+
+import yaml
+
+from .definitions import TemplateDefinition, FieldDefinition, SourceType, template_definition_from_dict, yaml_loader
+
+logger = logging.getLogger(__name__)
+
+# bump when validation rules change, so definitions validated by an older version are validated again
+VALIDATED_CACHE_VERSION = 3
+
+_DEFINITION_EXTENSIONS = (".yaml", ".yml")
+
+
+def _validate_definition_content(content: bytes) -> typing.Dict[str, typing.Any]:
+    # runs in worker processes, so only plain data crosses the process boundary
+    data = yaml.load(content, Loader=yaml_loader)
+    if not isinstance(data, dict):
+        raise ValueError("Template definition must be a mapping")
+    return template_definition_from_dict(data).model_dump(mode="json")
+
+
+def _construct_definition(data: typing.Dict[str, typing.Any]) -> TemplateDefinition:
+    # data was already validated, model_construct skips schema checks and pydantic validation
+    fields = [FieldDefinition.model_construct(id=field["id"],
+                                              source=SourceType(field["source"]),
+                                              value=field["value"],
+                                              instructions=field["instructions"],
+                                              max_retries=field.get("max_retries"),
+                                              fallback=field.get("fallback"),
+                                              chunk_size=field.get("chunk_size"))
+              for field in data["fields"]]
+    return TemplateDefinition.model_construct(name=data["name"],
+                                              description=data["description"],
+                                              instructions=data["instructions"],
+                                              fields=fields)
+
+
+class ValidatedDefinitionCache:
+    def __init__(self, directory: typing.Union[str, PathLike]):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        try:
+            with open(self._path(digest), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("version") != VALIDATED_CACHE_VERSION:
+            return None
+        return entry.get("definition")
+
+    def set(self, digest: str, definition: typing.Dict[str, typing.Any]):
+        # written to a temporary file first, so concurrent workers never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"version": VALIDATED_CACHE_VERSION, "definition": definition}, file, ensure_ascii=False)
+            os.replace(tmp_path, self._path(digest))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+@dataclass
+class _LoadedFile:
+    mtime_ns: int
+    size: int
+    digest: str
+    name: typing.Optional[str]  # None if the file is not a valid definition
+
+
+class TemplateDefinitionRegistry:
+    def __init__(self,
+                 directory: typing.Union[str, PathLike],
+                 cache_directory: typing.Optional[typing.Union[str, PathLike]] = None,
+                 max_workers: typing.Optional[int] = None,
+                 reload_interval: typing.Optional[float] = None,
+                 mp_context: str = "spawn",
+                 parallel_threshold: int = 8):
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.directory = directory
+        self.cache = ValidatedDefinitionCache(cache_directory) if cache_directory else None
+        self.max_workers = max_workers
+        # spawn is the default since the registry can be loaded in a process already running scheduler and render threads
+        self.mp_context = mp_context
+        # starting worker processes takes longer than validating a few definitions, so only larger batches use them
+        self.parallel_threshold = parallel_threshold
+        # if set, get() picks up changed files at most this often, otherwise reload() has to be called
+        self.reload_interval = reload_interval
+        self.errors: typing.Dict[str, Exception] = {}
+        self._files: typing.Dict[str, _LoadedFile] = {}  # only used by the thread holding the reload lock
+        self._definitions: typing.Dict[str, TemplateDefinition] = {}
+        self._paths: typing.Dict[str, str] = {}  # definition name -> file
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+        self._reload_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._last_reload = 0.0
+        self.reload()
+
+    def _definition_files(self) -> typing.List[str]:
+        return sorted(os.path.join(self.directory, name)
+                      for name in os.listdir(self.directory)
+                      if name.endswith(_DEFINITION_EXTENSIONS))
+
+    def _validate(self, contents: typing.List[bytes]) -> typing.List[typing.Union[typing.Dict[str, typing.Any], Exception]]:
+        def validate(content: bytes) -> typing.Union[typing.Dict[str, typing.Any], Exception]:
+            try:
+                return _validate_definition_content(content)
+            except Exception as e:
+                return e
+
+        if len(contents) < max(self.parallel_threshold, 2) or self.max_workers == 1:
+            return [validate(content) for content in contents]
+
+        # schema checks and pydantic validation are cpu bound, so large batches are validated in separate processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(self.mp_context))
+        futures = [self._executor.submit(_validate_definition_content, content) for content in contents]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def reload(self) -> typing.List[str]:
+        # returns the names of definitions that were added, changed or removed
+        with self._reload_lock:
+            return self._reload()
+
+    def _reload(self) -> typing.List[str]:
+        # files are read and validated without the lock, so get() keeps serving the loaded definitions meanwhile
+        self._last_reload = time.monotonic()
+        paths = self._definition_files()
+        changed_files = []
+
+        for path in paths:
+            stat = os.stat(path)
+            loaded_file = self._files.get(path)
+            if loaded_file and (loaded_file.mtime_ns, loaded_file.size) == (stat.st_mtime_ns, stat.st_size):
+                continue
+
+            with open(path, "rb") as file:
+                content = file.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if loaded_file and loaded_file.digest == digest:
+                loaded_file.mtime_ns, loaded_file.size = stat.st_mtime_ns, stat.st_size
+                continue
+
+            changed_files.append((path, stat, content, digest))
+
+        validated = {}
+        pending = []
+        for path, _, content, digest in changed_files:
+            cached_definition = self.cache.get(digest) if self.cache else None
+            if cached_definition is not None:
+                validated[path] = cached_definition
+            else:
+                pending.append((path, content, digest))
+
+        for (path, _, digest), result in zip(pending, self._validate([content for _, content, _ in pending])):
+            validated[path] = result
+            if self.cache and not isinstance(result, Exception):
+                self.cache.set(digest, result)
+
+        changed_names = []
+        with self._lock:
+            for path in set(self._files) - set(paths):
+                changed_names.extend(self._remove(path))
+
+            for path, stat, _, digest in changed_files:
+                changed_names.extend(self._remove(path))
+                name = self._add(path, validated[path])
+                self._files[path] = _LoadedFile(mtime_ns=stat.st_mtime_ns, size=stat.st_size, digest=digest, name=name)
+                if name:
+                    changed_names.append(name)
+
+        # a changed definition is removed and added again, it is reported once
+        changed_names = list(dict.fromkeys(changed_names))
+        if changed_names:
+            logger.debug(f"Loaded template definitions: {', '.join(changed_names)}")
+        return changed_names
+
+    def _remove(self, path: str) -> typing.List[str]:
+        loaded_file = self._files.pop(path, None)
+        self.errors.pop(path, None)
+        if loaded_file is None or loaded_file.name is None:
+            return []
+
+        self._definitions.pop(loaded_file.name, None)
+        self._paths.pop(loaded_file.name, None)
+        return [loaded_file.name]
+
+    def _add(self, path: str, result: typing.Union[typing.Dict[str, typing.Any], Exception]) -> typing.Optional[str]:
+        if isinstance(result, Exception):
+            # one invalid file does not prevent the other definitions from loading
+            logger.warning(f"Invalid template definition {path}: {result}")
+            self.errors[path] = result
+            return None
+
+        definition = _construct_definition(result)
+        existing_path = self._paths.get(definition.name)
+        if existing_path is not None and existing_path != path:
+            error = ValueError(f"Duplicate template definition name {definition.name} in {existing_path} and {path}")
+            logger.warning(str(error))
+            self.errors[path] = error
+            return None
+
+        self._definitions[definition.name] = definition
+        self._paths[definition.name] = path
+        return definition.name
+
+    def _maybe_reload(self):
+        if self.reload_interval is None or time.monotonic() - self._last_reload < self.reload_interval:
+            return
+        # if another thread is already reloading, the loaded definitions are used instead of waiting for it
+        if self._reload_lock.acquire(blocking=False):
+            try:
+                self._reload()
+            finally:
+                self._reload_lock.release()
+
+    def get(self, name: str) -> TemplateDefinition:
+        self._maybe_reload()
+        with self._lock:
+            definition = self._definitions.get(name)
+        if definition is None:
+            raise ValueError(f"Template definition {name} not found")
+        return definition
+
+    def names(self) -> typing.List[str]:
+        self._maybe_reload()
+        with self._lock:
+            return sorted(self._definitions)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names()
+
+    def __len__(self) -> int:
+        return len(self.names())
+
+    def close(self):
+        with self._reload_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def __enter__(self) -> "TemplateDefinitionRegistry":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
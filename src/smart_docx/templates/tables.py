@@ -0,0 +1,338 @@
+import copy
+import re
+import typing
+from dataclasses import dataclass
+
+from docx.document import Document
+from docx.oxml.ns import qn
+
+# rows of a filled loop are replaced by a marker row while docxtpl renders the rest of the document
+_MARKER_ATTRIBUTE = "{urn:smart-docx:tables}loop"
+
+_FOR_ROW_PATTERN = re.compile(r"^\s*\{%tr\s+for\s+([A-Za-z_]\w*)\s+in\s+([A-Za-z_]\w*)\s*-?%}\s*$")
+_ENDFOR_ROW_PATTERN = re.compile(r"^\s*\{%tr\s+endfor\s*-?%}\s*$")
+_PLACEHOLDER_PATTERN = re.compile(r"\{\{(.*?)}}", re.DOTALL)
+# a variable with attribute and item lookups, e.g. item.name or item['unit price']
+_EXPRESSION_PATTERN = re.compile(r"^\s*([A-Za-z_]\w*)((?:\s*(?:\.[A-Za-z_]\w*|\[\s*'[^']*'\s*]|\[\s*\"[^\"]*\"\s*]))*)\s*$")
+_ACCESSOR_PATTERN = re.compile(r"\.([A-Za-z_]\w*)|\[\s*'([^']*)'\s*]|\[\s*\"([^\"]*)\"\s*]")
+# quotes typed in word are replaced by docxtpl before rendering, so they are replaced here as well
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+# jinja tags, with the optional docxtpl prefix of {%p %}, {%tr %}, {%tc %} and {%r %}
+_TAG_PATTERN = re.compile(r"\{%-?\s*(?:(?:tr|tc|p|r)\s+)?([A-Za-z_]\w*)(.*?)-?%}", re.DOTALL)
+_BLOCK_TAGS = {"for", "if", "with", "macro", "call", "filter", "block", "raw", "autoescape", "set"}
+_SET_TARGET_PATTERN = re.compile(r"[A-Za-z_]\w*")
+_SIMPLE_TYPES = (str, int, float, bool, type(None))
+_LINE_BREAK_TAG = qn("w:br")
+_TEXT_TAG = qn("w:t")
+_SPACE_ATTRIBUTE = qn("xml:space")
+
+_UNDEFINED = object()
+
+Expression = typing.Tuple[str, typing.Tuple[typing.Tuple[bool, str], ...]]  # variable, (is attribute, key) lookups
+
+
+class _UnsupportedLoop(Exception):
+    # raised for loops, and values in them, which are left to docxtpl
+    pass
+
+
+def _get_attribute(value: typing.Any, key: str) -> typing.Any:
+    # same lookup order as jinja, value.key is an attribute first
+    try:
+        return getattr(value, key)
+    except AttributeError:
+        pass
+    try:
+        return value[key]
+    except (TypeError, LookupError, AttributeError):
+        return _UNDEFINED
+
+
+def _get_item(value: typing.Any, key: str) -> typing.Any:
+    try:
+        return value[key]
+    except (TypeError, LookupError, AttributeError):
+        pass
+    try:
+        return getattr(value, key)
+    except AttributeError:
+        return _UNDEFINED
+
+
+def _compile_expression(source: str) -> Expression:
+    match = _EXPRESSION_PATTERN.match(source.translate(_QUOTES))
+    if not match:
+        # filters, calls, docxtpl's {{r }} and {{p }} tags, ...
+        raise _UnsupportedLoop(f"Unsupported expression {source}")
+
+    accessors = []
+    for accessor in _ACCESSOR_PATTERN.finditer(match.group(2)):
+        attribute, single_quoted_key, double_quoted_key = accessor.groups()
+        if attribute is not None:
+            accessors.append((True, attribute))
+        else:
+            accessors.append((False, single_quoted_key if single_quoted_key is not None else double_quoted_key))
+    return match.group(1), tuple(accessors)
+
+
+def _compile_text(text: str) -> typing.Tuple[typing.Union[str, Expression], ...]:
+    parts = []
+    for index, part in enumerate(_PLACEHOLDER_PATTERN.split(text)):
+        if index % 2:
+            parts.append(_compile_expression(part))
+        elif "{{" in part or "}}" in part:
+            raise _UnsupportedLoop(f"Unclosed placeholder in {text}")
+        elif part:
+            parts.append(part)
+    return tuple(parts)
+
+
+@dataclass(frozen=True)
+class _TextSlot:
+    index: int  # position of the w:t element in its row
+    parts: typing.Tuple[typing.Union[str, Expression], ...]  # empty if the text was merged into a previous slot
+
+
+@dataclass(frozen=True)
+class RowLoop:
+    row_index: int  # position of the {%tr for %} row among all rows of the document body
+    item_name: str
+    iterable_name: str
+    slots: typing.Tuple[typing.Tuple[_TextSlot, ...], ...]  # text slots of every row repeated by the loop
+
+    def names(self) -> typing.Set[str]:
+        # names other than the loop item, which are looked up in the render context
+        return {part[0] for row_slots in self.slots for slot in row_slots for part in slot.parts
+                if not isinstance(part, str) and part[0] != self.item_name}
+
+    def _resolve(self, expression: Expression, item: typing.Any, context: typing.Dict[str, typing.Any]) -> str:
+        name, accessors = expression
+        if name != self.item_name and name not in context:
+            # jinja may still resolve it, e.g. from globals, docxtpl decides what it renders to
+            raise _UnsupportedLoop(f"{name} is not in the context")
+        value = item if name == self.item_name else context[name]
+        for is_attribute, key in accessors:
+            if value is _UNDEFINED:
+                # jinja fails on lookups in undefined values, docxtpl reports it
+                raise _UnsupportedLoop(f"{name} is undefined")
+            value = _get_attribute(value, key) if is_attribute else _get_item(value, key)
+
+        if value is _UNDEFINED:
+            return ""
+        # rich text, images, listings, ... are inserted by docxtpl
+        if not isinstance(value, _SIMPLE_TYPES):
+            raise _UnsupportedLoop(f"Unsupported value {type(value).__name__}")
+        text = str(value)
+        if "\t" in text or "\a" in text or "\f" in text:
+            # docxtpl splits the run for these, copying its properties
+            raise _UnsupportedLoop("Tabs, paragraph and page breaks are inserted by docxtpl")
+        return text
+
+    def render(self, item: typing.Any, context: typing.Dict[str, typing.Any]) -> typing.List[typing.List[str]]:
+        return [[
+            "".join(part if isinstance(part, str) else self._resolve(part, item, context) for part in slot.parts)
+            for slot in row_slots
+        ] for row_slots in self.slots]
+
+
+def _row_text(row) -> str:
+    return "".join(text.text or "" for text in row.iter(_TEXT_TAG))
+
+
+def _has_nested_rows(row) -> bool:
+    return any(nested_row is not row for nested_row in row.iter(qn("w:tr")))
+
+
+def _compile_row(row) -> typing.Tuple[_TextSlot, ...]:
+    text = _row_text(row)
+    if "{%" in text or "%}" in text or "{#" in text or "#}" in text:
+        raise _UnsupportedLoop("Rows with tags are rendered by docxtpl")
+    if _has_nested_rows(row) or next(row.iter(qn("wp:docPr")), None) is not None:
+        # nested tables shift the row positions and docxtpl renumbers the ids of pictures
+        raise _UnsupportedLoop("Rows with tables or pictures are rendered by docxtpl")
+
+    text_indexes = {text: index for index, text in enumerate(row.iter(_TEXT_TAG))}
+    slots = []
+    for paragraph in row.iter(qn("w:p")):
+        # a placeholder split across runs is merged into its first run, like docxtpl does
+        merged_index = None
+        merged_text = ""
+        merged = False
+        for text in paragraph.iter(_TEXT_TAG):
+            index = text_indexes[text]
+            if merged_index is None:
+                merged_index = index
+                merged_text = text.text or ""
+                merged = False
+            else:
+                merged_text += text.text or ""
+                merged = True
+                slots.append(_TextSlot(index=index, parts=()))
+
+            if merged_text.rfind("{{") > merged_text.rfind("}}") or merged_text.endswith("{"):
+                continue
+            if "{{" in merged_text or merged:
+                slots.append(_TextSlot(index=merged_index, parts=_compile_text(merged_text)))
+            merged_index = None
+
+        if merged_index is not None:
+            raise _UnsupportedLoop("Placeholder is not closed within its paragraph")
+
+    return tuple(sorted(slots, key=lambda slot: slot.index))
+
+
+def _scan_tags(document: Document) -> typing.Tuple[typing.Dict[typing.Any, int], typing.Set[str]]:
+    # depth of the jinja blocks around every row and the names assigned by {% set %} anywhere in the document
+    offsets = {}
+    parts = []
+    length = 0
+    for text in document.element.body.iter(_TEXT_TAG):
+        offsets[text] = length
+        parts.append(text.text or "")
+        length += len(parts[-1])
+    source = "".join(parts)
+
+    tags = []
+    assigned_names = set()
+    for tag in _TAG_PATTERN.finditer(source):
+        keyword, arguments = tag.group(1), tag.group(2)
+        if keyword == "set":
+            target, _, value = arguments.partition("=")
+            assigned_names.update(_SET_TARGET_PATTERN.findall(target))
+            if value:
+                # {% set x = ... %} has no end tag
+                continue
+        if keyword in _BLOCK_TAGS:
+            tags.append((tag.start(), 1))
+        elif keyword.startswith("end") and keyword[3:] in _BLOCK_TAGS:
+            tags.append((tag.start(), -1))
+
+    # rows and tags are both in document order
+    depths = {}
+    depth = 0
+    tag_index = 0
+    for row in document.element.body.iter(qn("w:tr")):
+        first_text = next(row.iter(_TEXT_TAG), None)
+        if first_text is None:
+            continue
+        while tag_index < len(tags) and tags[tag_index][0] < offsets[first_text]:
+            depth += tags[tag_index][1]
+            tag_index += 1
+        depths[row] = depth
+    return depths, assigned_names
+
+
+def find_row_loops(document: Document) -> typing.List[RowLoop]:
+    # {%tr for %} loops which only insert values into their rows, these are filled without jinja
+    rows = list(document.element.body.iter(qn("w:tr")))
+    depths, assigned_names = _scan_tags(document)
+    row_loops = []
+    for row_index, row in enumerate(rows):
+        match = _FOR_ROW_PATTERN.match(_row_text(row))
+        if not match or _has_nested_rows(row):
+            continue
+        if depths.get(row, 0) != 0:
+            # variables of an outer loop or block are not in the render context, docxtpl renders these
+            continue
+
+        body_rows = []
+        sibling = row.getnext()
+        while sibling is not None and sibling.tag == qn("w:tr") and not _ENDFOR_ROW_PATTERN.match(_row_text(sibling)):
+            body_rows.append(sibling)
+            sibling = sibling.getnext()
+        if sibling is None or sibling.tag != qn("w:tr") or not body_rows:
+            continue
+
+        try:
+            slots = tuple(_compile_row(body_row) for body_row in body_rows)
+        except _UnsupportedLoop:
+            continue
+        row_loop = RowLoop(row_index=row_index, item_name=match.group(1), iterable_name=match.group(2), slots=slots)
+        if row_loop.names() & assigned_names or row_loop.iterable_name in assigned_names:
+            # {% set %} values are only known to jinja
+            continue
+        row_loops.append(row_loop)
+
+    return row_loops
+
+
+@dataclass
+class DetachedRowLoop:
+    row_loop: RowLoop
+    rows: typing.List[typing.Any]  # rows repeated by the loop, removed from the document
+    texts: typing.List[typing.List[typing.List[str]]]  # texts of the slots, per item and row
+
+
+def detach_row_loops(document: Document,
+                     row_loops: typing.List[RowLoop],
+                     context: typing.Dict[str, typing.Any]) -> typing.List[DetachedRowLoop]:
+    # loops whose values can all be inserted as text are replaced by a marker row, so docxtpl skips them
+    if not row_loops:
+        return []
+
+    rows = list(document.element.body.iter(qn("w:tr")))
+    detached_row_loops = []
+    for row_loop in row_loops:
+        items = context.get(row_loop.iterable_name)
+        if not isinstance(items, (list, tuple)):
+            continue
+        try:
+            texts = [row_loop.render(item, context) for item in items]
+        except _UnsupportedLoop:
+            continue
+
+        for_row = rows[row_loop.row_index]
+        body_rows = rows[row_loop.row_index + 1:row_loop.row_index + 1 + len(row_loop.slots)]
+        endfor_row = body_rows[-1].getnext()
+
+        # the marker has the cells of the repeated rows, so docxtpl fixes the table grid the same way
+        marker = copy.deepcopy(body_rows[0])
+        for text in marker.iter(_TEXT_TAG):
+            text.text = ""
+        marker.set(_MARKER_ATTRIBUTE, str(row_loop.row_index))
+        for_row.addprevious(marker)
+        for removed_row in [for_row, *body_rows, endfor_row]:
+            removed_row.getparent().remove(removed_row)
+
+        detached_row_loops.append(DetachedRowLoop(row_loop=row_loop, rows=body_rows, texts=texts))
+
+    return detached_row_loops
+
+
+def _set_text(text_element, text: str):
+    text_element.set(_SPACE_ATTRIBUTE, "preserve")
+    lines = text.split("\n")
+    text_element.text = lines[0]
+
+    # line breaks are separate elements of the run, as docxtpl inserts them
+    previous = text_element
+    for line in lines[1:]:
+        line_break = text_element.makeelement(_LINE_BREAK_TAG, {})
+        previous.addnext(line_break)
+        next_text = text_element.makeelement(_TEXT_TAG, {_SPACE_ATTRIBUTE: "preserve"})
+        next_text.text = line
+        line_break.addnext(next_text)
+        previous = next_text
+
+
+def fill_row_loops(document: Document, detached_row_loops: typing.List[DetachedRowLoop]):
+    if not detached_row_loops:
+        return
+
+    # loops inside jinja blocks are left to docxtpl, so every marker is in the rendered document once
+    markers: typing.Dict[str, typing.List[typing.Any]] = {}
+    for row in document.element.body.iter(qn("w:tr")):
+        key = row.get(_MARKER_ATTRIBUTE)
+        if key is not None:
+            markers.setdefault(key, []).append(row)
+
+    for detached_row_loop in detached_row_loops:
+        for marker in markers.get(str(detached_row_loop.row_loop.row_index), []):
+            for item_texts in detached_row_loop.texts:
+                for row, row_slots, row_texts in zip(detached_row_loop.rows, detached_row_loop.row_loop.slots, item_texts):
+                    filled_row = copy.deepcopy(row)
+                    text_elements = list(filled_row.iter(_TEXT_TAG))
+                    for slot, text in zip(row_slots, row_texts):
+                        _set_text(text_elements[slot.index], text)
+                    marker.addprevious(filled_row)
+            marker.getparent().remove(marker)
@@ -0,0 +1,48 @@
+import io
+import os
+import tempfile
+import unittest
+
+from docx import Document
+
+from smart_docx.rendering import ProcessPoolDocxRenderer, load_rendered_docx
+from smart_docx.templates.cache import TemplateCache
+
+
+class TestProcessPoolDocxRenderer(unittest.TestCase):
+    def setUp(self):
+        file = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
+        file.close()
+        self.template_file = file.name
+        doc = Document()
+        doc.add_paragraph("Greeting: {{ greeting }}")
+        doc.save(self.template_file)
+
+    def tearDown(self):
+        os.remove(self.template_file)
+
+    def test_render(self):
+        template = TemplateCache().get(self.template_file)
+
+        with ProcessPoolDocxRenderer(max_workers=2) as renderer:
+            contents = [renderer.render(template, {"greeting": f"hello {i}"}) for i in range(3)]
+            self.assertEqual([f"{template.digest}.docx"], os.listdir(renderer._directory))
+
+        for i, content in enumerate(contents):
+            self.assertEqual([f"Greeting: hello {i}"], [p.text for p in Document(io.BytesIO(content)).paragraphs])
+        self.assertFalse(os.path.exists(renderer._directory))
+
+    def test_load_rendered_docx(self):
+        template = TemplateCache().get(self.template_file)
+        with ProcessPoolDocxRenderer(max_workers=1) as renderer:
+            content = renderer.render(template, {"greeting": "hello"})
+
+        docx = load_rendered_docx(content)
+        output = io.BytesIO()
+        docx.save(output)
+
+        self.assertEqual(["Greeting: hello"], [p.text for p in Document(output).paragraphs])
+
+
+if __name__ == '__main__':
+    unittest.main()
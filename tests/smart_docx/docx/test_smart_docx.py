@@ -1,10 +1,58 @@
+import asyncio
+import io
+import os
+import tempfile
+import typing
 import unittest
+from unittest import mock
 
-from smart_docx.smart_docx import SmartDocx
-from smart_docx.templates.definitions import load_template_definition
+from docx import Document
+
+from smart_docx.llm.budget import Deadline
+from smart_docx.llm.json_answer_generator import PipelinePool
+from smart_docx.rendering import ProcessPoolDocxRenderer
+from smart_docx.smart_docx import SmartDocx, DocumentRenderedEvent
+from smart_docx.templates.definitions import load_template_definition, TemplateDefinition, FieldDefinition, SourceType
+
+
+class FakeAnswerGenerator:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def answer(self, question: str, schema: dict, system_prompt: str = None):
+        return question.upper()
+
+
+class CountingGenerator:
+    model = "counting"
+
+    def __init__(self, json_replies: typing.List[str]):
+        self.json_replies = json_replies
+
+    def run(self, prompt: str):
+        reply = self.json_replies.pop(0) if "JSON" in prompt else "Ana is thirty"
+        return {"replies": [reply], "meta": [{"usage": {"prompt_tokens": 10, "completion_tokens": 5}}]}
 
 
 class TestSmartDocx(unittest.TestCase):
+    def setUp(self):
+        self.created_files = []
+
+    def tearDown(self):
+        for file in self.created_files:
+            if os.path.exists(file) and os.path.isfile(file):
+                os.remove(file)
+
+    def create_temp_docx_file(self, paragraphs: typing.List[str]) -> str:
+        file_path = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
+        file_path.close()
+        doc = Document()
+        for par in paragraphs:
+            doc.add_paragraph(par)
+        doc.save(file_path.name)
+        self.created_files.append(file_path.name)
+        return file_path.name
+
     def test_render_and_save(self):
         template_def_path = "./resources/template_def.yaml"
         output_path = "./resources/cooking.docx"
@@ -22,6 +70,159 @@ class TestSmartDocx(unittest.TestCase):
 
         smart_docx.save(output_path)
 
+    def create_greeting_template_definition(self) -> TemplateDefinition:
+        return TemplateDefinition(
+            name="greetings",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[
+                FieldDefinition(id="name", source=SourceType.INPUT, value={"type": "string"}, instructions="Name"),
+                FieldDefinition(id="greeting", source=SourceType.AUTO, value={"type": "string"},
+                                instructions="hello {{ name }}"),
+                FieldDefinition(id="farewell", source=SourceType.AUTO, value={"type": "string"},
+                                instructions="bye {{ greeting }}"),
+            ]
+        )
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_render_stream(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}", "Farewell: {{ farewell }}"])
+        smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(), template_file=template_file)
+
+        events = list(smart_docx.render_stream({"name": "Ana"}))
+
+        self.assertEqual(["greeting", "farewell"], [event.id for event in events[:2]])
+        self.assertEqual("BYE HELLO ANA", events[1].value)
+        self.assertIsInstance(events[2], DocumentRenderedEvent)
+        self.assertIs(smart_docx.docx, events[2].docx)
+        self.assertEqual(["Greeting: HELLO ANA", "Farewell: BYE HELLO ANA"], [p.text for p in smart_docx.docx.paragraphs])
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_render_many(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}"])
+        template_def = self.create_greeting_template_definition()
+
+        smart_docx = SmartDocx(template_definition=template_def, template_file=template_file)
+        inputs = [{"name": f"user {i}"} for i in range(5)] + [{"unknown": "value"}]
+
+        results = list(smart_docx.render_many(inputs, max_concurrent_renders=2))
+
+        self.assertEqual(6, len(results))
+        self.assertEqual(inputs, [result.inputs for result in results])
+        for i, result in enumerate(results[:5]):
+            self.assertTrue(result.ok)
+            self.assertIn(f"Greeting: HELLO USER {i}", [p.text for p in result.docx.paragraphs])
+
+        self.assertFalse(results[5].ok)
+        self.assertIn("Missing inputs: name", str(results[5].error))
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_render_with_saved_manifest(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}", "Farewell: {{ farewell }}"])
+        manifest_file = os.path.join(tempfile.gettempdir(), f"{os.path.basename(template_file)}.json")
+        self.created_files.append(manifest_file)
+
+        smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(), template_file=template_file)
+        smart_docx.render({"name": "Ana"})
+        smart_docx.save_manifest(manifest_file)
+
+        events = list(smart_docx.render_stream({"name": "Ana"}, manifest=smart_docx.load_manifest(manifest_file)))
+
+        self.assertTrue(all(event.reused for event in events[:2]))
+        self.assertEqual(["Greeting: HELLO ANA", "Farewell: BYE HELLO ANA"], [p.text for p in smart_docx.docx.paragraphs])
+
+        # loading a manifest keeps no state, it is passed to the render it applies to
+        other_smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(), template_file=template_file)
+        manifest = SmartDocx.load_manifest(manifest_file)
+        self.assertIsNone(other_smart_docx.manifest)
+        other_smart_docx.render_to_bytes({"name": "Ana"}, manifest=manifest, deadline=Deadline(5))
+        self.assertTrue(all(field_report.reused for field_report in other_smart_docx.report.fields))
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_render_with_process_pool_renderer(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}", "Farewell: {{ farewell }}"])
+        output_file = os.path.join(tempfile.gettempdir(), f"rendered_{os.path.basename(template_file)}")
+        self.created_files.append(output_file)
+
+        with ProcessPoolDocxRenderer(max_workers=1) as renderer:
+            smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(),
+                                   template_file=template_file,
+                                   renderer=renderer)
+            events = list(smart_docx.render_stream({"name": "Ana"}))
+            results = list(smart_docx.render_many([{"name": "Bob"}]))
+
+        self.assertIsNone(events[2].docx)
+        self.assertEqual(smart_docx.content, events[2].content)
+        smart_docx.save(output_file)
+        self.assertEqual(["Greeting: HELLO ANA", "Farewell: BYE HELLO ANA"], [p.text for p in Document(output_file).paragraphs])
+        self.assertEqual(["Greeting: HELLO ANA", "Farewell: BYE HELLO ANA"], [p.text for p in smart_docx.docx.paragraphs])
+        self.assertIn("Greeting: HELLO BOB", [p.text for p in Document(io.BytesIO(results[0].content)).paragraphs])
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_render_to_bytes(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}"])
+        smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(), template_file=template_file)
+
+        with self.assertRaises(ValueError):
+            smart_docx.save(io.BytesIO())
+
+        content = smart_docx.render_to_bytes({"name": "Ana"})
+        sink = io.BytesIO()
+        smart_docx.render_to({"name": "Bob"}, sink)
+
+        self.assertEqual(["Greeting: HELLO ANA"], [p.text for p in Document(io.BytesIO(content)).paragraphs])
+        self.assertEqual(["Greeting: HELLO BOB"], [p.text for p in Document(io.BytesIO(sink.getvalue())).paragraphs])
+
+    @mock.patch("smart_docx.llm.json_answer_generator.JsonAnswerGenerator", FakeAnswerGenerator)
+    def test_arender(self):
+        template_file = self.create_temp_docx_file(["Greeting: {{ greeting }}", "Farewell: {{ farewell }}"])
+        smart_docx = SmartDocx(template_definition=self.create_greeting_template_definition(), template_file=template_file)
+
+        async def render():
+            events = [event async for event in smart_docx.arender_stream({"name": "Ana"})]
+            return events, await smart_docx.arender_to_bytes({"name": "Bob"})
+
+        events, content = asyncio.run(render())
+
+        self.assertEqual(["greeting", "farewell"], [event.id for event in events[:2]])
+        self.assertIsInstance(events[2], DocumentRenderedEvent)
+        self.assertEqual(["Greeting: HELLO BOB", "Farewell: BYE HELLO BOB"], [p.text for p in Document(io.BytesIO(content)).paragraphs])
+        self.assertEqual(2, len(smart_docx.report.fields))
+
+    def test_render_report(self):
+        template_file = self.create_temp_docx_file(["Age: {{ age }}"])
+        template_def = TemplateDefinition(
+            name="age",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[
+                FieldDefinition(id="name", source=SourceType.INPUT, value={"type": "string"}, instructions="Name"),
+                FieldDefinition(id="age", source=SourceType.AUTO, value={"type": "integer"}, instructions="age of {{ name }}"),
+            ]
+        )
+        reports = []
+        smart_docx = SmartDocx(template_definition=template_def,
+                               template_file=template_file,
+                               pool=PipelinePool(llm=CountingGenerator(["thirty", "30"])),
+                               report_hooks=[reports.append])
+
+        smart_docx.render({"name": "Ana"})
+
+        report = smart_docx.report
+        self.assertEqual([report], reports)
+        self.assertEqual(["age"], [field_report.id for field_report in report.fields])
+        self.assertEqual(3, report.llm_calls)
+        self.assertEqual(2, report.converter_calls)
+        self.assertEqual(1, report.validation_failures)
+        self.assertEqual({"ValidationError": 1}, report.validation_errors)
+        # the converter's "30" is turned into a number locally
+        self.assertEqual(1, report.repairs)
+        self.assertEqual({"string_to_number": 1}, report.repair_fixes)
+        self.assertEqual(30, report.prompt_tokens)
+        self.assertEqual(15, report.completion_tokens)
+        self.assertEqual(1, report.to_dict()["fields"][0]["retries"])
+        self.assertGreaterEqual(report.total_time, report.generation_time + report.docx_render_time)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from smart_docx.llm.answer_cache import InMemoryAnswerCache, SqliteAnswerCache, answer_cache_key
+from smart_docx.llm.budget import RetryBudgetExceededError
+from smart_docx.llm.json_answer_generator import JsonAnswerGenerator
+
+
+class AnswerCacheTests:
+    def create_cache(self, **kwargs):
+        raise NotImplementedError
+
+    def test_get_and_set(self):
+        cache = self.create_cache()
+        key = answer_cache_key("gpt-4o", "system", "question", {"type": "object"})
+
+        self.assertIsNone(cache.get(key))
+        cache.set(key, {"name": "Ana", "age": 30})
+
+        self.assertEqual({"name": "Ana", "age": 30}, cache.get(key))
+        self.assertEqual({"hits": 1, "misses": 1}, cache.stats)
+
+    def test_none_is_not_cached(self):
+        cache = self.create_cache()
+        cache.set("key", None)
+        self.assertEqual(0, len(cache))
+
+    def test_ttl(self):
+        cache = self.create_cache(ttl=0.05)
+        cache.set("key", "value")
+        self.assertEqual("value", cache.get("key"))
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("key"))
+
+    def test_max_size(self):
+        cache = self.create_cache(max_size=2)
+        cache.set("a", 1)
+        time.sleep(0.01)
+        cache.set("b", 2)
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.set("c", 3)
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+
+
+class TestInMemoryAnswerCache(AnswerCacheTests, unittest.TestCase):
+    def create_cache(self, **kwargs):
+        return InMemoryAnswerCache(**kwargs)
+
+
+class TestSqliteAnswerCache(AnswerCacheTests, unittest.TestCase):
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(delete=False, suffix='.sqlite')
+        self.db_file.close()
+
+    def tearDown(self):
+        if os.path.exists(self.db_file.name):
+            os.remove(self.db_file.name)
+
+    def create_cache(self, **kwargs):
+        return SqliteAnswerCache(self.db_file.name, **kwargs)
+
+    def test_persistence(self):
+        cache = self.create_cache()
+        cache.set("key", ["a", "b"])
+        cache.close()
+
+        self.assertEqual(["a", "b"], self.create_cache().get("key"))
+
+
+class TestAnswerCacheKey(unittest.TestCase):
+    def test_key(self):
+        key = answer_cache_key("gpt-4o", "system", "question", {"type": "object", "required": ["a"]})
+
+        self.assertEqual(key, answer_cache_key("gpt-4o", "system", "question", {"required": ["a"], "type": "object"}))
+        self.assertNotEqual(key, answer_cache_key("gemini-2.0-flash", "system", "question", {"type": "object", "required": ["a"]}))
+        self.assertNotEqual(key, answer_cache_key("gpt-4o", "other", "question", {"type": "object", "required": ["a"]}))
+        self.assertNotEqual(key, answer_cache_key("gpt-4o", "system", "question", {"type": "object"}))
+
+
+def create_pipeline_pool(pipeline_result: dict) -> mock.MagicMock:
+    pool = mock.MagicMock()
+    pool.model = "gpt-4o"
+    pool.pipeline.return_value.__enter__.return_value.run.return_value = pipeline_result
+    return pool
+
+
+class TestJsonAnswerGeneratorCache(unittest.TestCase):
+    def test_cache_hit_skips_pipeline(self):
+        pool = create_pipeline_pool({"output_validator": {"valid_reply": "Ljubljana"}})
+        cache = InMemoryAnswerCache()
+        generator = JsonAnswerGenerator("system", cache=cache, pool=pool)
+
+        self.assertEqual("Ljubljana", generator.answer("Capital of Slovenia?", {"type": "string"}))
+        self.assertEqual("Ljubljana", generator.answer("Capital of Slovenia?", {"type": "string"}))
+
+        self.assertEqual(1, pool.pipeline.call_count)
+        self.assertEqual({"hits": 1, "misses": 1}, cache.stats)
+
+    def test_system_prompt_is_part_of_key(self):
+        pool = create_pipeline_pool({"output_validator": {"valid_reply": "Ljubljana"}})
+        generator = JsonAnswerGenerator("system", cache=InMemoryAnswerCache(), pool=pool)
+
+        generator.answer("Capital of Slovenia?", {"type": "string"})
+        generator.answer("Capital of Slovenia?", {"type": "string"}, system_prompt="other system")
+
+        self.assertEqual(2, pool.pipeline.call_count)
+
+    def test_invalid_answer_is_not_cached(self):
+        pool = create_pipeline_pool({"output_validator": {}})
+        cache = InMemoryAnswerCache()
+        generator = JsonAnswerGenerator("system", cache=cache, pool=pool)
+
+        for _ in range(2):
+            with self.assertRaises(RetryBudgetExceededError):
+                generator.answer("Capital of Slovenia?", {"type": "string"})
+
+        self.assertEqual(2, pool.pipeline.call_count)
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from smart_docx.llm.answer_cache import InMemoryAnswerCache
+from smart_docx.llm.hedging import HedgingPolicy, arun_hedged, run_hedged
+from smart_docx.llm.json_answer_generator import AnswerGenerator, JsonAnswerGenerator, PipelinePool
+from smart_docx.llm.scheduler import LLMScheduler
+
+
+class FakeGenerator:
+    def __init__(self, model: str, reply: str = None, delay: float = 0.0, error: Exception = None):
+        self.model = model
+        self.reply = reply or model
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def run(self, prompt: str):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"replies": [self.reply]}
+
+
+class TestHedgingPolicy(unittest.TestCase):
+    def test_delay(self):
+        hedging = HedgingPolicy(percentile=90, initial_delay=5.0, min_delay=0.1, min_samples=10)
+
+        self.assertEqual(5.0, hedging.delay("model"))
+
+        for latency in range(1, 11):
+            hedging.record("model", latency / 10)
+        self.assertAlmostEqual(0.9, hedging.delay("model"))
+        self.assertEqual(5.0, hedging.delay("other"))
+
+    def test_invalid_percentile(self):
+        with self.assertRaises(ValueError):
+            HedgingPolicy(percentile=0)
+
+
+class TestRunHedged(unittest.TestCase):
+    def test_fail_over(self):
+        calls = [("first", lambda cancelled: 1 / 0), ("second", lambda cancelled: "second")]
+
+        self.assertEqual("second", run_hedged(calls))
+        self.assertEqual("second", run_hedged(calls, hedging=HedgingPolicy()))
+
+    def test_invalid_results_fail_over(self):
+        calls = [("first", lambda cancelled: ""), ("second", lambda cancelled: "second")]
+
+        self.assertEqual("second", run_hedged(calls, is_valid=bool))
+
+    def test_all_calls_fail(self):
+        def fail(cancelled):
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            run_hedged([("first", fail), ("second", fail)], hedging=HedgingPolicy())
+
+    def test_slow_call_is_hedged(self):
+        slow_call_cancelled = threading.Event()
+
+        def slow(cancelled):
+            cancelled.wait(5)
+            slow_call_cancelled.set()
+            return "slow"
+
+        start = time.perf_counter()
+        result = run_hedged([("slow", slow), ("fast", lambda cancelled: "fast")],
+                            hedging=HedgingPolicy(initial_delay=0.05, min_delay=0.0))
+
+        self.assertEqual("fast", result)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertTrue(slow_call_cancelled.wait(1))
+
+    def test_fast_call_is_not_hedged(self):
+        hedged = []
+
+        result = run_hedged([("fast", lambda cancelled: "fast"), ("hedge", lambda cancelled: hedged.append(True))],
+                            hedging=HedgingPolicy(initial_delay=1.0))
+
+        self.assertEqual("fast", result)
+        self.assertEqual([], hedged)
+
+
+class TestArunHedged(unittest.TestCase):
+    def test_fail_over(self):
+        async def fail():
+            raise RuntimeError("failed")
+
+        async def reply():
+            return "second"
+
+        calls = [("first", fail), ("second", reply)]
+        self.assertEqual("second", asyncio.run(arun_hedged(calls)))
+        self.assertEqual("second", asyncio.run(arun_hedged(calls, hedging=HedgingPolicy())))
+
+    def test_slow_call_is_hedged_and_cancelled(self):
+        slow_call_cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                slow_call_cancelled.append(True)
+                raise
+            return "slow"
+
+        async def fast():
+            return "fast"
+
+        async def run():
+            result = await arun_hedged([("slow", slow), ("fast", fast)], hedging=HedgingPolicy(initial_delay=0.05, min_delay=0.0))
+            await asyncio.sleep(0)
+            return result
+
+        start = time.perf_counter()
+        self.assertEqual("fast", asyncio.run(run()))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        # unlike threads, calls in flight are cancelled as soon as another one won
+        self.assertEqual([True], slow_call_cancelled)
+
+
+class TestAnswerGeneratorFallbacks(unittest.TestCase):
+    def test_fallback_on_error(self):
+        fallback = FakeGenerator("fallback")
+        generator = AnswerGenerator(FakeGenerator("primary", error=RuntimeError("unavailable")),
+                                    fallbacks=[AnswerGenerator(fallback)])
+
+        self.assertEqual(["fallback"], generator.run("prompt")["replies"])
+        self.assertEqual(1, fallback.calls)
+
+    def test_hedged_reply(self):
+        primary = FakeGenerator("primary", delay=1.0)
+        generator = AnswerGenerator(primary,
+                                    fallbacks=[AnswerGenerator(FakeGenerator("fallback"))],
+                                    hedging=HedgingPolicy(initial_delay=0.05, min_delay=0.0))
+
+        self.assertEqual(["fallback"], generator.run("prompt")["replies"])
+
+    def test_no_fallback_needed(self):
+        fallback = FakeGenerator("fallback")
+        generator = AnswerGenerator(FakeGenerator("primary"),
+                                    fallbacks=[AnswerGenerator(fallback)],
+                                    hedging=HedgingPolicy(initial_delay=1.0))
+
+        self.assertEqual(["primary"], generator.run("prompt")["replies"])
+        self.assertEqual(0, fallback.calls)
+
+    def test_async_fallback_on_error(self):
+        fallback = FakeGenerator("fallback")
+        generator = AnswerGenerator(FakeGenerator("primary", error=RuntimeError("unavailable")),
+                                    fallbacks=[AnswerGenerator(fallback)])
+
+        self.assertEqual(["fallback"], asyncio.run(generator.run_async("prompt"))["replies"])
+        self.assertEqual(1, fallback.calls)
+
+    def test_fallback_answers_are_not_cached(self):
+        primary = FakeGenerator("primary", error=RuntimeError("unavailable"))
+        fallback = FakeGenerator("fallback")
+        pool = PipelinePool(llm=primary, scheduler=LLMScheduler(), fallback_llms=[fallback])
+        generator = JsonAnswerGenerator("system", cache=InMemoryAnswerCache(), pool=pool)
+
+        self.assertEqual("fallback", generator.answer("question", {"type": "string"}))
+        self.assertEqual(0, len(generator.cache))
+
+        primary.error = None
+        self.assertEqual("primary", generator.answer("question", {"type": "string"}))
+        self.assertEqual("primary", generator.answer("question", {"type": "string"}))
+        self.assertEqual(1, len(generator.cache))
+
+    def test_async_fallback_answers_are_not_cached(self):
+        pool = PipelinePool(llm=FakeGenerator("primary", error=RuntimeError("unavailable")),
+                            scheduler=LLMScheduler(),
+                            fallback_llms=[FakeGenerator("fallback")])
+        generator = JsonAnswerGenerator("system", cache=InMemoryAnswerCache(), pool=pool)
+
+        self.assertEqual("fallback", asyncio.run(generator.aanswer("question", {"type": "string"})))
+        self.assertEqual(0, len(generator.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,17 @@
+import asyncio
+import json
+import re
+import threading
+import typing
 import unittest
+from unittest import mock
 
+from haystack.components.generators import OpenAIGenerator
 from jsonschema import validate, ValidationError
 
-from smart_docx.llm.json_answer_generator import JsonAnswerGenerator
+from smart_docx.llm.budget import AnswerBudget, Deadline, DeadlineExceededError, RetryBudgetExceededError, answer_budget
+from smart_docx.llm.json_answer_generator import JsonAnswerGenerator, PipelinePool, GenerationMode
+from smart_docx.llm.providers import _to_gemini_schema
 
 
 class TestJsonAnswerGenerator(unittest.TestCase):
@@ -35,5 +44,525 @@ class TestJsonAnswerGenerator(unittest.TestCase):
         self.assertTrue(valid, "The generated answer does not conform to the expected JSON schema")
 
 
+class TestPipelinePool(unittest.TestCase):
+    def create_llm(self) -> mock.Mock:
+        llm = mock.Mock(spec=OpenAIGenerator)
+        llm.model = "gpt-4o"
+        return llm
+
+    def test_pipelines_are_reused(self):
+        pool = PipelinePool(llm=self.create_llm())
+
+        with pool.pipeline() as first:
+            pass
+        with pool.pipeline() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual("gpt-4o", pool.model)
+
+    def test_model_is_resolved_once(self):
+        pool = PipelinePool(llm=self.create_llm())
+
+        with mock.patch("smart_docx.llm.providers.OpenAIProvider.model") as model:
+            for _ in range(3):
+                self.assertEqual("gpt-4o", pool.model)
+
+        model.assert_not_called()
+
+    def test_concurrent_callers_get_separate_pipelines_sharing_llm(self):
+        llm = self.create_llm()
+        pool = PipelinePool(llm=llm)
+
+        with pool.pipeline() as first, pool.pipeline() as second:
+            self.assertIsNot(first, second)
+            self.assertIs(llm, first.get_component("llm").generator)
+            self.assertIs(llm, second.get_component("llm").generator)
+
+    def test_max_size(self):
+        pool = PipelinePool(llm=self.create_llm(), max_size=1)
+        acquired = threading.Event()
+
+        def acquire():
+            with pool.pipeline():
+                acquired.set()
+
+        with pool.pipeline():
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            self.assertFalse(acquired.wait(0.1))
+
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_system_prompt_per_call(self):
+        pool = mock.MagicMock()
+        pipeline = pool.pipeline.return_value.__enter__.return_value
+        pipeline.run.return_value = {"output_validator": {"valid_reply": "answer"}}
+        generator = JsonAnswerGenerator("default system", pool=pool)
+
+        generator.answer("question", {"type": "string"})
+        generator.answer("question", {"type": "string"}, system_prompt="template system")
+
+        prompts = [call.args[0]["llm"]["prompt"] for call in pipeline.run.call_args_list]
+        self.assertTrue(prompts[0].startswith("default system"))
+        self.assertTrue(prompts[1].startswith("template system"))
+
+
+class TestStructuredOutput(unittest.TestCase):
+    def create_pool(self, structured_reply: str, text_reply: str = "text", json_reply: str = "{}") -> PipelinePool:
+        llm = mock.Mock(spec=OpenAIGenerator)
+        llm.model = "gpt-4o"
+
+        def run(prompt: str, generation_kwargs: dict = None):
+            if generation_kwargs and "response_format" in generation_kwargs:
+                return {"replies": [structured_reply]}
+            if "JSON" in prompt:
+                return {"replies": [json_reply]}
+            return {"replies": [text_reply]}
+
+        llm.run.side_effect = run
+        return PipelinePool(llm=llm)
+
+    def test_structured_object(self):
+        pool = self.create_pool('{"name": "Ana", "age": 30}')
+        generator = JsonAnswerGenerator("system", pool=pool)
+        schema = {"type": "object", "properties": {"name": {"type": "string"}, "age": {"type": "integer"}}}
+
+        self.assertEqual({"name": "Ana", "age": 30}, generator.answer("question", schema))
+        self.assertEqual(1, pool.llm.run.call_count)
+        response_format = pool.llm.run.call_args.kwargs["generation_kwargs"]["response_format"]
+        self.assertEqual(schema, response_format["json_schema"]["schema"])
+
+    def test_structured_primitive_is_wrapped(self):
+        pool = self.create_pool('{"value": ["a", "b"]}')
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        self.assertEqual(["a", "b"], generator.answer("question", {"type": "array", "items": {"type": "string"}}))
+        self.assertEqual(1, pool.llm.run.call_count)
+        response_format = pool.llm.run.call_args.kwargs["generation_kwargs"]["response_format"]
+        self.assertEqual(["value"], response_format["json_schema"]["schema"]["required"])
+
+    def test_invalid_structured_reply_falls_back_to_two_stage(self):
+        pool = self.create_pool('{"value": 10}', json_reply='Ljubljana')
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        self.assertEqual("Ljubljana", generator.answer("question", {"type": "string"}))
+        self.assertEqual(3, pool.llm.run.call_count)
+
+    def test_two_stage_mode(self):
+        pool = self.create_pool('{"value": "structured"}', json_reply='two stage')
+        generator = JsonAnswerGenerator("system", pool=pool, mode=GenerationMode.TWO_STAGE)
+
+        self.assertEqual("two stage", generator.answer("question", {"type": "string"}))
+        self.assertEqual(2, pool.llm.run.call_count)
+
+    def test_answer_many(self):
+        pool = self.create_pool('{"capital": "Ljubljana", "population": "two million"}', json_reply="2100000")
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        answers = generator.answer_many({"capital": "Capital of Slovenia?", "population": "Population of Slovenia?"},
+                                        {"capital": {"type": "string"}, "population": {"type": "string", "pattern": "^[0-9]+$"}})
+
+        self.assertEqual({"capital": "Ljubljana", "population": "2100000"}, answers)
+        combined_schema = pool.llm.run.call_args_list[0].kwargs["generation_kwargs"]["response_format"]["json_schema"]["schema"]
+        self.assertEqual(["capital", "population"], combined_schema["required"])
+        # population did not match its schema, so it was generated on its own (structured, then two stage)
+        self.assertEqual(4, pool.llm.run.call_count)
+
+    def test_custom_generator(self):
+        class CustomGenerator:
+            model = "custom"
+
+            def __init__(self):
+                self.prompts = []
+
+            def run(self, prompt: str):
+                self.prompts.append(prompt)
+                return {"replies": ["Ljubljana"]}
+
+        pool = PipelinePool(llm=CustomGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        self.assertEqual("Ljubljana", generator.answer("question", {"type": "string"}))
+        self.assertEqual("custom", pool.model)
+        # no structured output support, the answer is generated in two stages
+        self.assertEqual(2, len(pool.llm.prompts))
+
+    def test_custom_generator_structured_output(self):
+        class CustomGenerator:
+            def run(self, prompt: str):
+                raise AssertionError("Structured output should be used")
+
+            def supports_structured_output(self, schema: dict) -> bool:
+                return True
+
+            def run_structured(self, prompt: str, schema: dict):
+                return {"replies": ['{"value": "Ljubljana"}']}
+
+        pool = PipelinePool(llm=CustomGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        self.assertEqual("Ljubljana", generator.answer("question", {"type": "string"}))
+        self.assertEqual("CustomGenerator", pool.model)
+
+    def test_rejected_schema_falls_back_to_two_stages(self):
+        class SchemaError(Exception):
+            pass
+
+        class CustomGenerator:
+            def __init__(self):
+                self.prompts = []
+
+            def run(self, prompt: str):
+                self.prompts.append(prompt)
+                return {"replies": ["Ljubljana"]}
+
+            def supports_structured_output(self, schema: dict) -> bool:
+                return True
+
+            def run_structured(self, prompt: str, schema: dict):
+                raise SchemaError("Invalid response schema")
+
+            def is_schema_error(self, error: Exception) -> bool:
+                return isinstance(error, SchemaError)
+
+        pool = PipelinePool(llm=CustomGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool)
+
+        self.assertEqual("Ljubljana", generator.answer("question", {"type": "string"}))
+        self.assertEqual("Ljubljana", asyncio.run(generator.aanswer("other question", {"type": "string"})))
+        self.assertEqual(4, len(pool.llm.prompts))
+
+    def test_other_structured_output_errors_are_raised(self):
+        class CustomGenerator:
+            def run(self, prompt: str):
+                raise AssertionError("Errors other than schema errors should not fall back")
+
+            def supports_structured_output(self, schema: dict) -> bool:
+                return True
+
+            def run_structured(self, prompt: str, schema: dict):
+                raise ConnectionError("Connection reset")
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=CustomGenerator()))
+
+        with self.assertRaises(ConnectionError):
+            generator.answer("question", {"type": "string"})
+
+    def test_invalid_reply_is_converted_again(self):
+        class CustomGenerator:
+            def __init__(self):
+                self.replies = ["Ana is 30", '{"name": "Ana", "age": 30', '{"name": "Ana", "age": 30}']
+
+            def run(self, prompt: str):
+                return {"replies": [self.replies.pop(0)]}
+
+        pool = PipelinePool(llm=CustomGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool, mode=GenerationMode.TWO_STAGE)
+        schema = {"type": "object", "properties": {"name": {"type": "string"}, "age": {"type": "integer"}}}
+
+        self.assertEqual({"name": "Ana", "age": 30}, generator.answer("question", schema))
+        self.assertEqual([], pool.llm.replies)
+
+    def test_retry_budget(self):
+        class InvalidGenerator:
+            def __init__(self):
+                self.calls = 0
+
+            def run(self, prompt: str):
+                self.calls += 1
+                return {"replies": ["not json"]}
+
+        pool = PipelinePool(llm=InvalidGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool, mode=GenerationMode.TWO_STAGE)
+        schema = {"type": "object", "properties": {"name": {"type": "string"}}}
+
+        with answer_budget(AnswerBudget(max_retries=1)), self.assertRaises(RetryBudgetExceededError):
+            generator.answer("question", schema)
+        # the answer, its conversion and one retry
+        self.assertEqual(3, pool.llm.calls)
+
+    def test_default_retry_budget(self):
+        class InvalidGenerator:
+            def run(self, prompt: str):
+                return {"replies": ["not json"]}
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=InvalidGenerator()), mode=GenerationMode.TWO_STAGE)
+        schema = {"type": "object", "properties": {"name": {"type": "string"}}}
+
+        # without a budget the retries end at the pipeline's run limit
+        with self.assertRaises(RetryBudgetExceededError):
+            generator.answer("question", schema)
+        with self.assertRaises(RetryBudgetExceededError):
+            asyncio.run(generator.aanswer("question", schema))
+
+    def test_expired_deadline(self):
+        class Generator:
+            def run(self, prompt: str):
+                return {"replies": ["Ana"]}
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=Generator()), mode=GenerationMode.TWO_STAGE)
+        deadline = Deadline()
+        deadline.cancel()
+
+        with answer_budget(AnswerBudget(deadline=deadline)), self.assertRaises(DeadlineExceededError):
+            generator.answer("question", {"type": "string"})
+
+    def test_gemini_schema(self):
+        schema = {
+            "type": "object",
+            "title": "Nutrition",
+            "additionalProperties": False,
+            "properties": {
+                "calories": {"type": "integer", "minimum": 0},
+                "tags": {"type": "array", "items": {"type": ["string", "null"]}, "minItems": 1},
+            },
+            "required": ["calories"]
+        }
+
+        self.assertEqual({
+            "type": "object",
+            "properties": {
+                "calories": {"type": "integer"},
+                "tags": {"type": "array", "items": {"type": "string", "nullable": True}, "min_items": 1},
+            },
+            "required": ["calories"]
+        }, _to_gemini_schema(schema))
+
+    def test_unsupported_gemini_schema(self):
+        self.assertIsNone(_to_gemini_schema({"anyOf": [{"type": "string"}, {"type": "integer"}]}))
+        self.assertIsNone(_to_gemini_schema({"type": ["string", "integer"]}))
+        self.assertIsNone(_to_gemini_schema({"type": "object", "properties": {"a": {"$ref": "#/definitions/a"}}}))
+        self.assertIsNone(_to_gemini_schema({"type": "object"}))
+        self.assertIsNone(_to_gemini_schema({"type": "array", "items": {"type": "object", "properties": {}}}))
+
+
+class PagedGenerator:
+    # replies with the requested page of the numbers from 1 to total, pages in invalid_pages are invalid at first
+    def __init__(self, total: int, invalid_pages: typing.Iterable[int] = ()):
+        self.total = total
+        self.invalid_pages = set(invalid_pages)
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def run(self, prompt: str):
+        with self.lock:
+            self.prompts.append(prompt)
+        if "JSON shema" not in prompt:
+            return {"replies": ["the numbers"]}
+
+        invalid_reply = re.search(r"ni ustrezal shemi:\n(.*)\n", prompt)
+        if invalid_reply:
+            return {"replies": [re.sub(r'"invalid-(\d+)"', r"\1", invalid_reply.group(1))]}
+
+        page = re.search(r"od (\d+)\. do (\d+)\.", prompt)
+        start, end = (int(page.group(1)), int(page.group(2))) if page else (1, self.total)
+        items = list(range(start, min(end, self.total) + 1))
+        if start in self.invalid_pages:
+            items[0] = f"invalid-{items[0]}"
+        return {"replies": [json.dumps(items)]}
+
+
+class TestChunkedArrays(unittest.TestCase):
+    def create_generator(self, llm: PagedGenerator, **kwargs) -> JsonAnswerGenerator:
+        return JsonAnswerGenerator("system", pool=PipelinePool(llm=llm), mode=GenerationMode.TWO_STAGE, **kwargs)
+
+    def test_pages_are_generated_in_parallel(self):
+        llm = PagedGenerator(total=45)
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 50}
+
+        self.assertEqual(list(range(1, 46)), self.create_generator(llm).answer_array("numbers", schema, chunk_size=20))
+        # three pages, each answered and converted
+        self.assertEqual(6, len(llm.prompts))
+
+    def test_only_invalid_pages_are_retried(self):
+        llm = PagedGenerator(total=45, invalid_pages=[21])
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 50}
+
+        self.assertEqual(list(range(1, 46)), self.create_generator(llm).answer_array("numbers", schema, chunk_size=20))
+        retries = [prompt for prompt in llm.prompts if "ni ustrezal shemi" in prompt]
+        self.assertEqual(1, len(retries))
+        self.assertIn("invalid-21", retries[0])
+
+    def test_pages_without_max_items(self):
+        llm = PagedGenerator(total=45)
+        schema = {"type": "array", "items": {"type": "integer"}}
+
+        self.assertEqual(list(range(1, 46)), self.create_generator(llm, max_chunk_workers=1).answer_array("numbers", schema, chunk_size=20))
+        # pages are requested until one is not full
+        self.assertEqual(6, len(llm.prompts))
+
+    def test_pages_after_a_short_page_are_not_requested(self):
+        llm = PagedGenerator(total=45)
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 200}
+
+        self.assertEqual(list(range(1, 46)), self.create_generator(llm, max_chunk_workers=2).answer_array("numbers", schema, chunk_size=20))
+        # at most max_chunk_workers pages are requested ahead, not all ten pages up to maxItems
+        pages = [prompt for prompt in llm.prompts if "JSON shema" not in prompt]
+        self.assertLessEqual(len(pages), 4)
+
+    def test_async_pages_after_a_short_page_are_not_requested(self):
+        llm = PagedGenerator(total=45)
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 200}
+
+        result = asyncio.run(self.create_generator(llm, max_chunk_workers=2).aanswer_array("numbers", schema, chunk_size=20))
+
+        self.assertEqual(list(range(1, 46)), result)
+        pages = [prompt for prompt in llm.prompts if "JSON shema" not in prompt]
+        self.assertLessEqual(len(pages), 4)
+
+    def test_too_many_pages_without_max_items(self):
+        llm = PagedGenerator(total=1000)
+        schema = {"type": "array", "items": {"type": "integer"}}
+
+        with self.assertRaises(ValueError):
+            self.create_generator(llm).answer_array("numbers", schema, chunk_size=5)
+        with self.assertRaises(ValueError):
+            asyncio.run(self.create_generator(llm).aanswer_array("numbers", schema, chunk_size=5))
+
+    def test_invalid_joined_array_is_generated_at_once(self):
+        llm = PagedGenerator(total=45)
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 50, "minItems": 45, "uniqueItems": True}
+        generator = self.create_generator(llm)
+
+        with mock.patch("smart_docx.llm.json_answer_generator._join_chunks", return_value=[1, 1]):
+            self.assertEqual(list(range(1, 46)), generator.answer_array("numbers", schema, chunk_size=20))
+        self.assertNotRegex(llm.prompts[-1], r"od \d+\. do")
+
+    def test_async_pages(self):
+        llm = PagedGenerator(total=45, invalid_pages=[41])
+        schema = {"type": "array", "items": {"type": "integer"}, "maxItems": 50}
+
+        self.assertEqual(list(range(1, 46)), asyncio.run(self.create_generator(llm).aanswer_array("numbers", schema, chunk_size=20)))
+        self.assertEqual(7, len(llm.prompts))
+
+
+class TestAsyncAnswers(unittest.TestCase):
+    def test_invalid_reply_is_converted_again(self):
+        class AsyncGenerator:
+            def __init__(self):
+                self.replies = ["Ana is 30", '{"name": "Ana", "age": 30', '{"name": "Ana", "age": 30}']
+
+            def run(self, prompt: str):
+                raise AssertionError("run_async should be used")
+
+            async def run_async(self, prompt: str):
+                return {"replies": [self.replies.pop(0)]}
+
+        pool = PipelinePool(llm=AsyncGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool, mode=GenerationMode.TWO_STAGE)
+        schema = {"type": "object", "properties": {"name": {"type": "string"}, "age": {"type": "integer"}}}
+
+        self.assertEqual({"name": "Ana", "age": 30}, asyncio.run(generator.aanswer("question", schema)))
+        self.assertEqual([], pool.llm.replies)
+
+    def test_sync_generator(self):
+        class Generator:
+            def run(self, prompt: str):
+                return {"replies": ["Ljubljana"]}
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=Generator()))
+
+        self.assertEqual("Ljubljana", asyncio.run(generator.aanswer("question", {"type": "string"})))
+
+    def test_async_pipelines_are_reused(self):
+        pool = PipelinePool(llm=mock.Mock(spec=OpenAIGenerator, model="gpt-4o"), max_size=2)
+
+        async def acquire():
+            async with pool.async_pipeline() as first:
+                pass
+            async with pool.async_pipeline() as second, pool.async_pipeline() as third:
+                return first, second, third
+
+        first, second, third = asyncio.run(acquire())
+        self.assertIs(first, second)
+        self.assertIsNot(second, third)
+
+    def test_async_pipelines_are_bounded(self):
+        pool = PipelinePool(llm=mock.Mock(spec=OpenAIGenerator, model="gpt-4o"), max_size=1)
+        pipelines = []
+
+        async def acquire():
+            async with pool.async_pipeline() as pipeline:
+                pipelines.append(pipeline)
+                await asyncio.sleep(0.01)
+
+        async def acquire_concurrently():
+            await asyncio.gather(*(acquire() for _ in range(3)))
+
+        asyncio.run(acquire_concurrently())
+        # callers waited for the only pipeline instead of creating their own
+        self.assertEqual(1, len({id(pipeline) for pipeline in pipelines}))
+        # every event loop has its own semaphore
+        asyncio.run(acquire_concurrently())
+        self.assertEqual(6, len(pipelines))
+
+    def test_answer_many(self):
+        class Generator:
+            async def run_async(self, prompt: str):
+                return {"replies": ["Ljubljana"]}
+
+            def run(self, prompt: str):
+                raise AssertionError("run_async should be used")
+
+            def supports_structured_output(self, schema: dict) -> bool:
+                return True
+
+            def run_structured(self, prompt: str, schema: dict):
+                raise AssertionError("run_structured_async should be used")
+
+            async def run_structured_async(self, prompt: str, schema: dict):
+                if "capital" in schema["properties"]:
+                    return {"replies": ['{"capital": "Ljubljana", "population": "two million"}']}
+                return {"replies": ['{"value": "2100000"}']}
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=Generator()))
+
+        answers = asyncio.run(generator.aanswer_many({"capital": "Capital of Slovenia?", "population": "Population of Slovenia?"},
+                                                     {"capital": {"type": "string"}, "population": {"type": "string", "pattern": "^[0-9]+$"}}))
+
+        self.assertEqual({"capital": "Ljubljana", "population": "2100000"}, answers)
+
+    def test_retry_budget(self):
+        class InvalidGenerator:
+            def __init__(self):
+                self.calls = 0
+
+            def run(self, prompt: str):
+                raise AssertionError("run_async should be used")
+
+            async def run_async(self, prompt: str):
+                self.calls += 1
+                return {"replies": ["not json"]}
+
+        async def answer():
+            with answer_budget(AnswerBudget(max_retries=1)):
+                return await generator.aanswer("question", {"type": "object", "properties": {"name": {"type": "string"}}})
+
+        pool = PipelinePool(llm=InvalidGenerator())
+        generator = JsonAnswerGenerator("system", pool=pool, mode=GenerationMode.TWO_STAGE)
+
+        with self.assertRaises(RetryBudgetExceededError):
+            asyncio.run(answer())
+        self.assertEqual(3, pool.llm.calls)
+
+    def test_expired_deadline(self):
+        class Generator:
+            def run(self, prompt: str):
+                return {"replies": ["Ana"]}
+
+        async def answer():
+            with answer_budget(AnswerBudget(deadline=deadline)):
+                return await generator.aanswer("question", {"type": "string"})
+
+        generator = JsonAnswerGenerator("system", pool=PipelinePool(llm=Generator()), mode=GenerationMode.TWO_STAGE)
+        deadline = Deadline()
+        deadline.cancel()
+
+        with self.assertRaises(DeadlineExceededError):
+            asyncio.run(answer())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+from smart_docx.llm.json_repair import repair_reply, remove_trailing_commas, strip_code_fences
+
+
+class TestJsonRepair(unittest.TestCase):
+    def test_strip_code_fences(self):
+        self.assertEqual('{"a": 1}', strip_code_fences('```JSON\n{"a": 1}\n```'))
+        self.assertEqual('Here you go:\n```python\n[1, 2]\n``` bye', strip_code_fences('Here you go:\n```python\n[1, 2]\n``` bye'))
+        self.assertEqual('{"a": 1}', strip_code_fences(' {"a": 1} '))
+
+    def test_remove_trailing_commas(self):
+        self.assertEqual('{"a": [1, 2]}', remove_trailing_commas('{"a": [1, 2,],}'))
+
+    def test_trailing_commas(self):
+        value, fixes = repair_reply('{"name": "Ana", "tags": ["a", "b",],}', {"type": "object"})
+        self.assertEqual({"name": "Ana", "tags": ["a", "b"]}, value)
+        self.assertEqual(["trailing_comma"], fixes)
+
+    def test_single_quotes(self):
+        value, fixes = repair_reply("{'name': 'Ana', 'active': True}", {"type": "object"})
+        self.assertEqual({"name": "Ana", "active": True}, value)
+        self.assertEqual(["python_literal"], fixes)
+
+    def test_fenced_code_with_surrounding_text(self):
+        value, fixes = repair_reply('Odgovor:\n```js\n{"a": 1}\n```', {"type": "object"})
+        self.assertEqual({"a": 1}, value)
+        self.assertEqual(["code_fence"], fixes)
+
+        value, fixes = repair_reply('The answer is ["a", "b"].', {"type": "array", "items": {"type": "string"}})
+        self.assertEqual(["a", "b"], value)
+        self.assertEqual(["surrounding_text"], fixes)
+
+    def test_numbers_as_strings(self):
+        schema = {
+            "type": "object",
+            "properties": {
+                "calories": {"type": "integer"},
+                "protein": {"type": "number"},
+                "vegan": {"type": "boolean"},
+            }
+        }
+        value, fixes = repair_reply('{"calories": "450", "protein": "30.5", "vegan": "false"}', schema)
+        self.assertEqual({"calories": 450, "protein": 30.5, "vegan": False}, value)
+        self.assertEqual(["string_to_number", "string_to_number", "string_to_boolean"], fixes)
+
+        value, fixes = repair_reply("42", {"type": "integer"})
+        self.assertEqual(42, value)
+
+    def test_lone_object_for_array(self):
+        schema = {"type": "array", "items": {"type": "object"}}
+        value, fixes = repair_reply('{"name": "Ana"}', schema)
+        self.assertEqual([{"name": "Ana"}], value)
+        self.assertEqual(["wrapped_in_array"], fixes)
+
+    def test_quoted_simple_string(self):
+        value, fixes = repair_reply('"Pečen losos"', {"type": "string"})
+        self.assertEqual("Pečen losos", value)
+        self.assertEqual(["unquoted_string"], fixes)
+
+        value, fixes = repair_reply("'Losos'", {"type": "string"})
+        self.assertEqual("'Losos'", value)
+        self.assertEqual([], fixes)
+
+    def test_valid_string_starting_and_ending_with_quotes(self):
+        reply = '"Dober dan" je rekel "Janez"'
+        value, fixes = repair_reply(reply, {"type": "string"})
+        self.assertEqual(reply, value)
+        self.assertEqual([], fixes)
+
+    def test_string_with_fence_inside_text(self):
+        reply = 'Use ```python\nprint(1)\n``` to print'
+        value, fixes = repair_reply(reply, {"type": "string"})
+        self.assertEqual(reply, value)
+        self.assertEqual([], fixes)
+
+    def test_unparsable_reply(self):
+        with self.assertRaises(ValueError):
+            repair_reply('{"name": ', {"type": "object"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 import json
 import unittest
 
-from smart_docx.llm.jsonschema_output_validator import OutputValidator
+from jsonschema import ValidationError
+
+from smart_docx.llm.jsonschema_output_validator import OutputValidator, SchemaType, compile_schema
+from smart_docx.llm.stats import collect_answer_stats
 
 
 class TestOutputValidator(unittest.TestCase):
@@ -102,5 +105,88 @@ class TestOutputValidator(unittest.TestCase):
         self.assertEqual(expected_reply, result["valid_reply"])
 
 
+    def test_python_literal_string_array(self):
+        schema = {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+        validator = OutputValidator()
+        result = validator.run("['apple', 'banana']", schema)
+        self.assertEqual(["apple", "banana"], result["valid_reply"])
+
+    def test_unparsable_string_array(self):
+        schema = {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+        validator = OutputValidator()
+        result = validator.run("['apple', 'banana'", schema)
+        self.assertIn("invalid_reply", result)
+        self.assertIn("error_message", result)
+
+    def test_repaired_reply(self):
+        schema = {
+            "type": "object",
+            "properties": {"calories": {"type": "integer"}},
+            "required": ["calories"]
+        }
+        validator = OutputValidator()
+        with collect_answer_stats() as stats:
+            result = validator.run("```json\n{'calories': '450',}\n```", schema)
+        self.assertEqual({"calories": 450}, result["valid_reply"])
+        self.assertEqual(1, stats.repairs)
+        self.assertEqual({"code_fence": 1, "python_literal": 1, "string_to_number": 1}, stats.repair_fixes)
+
+    def test_quoted_simple_string(self):
+        validator = OutputValidator()
+        with collect_answer_stats() as stats:
+            self.assertEqual({"valid_reply": "Ljubljana"}, validator.run('"Ljubljana"', {"type": "string"}))
+            self.assertEqual({"valid_reply": "Ljubljana"}, validator.run('```json\n"Ljubljana"\n```', {"type": "string"}))
+            self.assertEqual({"valid_reply": "Ljubljana\n"}, validator.run("Ljubljana\n", {"type": "string"}))
+        self.assertEqual(2, stats.repairs)
+        self.assertEqual({"unquoted_string": 2, "code_fence": 1}, stats.repair_fixes)
+
+    def test_valid_strings_are_not_changed(self):
+        validator = OutputValidator()
+        for reply in ['"Dober dan" je rekel "Janez"', 'Use ```python\nprint(1)\n``` to print']:
+            with collect_answer_stats() as stats:
+                self.assertEqual({"valid_reply": reply}, validator.run(reply, {"type": "string"}))
+            self.assertEqual(0, stats.repairs)
+
+    def test_repair_disabled(self):
+        schema = {"type": "integer"}
+        validator = OutputValidator(repair=False)
+        with collect_answer_stats() as stats:
+            result = validator.run("42", schema)
+            self.assertEqual({"valid_reply": '"Ljubljana"'}, validator.run('"Ljubljana"', {"type": "string"}))
+        self.assertIn("invalid_reply", result)
+        self.assertEqual(0, stats.repairs)
+
+
+class TestCompileSchema(unittest.TestCase):
+    def test_compiled_schema_is_cached(self):
+        schema = {"type": "object", "properties": {"name": {"type": "string"}}}
+
+        compiled_schema = compile_schema(schema)
+
+        self.assertIs(compiled_schema, compile_schema({"properties": {"name": {"type": "string"}}, "type": "object"}))
+        self.assertIsNot(compiled_schema, compile_schema({"type": "object"}))
+        self.assertEqual(SchemaType.COMPLEX, compiled_schema.schema_type)
+
+    def test_schema_type(self):
+        self.assertEqual(SchemaType.SIMPLE, compile_schema({"type": "string"}).schema_type)
+        self.assertEqual(SchemaType.SIMPLE, compile_schema({"type": ["integer", "null"]}).schema_type)
+        self.assertEqual(SchemaType.SIMPLE_ARRAY, compile_schema({"type": "array", "items": {"type": "string"}}).schema_type)
+        self.assertEqual(SchemaType.COMPLEX, compile_schema({"type": "array", "items": {"type": "object"}}).schema_type)
+        self.assertEqual(SchemaType.COMPLEX, compile_schema({"type": "array"}).schema_type)
+
+    def test_validate(self):
+        compiled_schema = compile_schema({"type": "array", "items": {"type": "integer"}, "minItems": 1})
+
+        compiled_schema.validate([1, 2])
+        with self.assertRaises(ValidationError):
+            compiled_schema.validate([])
+
+
 if __name__ == "__main__":
     unittest.main()
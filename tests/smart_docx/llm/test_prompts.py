@@ -0,0 +1,74 @@
+import json
+import unittest
+
+import jsonschema
+
+from smart_docx.llm.prompts import build_answer_prompt, build_converter_prompt, minify_schema, record_prompt
+from smart_docx.llm.stats import collect_answer_stats
+
+ADDRESS_SCHEMA = {
+    "type": "object",
+    "title": "Naslov",
+    "properties": {
+        "street": {"type": "string", "description": "Street"},
+        "city": {"type": "string", "description": "Mesto, v katerem oseba živi"},
+    },
+    "required": ["street", "city"],
+}
+
+
+class TestPrompts(unittest.TestCase):
+    def test_minify_schema(self):
+        schema = {
+            "$schema": "http://json-schema.org/draft-07/schema#",
+            "type": "object",
+            "properties": {
+                "title": {"type": "string", "description": ""},
+                "home": ADDRESS_SCHEMA,
+                "work": ADDRESS_SCHEMA,
+                "previous": {"type": "array", "items": ADDRESS_SCHEMA},
+            },
+        }
+
+        minified = minify_schema(schema)
+
+        self.assertNotIn("$schema", minified)
+        self.assertEqual({"type": "string"}, minified["properties"]["title"])
+        self.assertEqual({"$ref": "#/$defs/s0"}, minified["properties"]["home"])
+        self.assertEqual({"$ref": "#/$defs/s0"}, minified["properties"]["previous"]["items"])
+        self.assertEqual({"type": "string"}, minified["$defs"]["s0"]["properties"]["street"])
+        self.assertIn("description", minified["$defs"]["s0"]["properties"]["city"])
+        self.assertLess(len(json.dumps(minified)), len(json.dumps(schema)))
+
+        reply = {"title": "t", "home": {"street": "s", "city": "c"}, "work": {"street": "s"}, "previous": []}
+        with self.assertRaises(jsonschema.ValidationError):
+            jsonschema.validate(reply, minified)
+        jsonschema.validate({**reply, "work": {"street": "s", "city": "c"}}, minified)
+
+    def test_converter_prompt_prefix(self):
+        first = build_converter_prompt({"type": "string"}, "question", answer="answer")
+        retry = build_converter_prompt({"type": "string"}, "question", invalid_reply="{", error_message="invalid")
+        other = build_converter_prompt({"type": "integer"}, "other question", answer="other answer")
+
+        self.assertEqual(first.prefix, retry.prefix)
+        self.assertIn('{"type":"string"}', first.prefix)
+        self.assertNotIn("question", retry.text)
+        self.assertIn("invalid", retry.suffix)
+        self.assertTrue(other.text.startswith(first.prefix.split("JSON shema: ")[0]))
+
+    def test_answer_prompt(self):
+        self.assertEqual("question", build_answer_prompt("", "question").text)
+        self.assertEqual("system\n\nquestion", build_answer_prompt("system ", "question").text)
+
+    def test_record_prompt(self):
+        prompt = build_answer_prompt("system prompt", "question")
+        with collect_answer_stats() as stats:
+            record_prompt(prompt)
+
+        self.assertEqual(1, stats.prompts)
+        self.assertEqual(prompt.estimated_tokens, stats.estimated_prompt_tokens)
+        self.assertEqual(prompt.prefix_tokens, stats.estimated_prefix_tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
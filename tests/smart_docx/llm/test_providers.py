@@ -0,0 +1,137 @@
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from haystack.components.generators import OpenAIGenerator
+from haystack.utils import Secret
+from openai.types.chat import ChatCompletion
+
+from smart_docx.llm import providers
+from smart_docx.llm.providers import Provider, OpenAIProvider, GeminiProvider, create_llm, provider_for, register_provider
+
+
+def run_python(code: str, env: dict = None) -> str:
+    result = subprocess.run([sys.executable, "-c", code],
+                            env={**os.environ, **(env or {})},
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return result.stdout.strip()
+
+
+class FakeProvider(Provider):
+    name = "fake"
+    env_var = "SMART_DOCX_FAKE_API_KEY"
+
+    def create(self, api_key: str):
+        return {"api_key": api_key}
+
+
+class TestProviders(unittest.TestCase):
+    def test_definitions_do_not_import_haystack(self):
+        loaded = run_python("import sys\n"
+                            "import smart_docx.smart_docx, smart_docx.templates.registry\n"
+                            "print(','.join(m for m in sys.modules if m.startswith(('haystack', 'openai'))))")
+
+        self.assertEqual("", loaded)
+
+    def test_only_selected_provider_is_imported(self):
+        loaded = run_python("import sys\n"
+                            "from smart_docx.llm.providers import create_llm\n"
+                            "create_llm()\n"
+                            "print('haystack_integrations' in sys.modules)",
+                            env={"OPENAI_API_TOKEN": "token", "GOOGLE_API_KEY": ""})
+
+        self.assertEqual("False", loaded)
+
+    def test_provider_for(self):
+        self.assertEqual("openai", provider_for(mock.Mock(spec=OpenAIGenerator)).name)
+        self.assertEqual("generic", provider_for(object()).name)
+
+    def test_create_llm(self):
+        self.addCleanup(providers._providers.pop, "fake", None)
+        register_provider(FakeProvider())
+
+        with mock.patch.dict(os.environ, {"OPENAI_API_TOKEN": "", "GOOGLE_API_KEY": "", "SMART_DOCX_FAKE_API_KEY": "key"}):
+            self.assertEqual({"api_key": "key"}, create_llm())
+            self.assertEqual({"api_key": "key"}, create_llm("fake"))
+            with self.assertRaises(ValueError):
+                create_llm("openai")
+
+        with self.assertRaises(ValueError):
+            create_llm("unknown")
+
+
+class TestAsyncProviders(unittest.TestCase):
+    # the async paths call the provider sdks directly, with the settings of the haystack generators
+
+    def test_openai_run_async(self):
+        generator = OpenAIGenerator(api_key=Secret.from_token("token"), model="gpt-4o", system_prompt="system")
+        completion = ChatCompletion.model_validate({
+            "id": "id", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Ljubljana"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+        })
+        provider = OpenAIProvider()
+        client = provider._async_client(generator)
+
+        with mock.patch.object(client.chat.completions, "create", new=mock.AsyncMock(return_value=completion)) as create:
+            result = asyncio.run(provider.run_structured_async(generator, "prompt", {"type": "object"}))
+
+        self.assertEqual(["Ljubljana"], result["replies"])
+        self.assertEqual(10, result["meta"][0]["usage"]["prompt_tokens"])
+        self.assertEqual("system", create.call_args.kwargs["messages"][0]["content"])
+        self.assertEqual("json_schema", create.call_args.kwargs["response_format"]["type"])
+
+    def test_gemini_run_structured_async(self):
+        from google.generativeai import GenerativeModel, protos
+        from google.generativeai.types import GenerateContentResponse
+        from haystack_integrations.components.generators.google_ai import GoogleAIGeminiGenerator
+
+        generator = GoogleAIGeminiGenerator(api_key=Secret.from_token("token"))
+        response = GenerateContentResponse.from_response(protos.GenerateContentResponse(
+            candidates=[{"content": {"parts": [{"text": "Ljubljana"}], "role": "model"}}],
+            usage_metadata={"prompt_token_count": 10, "candidates_token_count": 2},
+        ))
+
+        with mock.patch.object(GenerativeModel, "generate_content_async", new=mock.AsyncMock(return_value=response)) as generate:
+            result = asyncio.run(GeminiProvider().run_structured_async(generator, "prompt", {"type": "string"}))
+
+        self.assertEqual(["Ljubljana"], result["replies"])
+        self.assertEqual({"prompt_tokens": 10, "completion_tokens": 2}, result["meta"][0]["usage"])
+        self.assertEqual("application/json", generate.call_args.kwargs["generation_config"].response_mime_type)
+
+    def test_gemini_run_reports_usage(self):
+        from google.generativeai import GenerativeModel, protos
+        from google.generativeai.types import GenerateContentResponse
+        from haystack_integrations.components.generators.google_ai import GoogleAIGeminiGenerator
+
+        generator = GoogleAIGeminiGenerator(api_key=Secret.from_token("token"))
+        response = GenerateContentResponse.from_response(protos.GenerateContentResponse(
+            candidates=[{"content": {"parts": [{"text": "Ljubljana"}], "role": "model"}}],
+            usage_metadata={"prompt_token_count": 10, "candidates_token_count": 2},
+        ))
+
+        # the free text calls of the two stage path report usage like structured calls
+        with mock.patch.object(GenerativeModel, "generate_content", return_value=response) as generate:
+            result = GeminiProvider().run(generator, "prompt")
+
+        self.assertEqual(["Ljubljana"], result["replies"])
+        self.assertEqual({"prompt_tokens": 10, "completion_tokens": 2}, result["meta"][0]["usage"])
+        self.assertEqual("prompt", generate.call_args.kwargs["contents"])
+
+    def test_gemini_schema_errors(self):
+        from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+
+        provider = GeminiProvider()
+
+        self.assertTrue(provider.is_schema_error(None, InvalidArgument("Invalid response schema")))
+        self.assertTrue(provider.is_schema_error(None, ValueError("Unknown field for Schema")))
+        self.assertFalse(provider.is_schema_error(None, ServiceUnavailable("Try again later")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from smart_docx.llm.scheduler import LLMScheduler, TokenBucket, scheduler_queue, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_time_until_available(self):
+        bucket = TokenBucket(per_minute=60, capacity=1)
+
+        self.assertEqual(0, bucket.time_until_available(1))
+        bucket.consume(1)
+        self.assertAlmostEqual(1.0, bucket.time_until_available(1), delta=0.05)
+
+    def test_refund_debt(self):
+        bucket = TokenBucket(per_minute=600, capacity=100)
+
+        bucket.consume(100)
+        bucket.refund(-50)  # request used 50 tokens more than estimated
+        self.assertAlmostEqual(15.0, bucket.time_until_available(100), delta=0.05)
+
+
+class TestLLMScheduler(unittest.TestCase):
+    def test_is_rate_limit_error(self):
+        error = Exception()
+        error.status_code = 429
+
+        self.assertTrue(is_rate_limit_error(RateLimitError()))
+        self.assertTrue(is_rate_limit_error(error))
+        self.assertFalse(is_rate_limit_error(ValueError()))
+
+    def test_retries_rate_limit_errors(self):
+        scheduler = LLMScheduler(backoff_base=0.01)
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) < 3:
+                raise RateLimitError()
+            return "reply"
+
+        self.assertEqual("reply", scheduler.call(call))
+        self.assertEqual(3, len(calls))
+        self.assertEqual(0, scheduler.in_flight)
+
+    def test_gives_up_after_max_retries(self):
+        scheduler = LLMScheduler(max_retries=2, backoff_base=0.01)
+        calls = []
+
+        def call():
+            calls.append(1)
+            raise RateLimitError()
+
+        with self.assertRaises(RateLimitError):
+            scheduler.call(call)
+        self.assertEqual(3, len(calls))
+
+    def test_other_errors_are_not_retried(self):
+        scheduler = LLMScheduler(backoff_base=0.01)
+        calls = []
+
+        def call():
+            calls.append(1)
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            scheduler.call(call)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(0, scheduler.in_flight)
+
+    def test_max_in_flight(self):
+        scheduler = LLMScheduler(max_in_flight=2)
+        lock = threading.Lock()
+        in_flight, max_in_flight = [0], [0]
+
+        def call():
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+
+        threads = [threading.Thread(target=scheduler.call, args=(call,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(2, max_in_flight[0])
+
+    def test_requests_per_minute(self):
+        scheduler = LLMScheduler(requests_per_minute=600)
+        scheduler.requests = TokenBucket(per_minute=600, capacity=1)
+
+        start = time.perf_counter()
+        for _ in range(3):
+            scheduler.call(lambda: None)
+
+        # one request is available right away, the other two wait 0.1s each
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+
+    def test_queues_are_served_round_robin(self):
+        scheduler = LLMScheduler(max_in_flight=1)
+        blocker = threading.Event()
+        order = []
+
+        def queued_tickets() -> int:
+            with scheduler._condition:
+                return sum(len(queue) for queue in scheduler._queues.values())
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+        def submit(queue: str, name: str) -> threading.Thread:
+            def run():
+                with scheduler_queue(queue):
+                    scheduler.call(lambda: blocker.wait() if name == "blocker" else order.append(name))
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            return thread
+
+        threads = [submit("other", "blocker")]
+        wait_for(lambda: scheduler.in_flight == 1)
+        for queue, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("b", "b2")]:
+            expected_tickets = queued_tickets() + 1
+            threads.append(submit(queue, name))
+            wait_for(lambda: queued_tickets() == expected_tickets)
+
+        blocker.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(["a1", "b1", "a2", "b2", "a3"], order)
+
+
+class TestAsyncLLMScheduler(unittest.TestCase):
+    def test_queued_calls_start_when_a_call_finishes(self):
+        scheduler = LLMScheduler(max_in_flight=1)
+
+        async def call():
+            await asyncio.sleep(0.001)
+
+        async def run_calls():
+            await asyncio.gather(*[scheduler.acall(call) for _ in range(10)])
+
+        start = time.perf_counter()
+        asyncio.run(run_calls())
+
+        # waiting calls are woken by the release, not by polling
+        self.assertLess(time.perf_counter() - start, 0.2)
+        self.assertEqual(0, scheduler.in_flight)
+        self.assertEqual({}, dict(scheduler._queues))
+        self.assertEqual(set(), scheduler._async_waiters)
+
+    def test_requests_per_minute(self):
+        scheduler = LLMScheduler(requests_per_minute=600)
+        scheduler.requests = TokenBucket(per_minute=600, capacity=1)
+
+        async def call():
+            return None
+
+        async def run_calls():
+            for _ in range(3):
+                await scheduler.acall(call)
+
+        start = time.perf_counter()
+        asyncio.run(run_calls())
+
+        # the two waiting calls sleep until their request is due
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+        self.assertLess(time.perf_counter() - start, 0.3)
+
+    def test_thread_release_wakes_async_caller(self):
+        scheduler = LLMScheduler(max_in_flight=1)
+        started, blocker = threading.Event(), threading.Event()
+
+        def blocking_call():
+            started.set()
+            blocker.wait()
+
+        thread = threading.Thread(target=scheduler.call, args=(blocking_call,))
+        thread.start()
+        started.wait()
+        threading.Timer(0.05, blocker.set).start()
+
+        async def call():
+            return time.perf_counter()
+
+        start = time.perf_counter()
+        started_at = asyncio.run(scheduler.acall(call))
+        thread.join()
+
+        self.assertLess(started_at - start, 0.2)
+        self.assertGreaterEqual(started_at - start, 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import typing
+import unittest
+from unittest import mock
+
+from docx import Document
+
+from smart_docx.templates.cache import TemplateCache
+from smart_docx.templates.definitions import FieldDefinition, SourceType, TemplateDefinition
+
+
+def create_template_definition(field_ids: typing.List[str]) -> TemplateDefinition:
+    return TemplateDefinition(
+        name="test",
+        description="description ...",
+        instructions="instructions ...",
+        fields=[FieldDefinition(id=field_id, source=SourceType.INPUT, value={"type": "string"}, instructions="...")
+                for field_id in field_ids]
+    )
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.created_files = []
+
+    def tearDown(self):
+        for file in self.created_files:
+            if os.path.exists(file) and os.path.isfile(file):
+                os.remove(file)
+
+    def create_temp_docx_file(self, paragraphs: typing.List[str]) -> str:
+        file_path = tempfile.NamedTemporaryFile(delete=False, suffix='.docx')
+        file_path.close()
+        doc = Document()
+        for par in paragraphs:
+            doc.add_paragraph(par)
+        doc.save(file_path.name)
+        self.created_files.append(file_path.name)
+        return file_path.name
+
+    def test_get_parses_template_once(self):
+        template_file = self.create_temp_docx_file(["Name: {{ name }}", "Date: {{ date }}"])
+        cache = TemplateCache()
+
+        with mock.patch("smart_docx.templates.cache.DocxTemplate.get_undeclared_template_variables",
+                        autospec=True, return_value={"name", "date"}) as get_variables:
+            template = cache.get(template_file)
+            with open(template_file, "rb") as file:
+                same_template = cache.get(file)
+
+        self.assertIs(template, same_template)
+        self.assertEqual(1, get_variables.call_count)
+        self.assertEqual({"name", "date"}, template.variables)
+
+    def test_new_docx_does_not_modify_cached_template(self):
+        template_file = self.create_temp_docx_file(["Name: {{ name }}"])
+        template = TemplateCache().get(template_file)
+
+        first = template.new_docx()
+        first.render({"name": "Ana"})
+        second = template.new_docx()
+        second.render({"name": "Bor"})
+
+        self.assertEqual("Name: Ana", first.paragraphs[0].text)
+        self.assertEqual("Name: Bor", second.paragraphs[0].text)
+        self.assertEqual("Name: {{ name }}", template.document.paragraphs[0].text)
+
+    def test_validate(self):
+        template_file = self.create_temp_docx_file(["Name: {{ name }}", "Date: {{ date }}"])
+        cache = TemplateCache()
+        template = cache.get(template_file)
+
+        valid_definition = create_template_definition(["name", "date"])
+        cache.validate(valid_definition, template)
+        with mock.patch.object(TemplateDefinition, "_validate_template_variables") as validate_variables:
+            cache.validate(valid_definition, template)
+        validate_variables.assert_not_called()
+
+        with self.assertRaises(ValueError) as context:
+            cache.validate(create_template_definition(["name"]), template)
+        self.assertIn("Missing defined fields, which are present in template: date", str(context.exception))
+
+    def test_lru_eviction(self):
+        cache = TemplateCache(max_size=2)
+        first = self.create_temp_docx_file(["{{ a }}"])
+        second = self.create_temp_docx_file(["{{ b }}"])
+        third = self.create_temp_docx_file(["{{ c }}"])
+
+        first_template = cache.get(first)
+        cache.get(second)
+        cache.get(first)
+        cache.get(third)
+
+        self.assertEqual(2, len(cache))
+        self.assertIs(first_template, cache.get(first))
+        self.assertEqual({"b"}, cache.get(second).variables)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,7 @@ import unittest
 
 from docx import Document
 
-from smart_docx.templates.definitions import FieldDefinition, SourceType, TemplateDefinition
+from smart_docx.templates.definitions import FieldDefinition, SourceType, TemplateDefinition, group_field_definitions_by_level
 
 
 class TestTemplateDefinition(unittest.TestCase):
@@ -76,6 +76,16 @@ class TestTemplateDefinition(unittest.TestCase):
                 instructions="Enter the username"
             )
 
+    def test_chunk_size(self):
+        field = FieldDefinition(id="items", source=SourceType.AUTO, value={"type": "array", "items": {"type": "string"}},
+                                instructions="List the items", chunk_size=20)
+        self.assertEqual(20, field.chunk_size)
+
+        with self.assertRaises(ValueError):
+            FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"}, instructions="Title", chunk_size=20)
+        with self.assertRaises(ValueError):
+            FieldDefinition(id="items", source=SourceType.AUTO, value={"type": "array"}, instructions="List the items", chunk_size=0)
+
     def test_invalid_template_definition_duplicate_field_ids(self):
         docx = self.create_temp_docx_file([
             "My username is {{ username }}"
@@ -204,6 +214,36 @@ class TestTemplateDefinition(unittest.TestCase):
 
         self.assertIn("Circular dependency between fields", str(context.exception))
 
+    def test_group_field_definitions_by_level(self):
+        fields = [
+            FieldDefinition(id="summary", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="Summarize {{ title }} and {{ intro }}"),
+            FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="Title for {{ topic }}"),
+            FieldDefinition(id="intro", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="Intro for {{ topic }}"),
+            FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"},
+                            instructions="Topic"),
+            FieldDefinition(id="footer", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="Footer"),
+        ]
+
+        levels = group_field_definitions_by_level(fields)
+
+        self.assertEqual([["topic", "footer"], ["title", "intro"], ["summary"]],
+                         [[f.id for f in level] for level in levels])
+
+    def test_group_field_definitions_by_level_circular_dependency(self):
+        fields = [
+            FieldDefinition(id="a", source=SourceType.AUTO, value={"type": "string"}, instructions="{{ b }}"),
+            FieldDefinition(id="b", source=SourceType.AUTO, value={"type": "string"}, instructions="{{ a }}"),
+        ]
+
+        with self.assertRaises(ValueError) as context:
+            group_field_definitions_by_level(fields)
+
+        self.assertIn("Circular dependency between fields", str(context.exception))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,442 @@
+import asyncio
+import threading
+import time
+import typing
+import unittest
+
+from smart_docx.llm.budget import Deadline, DeadlineExceededError
+from smart_docx.llm.json_answer_generator import JsonAnswerGenerator, PipelinePool, GenerationMode
+from smart_docx.llm.stats import current_answer_stats
+from smart_docx.templates.definitions import FieldDefinition, SourceType, TemplateDefinition
+from smart_docx.templates.fields_generation import TemplateFieldsGenerator, TimeoutPolicy, FieldEvent
+
+
+class FakeAnswerGenerator:
+    def __init__(self, delay: float = 0.0, failures: dict = None):
+        self.delay = delay
+        self.failures = failures or {}
+        self.questions = []
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def answer(self, question: str, schema: dict, system_prompt: str = None):
+        with self.lock:
+            self.questions.append(question)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        time.sleep(self.delay)
+        stats = current_answer_stats()
+        if stats is not None:
+            stats.validation_failures += self.failures.get(question, 0)
+
+        with self.lock:
+            self.in_flight -= 1
+        return question.upper()
+
+    def answer_many(self, questions: dict, schemas: dict, system_prompt: str = None):
+        self.batches.append(list(questions))
+        return {field_id: self.answer(question, schemas[field_id]) for field_id, question in questions.items()}
+
+
+class AsyncFakeAnswerGenerator(FakeAnswerGenerator):
+    async def aanswer(self, question: str, schema: dict, system_prompt: str = None):
+        self.questions.append(question)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return question.upper()
+
+    async def aanswer_many(self, questions: dict, schemas: dict, system_prompt: str = None):
+        self.batches.append(list(questions))
+        return {field_id: await self.aanswer(question, schemas[field_id]) for field_id, question in questions.items()}
+
+
+async def collect_events(generator: TemplateFieldsGenerator) -> typing.List[FieldEvent]:
+    return [event async for event in generator.aiter_template_fields()]
+
+
+def create_template_definition() -> TemplateDefinition:
+    return TemplateDefinition(
+        name="test",
+        description="description ...",
+        instructions="instructions ...",
+        fields=[
+            FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+            FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="title of {{ topic }}"),
+            FieldDefinition(id="intro", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="intro of {{ topic }}"),
+            FieldDefinition(id="outro", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="outro of {{ topic }}"),
+            FieldDefinition(id="summary", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="summary of {{ title }}"),
+        ]
+    )
+
+
+class TestTemplateFieldsGenerator(unittest.TestCase):
+    def test_generate_template_fields(self):
+        answer_generator = FakeAnswerGenerator()
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator)
+
+        fields = {field.id: field.value for field in generator.generate_template_fields()}
+
+        self.assertEqual("cats", fields["topic"])
+        self.assertEqual("TITLE OF CATS", fields["title"])
+        self.assertEqual("SUMMARY OF TITLE OF CATS", fields["summary"])
+        self.assertEqual(1, answer_generator.max_in_flight)
+
+    def test_generate_template_fields_concurrently(self):
+        answer_generator = FakeAnswerGenerator(delay=0.1)
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            max_workers=4)
+
+        fields = {field.id: field.value for field in generator.generate_template_fields()}
+
+        self.assertEqual("INTRO OF CATS", fields["intro"])
+        self.assertEqual("OUTRO OF CATS", fields["outro"])
+        self.assertEqual("SUMMARY OF TITLE OF CATS", fields["summary"])
+        self.assertEqual(5, len(fields))
+        # title, intro and outro only depend on the input and are generated together
+        self.assertEqual(3, answer_generator.max_in_flight)
+
+    def test_generate_template_fields_in_batches(self):
+        answer_generator = FakeAnswerGenerator()
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            batch_size=2)
+
+        fields = {field.id: field.value for field in generator.generate_template_fields()}
+
+        self.assertEqual("TITLE OF CATS", fields["title"])
+        self.assertEqual("OUTRO OF CATS", fields["outro"])
+        self.assertEqual("SUMMARY OF TITLE OF CATS", fields["summary"])
+        # title is on the longest chain, so it is started first, summary is batched as soon as title is generated
+        self.assertEqual([["title", "intro"], ["outro", "summary"]], answer_generator.batches)
+
+    def test_iter_template_fields(self):
+        answer_generator = FakeAnswerGenerator(failures={"intro of cats": 2})
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator)
+
+        events = list(generator.iter_template_fields())
+
+        self.assertEqual({"title", "intro", "outro"}, {event.id for event in events[:3]})
+        self.assertEqual("summary", events[3].id)
+        self.assertEqual("SUMMARY OF TITLE OF CATS", events[3].value)
+        self.assertEqual({"title": 0, "intro": 2, "outro": 0, "summary": 0}, {event.id: event.retries for event in events})
+        self.assertTrue(all(event.elapsed >= 0 for event in events))
+
+    def test_closing_iterator_stops_generation(self):
+        answer_generator = FakeAnswerGenerator(delay=0.05)
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            max_workers=2)
+
+        events = generator.iter_template_fields()
+        next(events)
+        events.close()
+
+        # the level with the summary field is never reached
+        self.assertLessEqual(len(answer_generator.questions), 3)
+        self.assertNotIn("summary of TITLE OF CATS", answer_generator.questions)
+
+    def test_critical_path_does_not_wait_for_level(self):
+        template_definition = TemplateDefinition(
+            name="test",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[
+                FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+                FieldDefinition(id="short1", source=SourceType.AUTO, value={"type": "string"}, instructions="short1 {{ topic }}"),
+                FieldDefinition(id="short2", source=SourceType.AUTO, value={"type": "string"}, instructions="short2 {{ topic }}"),
+                FieldDefinition(id="short3", source=SourceType.AUTO, value={"type": "string"}, instructions="short3 {{ topic }}"),
+                FieldDefinition(id="long1", source=SourceType.AUTO, value={"type": "string"}, instructions="long1 {{ topic }}"),
+                FieldDefinition(id="long2", source=SourceType.AUTO, value={"type": "string"}, instructions="long2 {{ long1 }}"),
+                FieldDefinition(id="long3", source=SourceType.AUTO, value={"type": "string"}, instructions="long3 {{ long2 }}"),
+            ]
+        )
+        answer_generator = FakeAnswerGenerator(delay=0.02)
+        generator = TemplateFieldsGenerator(template_definition=template_definition,
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            max_workers=2)
+
+        fields = {field.id: field.value for field in generator.generate_template_fields()}
+
+        self.assertEqual("LONG3 LONG2 LONG1 CATS", fields["long3"])
+        questions = [question.split()[0] for question in answer_generator.questions]
+        self.assertEqual("long1", questions[0])
+        # long2 does not wait for the remaining fields of the first level
+        self.assertLess(questions.index("long2"), questions.index("short3"))
+
+    def test_invalid_max_workers(self):
+        with self.assertRaises(ValueError):
+            TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                    inputs={"topic": "cats"},
+                                    answer_generator=FakeAnswerGenerator(),
+                                    max_workers=0)
+
+
+def create_incremental_template_definition() -> TemplateDefinition:
+    return TemplateDefinition(
+        name="test",
+        description="description ...",
+        instructions="instructions ...",
+        fields=[
+            FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+            FieldDefinition(id="author", source=SourceType.INPUT, value={"type": "string"}, instructions="Author"),
+            FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="title of {{ topic }}"),
+            FieldDefinition(id="signature", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="signature of {{ author }}"),
+            FieldDefinition(id="summary", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="summary of {{ title }}"),
+        ]
+    )
+
+
+class TestIncrementalGeneration(unittest.TestCase):
+    def _generate(self, inputs: dict, previous_manifest=None, **kwargs):
+        answer_generator = FakeAnswerGenerator()
+        generator = TemplateFieldsGenerator(template_definition=create_incremental_template_definition(),
+                                            inputs=inputs,
+                                            answer_generator=answer_generator,
+                                            previous_manifest=previous_manifest,
+                                            **kwargs)
+        events = {event.id: event for event in generator.iter_template_fields()}
+        return generator, answer_generator, events
+
+    def test_unchanged_inputs_reuse_all_fields(self):
+        first, _, _ = self._generate({"topic": "cats", "author": "Ana"})
+        _, answer_generator, events = self._generate({"topic": "cats", "author": "Ana"}, first.manifest)
+
+        self.assertEqual([], answer_generator.questions)
+        self.assertTrue(all(event.reused for event in events.values()))
+        self.assertEqual("SUMMARY OF TITLE OF CATS", events["summary"].value)
+
+    def test_changed_input_regenerates_only_downstream_fields(self):
+        first, _, _ = self._generate({"topic": "cats", "author": "Ana"})
+        second, answer_generator, events = self._generate({"topic": "cats", "author": "Bor"}, first.manifest)
+
+        self.assertEqual(["signature of Bor"], answer_generator.questions)
+        self.assertTrue(events["title"].reused)
+        self.assertTrue(events["summary"].reused)
+        self.assertFalse(events["signature"].reused)
+        self.assertEqual("SIGNATURE OF BOR", second.manifest.entries["signature"].value)
+
+    def test_changed_input_propagates_through_dependencies(self):
+        first, _, _ = self._generate({"topic": "cats", "author": "Ana"})
+        _, answer_generator, events = self._generate({"topic": "dogs", "author": "Ana"}, first.manifest,
+                                                     max_workers=2, batch_size=2)
+
+        self.assertEqual({"title of dogs", "summary of TITLE OF DOGS"}, set(answer_generator.questions))
+        self.assertTrue(events["signature"].reused)
+        self.assertEqual("SUMMARY OF TITLE OF DOGS", events["summary"].value)
+
+
+class TestChunkedFields(unittest.TestCase):
+    class ChunkingAnswerGenerator(FakeAnswerGenerator):
+        def __init__(self):
+            super().__init__()
+            self.chunked = []
+
+        def answer_array(self, question: str, schema: dict, chunk_size: int, system_prompt: str = None):
+            self.chunked.append((question, chunk_size))
+            return [question.upper()]
+
+    def create_template_definition(self) -> TemplateDefinition:
+        return TemplateDefinition(
+            name="test",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[
+                FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+                FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"},
+                                instructions="title of {{ topic }}"),
+                FieldDefinition(id="intro", source=SourceType.AUTO, value={"type": "string"},
+                                instructions="intro of {{ topic }}"),
+                FieldDefinition(id="items", source=SourceType.AUTO, value={"type": "array", "items": {"type": "string"}},
+                                instructions="items of {{ topic }}", chunk_size=10),
+            ]
+        )
+
+    def test_chunked_field_is_not_batched(self):
+        answer_generator = self.ChunkingAnswerGenerator()
+        generator = TemplateFieldsGenerator(template_definition=self.create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            batch_size=3)
+
+        fields = {field.id: field.value for field in generator.generate_template_fields()}
+
+        self.assertEqual(["ITEMS OF CATS"], fields["items"])
+        self.assertEqual([("items of cats", 10)], answer_generator.chunked)
+        self.assertEqual([["title", "intro"]], answer_generator.batches)
+
+    def test_answer_generator_without_chunking(self):
+        generator = TemplateFieldsGenerator(template_definition=self.create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=FakeAnswerGenerator())
+
+        fields = {field.id: field.value for field in asyncio.run(generator.agenerate_template_fields())}
+
+        self.assertEqual("ITEMS OF CATS", fields["items"])
+
+
+class TestAsyncGeneration(unittest.TestCase):
+    def test_generate_template_fields_concurrently(self):
+        answer_generator = AsyncFakeAnswerGenerator(delay=0.1)
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            max_workers=4)
+
+        fields = {field.id: field.value for field in asyncio.run(generator.agenerate_template_fields())}
+
+        self.assertEqual("SUMMARY OF TITLE OF CATS", fields["summary"])
+        self.assertEqual(5, len(fields))
+        self.assertEqual(3, answer_generator.max_in_flight)
+        self.assertEqual(4, len(generator.manifest.entries))
+
+    def test_generate_template_fields_in_batches(self):
+        answer_generator = AsyncFakeAnswerGenerator()
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            batch_size=2)
+
+        events = asyncio.run(collect_events(generator))
+
+        self.assertEqual("SUMMARY OF TITLE OF CATS", {event.id: event.value for event in events}["summary"])
+        self.assertEqual([["title", "intro"], ["outro", "summary"]], answer_generator.batches)
+
+    def test_sync_answer_generator(self):
+        answer_generator = FakeAnswerGenerator(failures={"intro of cats": 2})
+        generator = TemplateFieldsGenerator(template_definition=create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator)
+
+        events = asyncio.run(collect_events(generator))
+
+        self.assertEqual("summary", events[3].id)
+        # stats are collected in the worker threads the answers are generated in
+        self.assertEqual({"title": 0, "intro": 2, "outro": 0, "summary": 0}, {event.id: event.retries for event in events})
+
+
+class TestDeadlines(unittest.TestCase):
+    def create_template_definition(self) -> TemplateDefinition:
+        return TemplateDefinition(
+            name="test",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[
+                FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+                FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string", "default": "Untitled"},
+                                instructions="title of {{ topic }}", fallback="No title"),
+                FieldDefinition(id="summary", source=SourceType.AUTO, value={"type": "string", "default": ""},
+                                instructions="summary of {{ title }}"),
+            ]
+        )
+
+    def generate(self, timeout_policy: TimeoutPolicy) -> typing.Tuple[TemplateFieldsGenerator, typing.List[FieldEvent]]:
+        generator = TemplateFieldsGenerator(template_definition=self.create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=FakeAnswerGenerator(delay=1.0),
+                                            deadline=Deadline(0.1),
+                                            timeout_policy=timeout_policy)
+        return generator, list(generator.iter_template_fields())
+
+    def test_default_policy(self):
+        start = time.perf_counter()
+        generator, events = self.generate(TimeoutPolicy.DEFAULT)
+
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual({"title": "Untitled", "summary": ""}, {event.id: event.value for event in events})
+        self.assertTrue(all(event.exhausted for event in events))
+        self.assertEqual({}, generator.manifest.entries)
+
+    def test_fallback_policy(self):
+        _, events = self.generate(TimeoutPolicy.FALLBACK)
+
+        self.assertEqual({"title": "No title", "summary": ""}, {event.id: event.value for event in events})
+
+    def test_fail_policy(self):
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceededError):
+            self.generate(TimeoutPolicy.FAIL)
+        self.assertLess(time.perf_counter() - start, 0.9)
+
+    def test_fields_finished_in_time_are_kept(self):
+        generator = TemplateFieldsGenerator(template_definition=self.create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=FakeAnswerGenerator(),
+                                            deadline=Deadline(5),
+                                            timeout_policy=TimeoutPolicy.DEFAULT)
+
+        events = list(generator.iter_template_fields())
+
+        self.assertEqual({"title": "TITLE OF CATS", "summary": "SUMMARY OF TITLE OF CATS"},
+                         {event.id: event.value for event in events})
+        self.assertFalse(any(event.exhausted for event in events))
+
+    def test_async_deadline_cancels_fields_in_flight(self):
+        answer_generator = AsyncFakeAnswerGenerator(delay=5.0)
+        generator = TemplateFieldsGenerator(template_definition=self.create_template_definition(),
+                                            inputs={"topic": "cats"},
+                                            answer_generator=answer_generator,
+                                            deadline=Deadline(0.1),
+                                            timeout_policy=TimeoutPolicy.FALLBACK)
+
+        start = time.perf_counter()
+        events = asyncio.run(collect_events(generator))
+
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual({"title": "No title", "summary": ""}, {event.id: event.value for event in events})
+        self.assertEqual(0, answer_generator.in_flight)
+
+    def test_default_retry_budget_exhausted(self):
+        class InvalidGenerator:
+            def run(self, prompt: str):
+                return {"replies": ["many"]}
+
+        template_definition = TemplateDefinition(
+            name="test",
+            description="description ...",
+            instructions="instructions ...",
+            fields=[FieldDefinition(id="count", source=SourceType.AUTO, value={"type": "integer", "default": 0},
+                                    instructions="count", fallback=1)]
+        )
+        answer_generator = JsonAnswerGenerator(pool=PipelinePool(llm=InvalidGenerator()), mode=GenerationMode.TWO_STAGE)
+
+        for timeout_policy, value in [(TimeoutPolicy.DEFAULT, 0), (TimeoutPolicy.FALLBACK, 1)]:
+            generator = TemplateFieldsGenerator(template_definition=template_definition,
+                                                inputs={},
+                                                answer_generator=answer_generator,
+                                                timeout_policy=timeout_policy)
+
+            events = list(generator.iter_template_fields())
+
+            self.assertEqual(value, events[0].value)
+            self.assertTrue(events[0].exhausted)
+
+    def test_invalid_fallback(self):
+        with self.assertRaises(ValueError):
+            FieldDefinition(id="count", source=SourceType.AUTO, value={"type": "integer"}, instructions="count", fallback="many")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from smart_docx.templates.definitions import FieldDefinition, SourceType
+from smart_docx.templates.manifest import RenderManifest, ManifestEntry, field_fingerprint
+
+
+class TestRenderManifest(unittest.TestCase):
+    def setUp(self):
+        self.field_def = FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"},
+                                         instructions="title of {{ topic }}")
+
+    def test_field_fingerprint(self):
+        fingerprint = field_fingerprint(self.field_def, "instructions", {"topic": "cats"})
+
+        self.assertEqual(fingerprint, field_fingerprint(self.field_def, "instructions", {"topic": "cats"}))
+        self.assertNotEqual(fingerprint, field_fingerprint(self.field_def, "instructions", {"topic": "dogs"}))
+        self.assertNotEqual(fingerprint, field_fingerprint(self.field_def, "other instructions", {"topic": "cats"}))
+
+    def test_get_entry(self):
+        manifest = RenderManifest(entries={"title": ManifestEntry(value="Cats", fingerprint="abc")})
+
+        self.assertEqual("Cats", manifest.get_entry("title", "abc").value)
+        self.assertIsNone(manifest.get_entry("title", "def"))
+        self.assertIsNone(manifest.get_entry("summary", "abc"))
+
+    def test_save_and_load(self):
+        manifest = RenderManifest(entries={"title": ManifestEntry(value="Mačke", fingerprint="abc"),
+                                           "items": ManifestEntry(value=[1, 2], fingerprint="def")})
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "manifest.json")
+            manifest.save(filename)
+            self.assertEqual(manifest, RenderManifest.load(filename))
+
+    def test_unsupported_version(self):
+        with self.assertRaises(ValueError):
+            RenderManifest.from_dict({"version": 0, "fields": {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
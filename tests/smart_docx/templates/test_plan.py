@@ -0,0 +1,54 @@
+import unittest
+
+from smart_docx.templates.definitions import FieldDefinition, SourceType, TemplateDefinition
+from smart_docx.templates.plan import compile_execution_plan, get_execution_plan
+
+
+def create_template_definition() -> TemplateDefinition:
+    return TemplateDefinition(
+        name="test",
+        description="description ...",
+        instructions="instructions ...",
+        fields=[
+            FieldDefinition(id="topic", source=SourceType.INPUT, value={"type": "string"}, instructions="Topic"),
+            FieldDefinition(id="intro", source=SourceType.AUTO, value={"type": "string"}, instructions="intro of {{ topic }}"),
+            FieldDefinition(id="title", source=SourceType.AUTO, value={"type": "string"}, instructions="title of {{ topic }}"),
+            FieldDefinition(id="outline", source=SourceType.AUTO, value={"type": "string"}, instructions="outline of {{ title }}"),
+            FieldDefinition(id="summary", source=SourceType.AUTO, value={"type": "string"},
+                            instructions="summary of {{ outline }} and {{ intro }}"),
+            FieldDefinition(id="footer", source=SourceType.AUTO, value={"type": "string"}, instructions="footer"),
+        ]
+    )
+
+
+class TestExecutionPlan(unittest.TestCase):
+    def test_priorities_and_critical_path(self):
+        plan = compile_execution_plan(create_template_definition())
+
+        self.assertEqual({"topic": 3, "intro": 2, "title": 3, "outline": 2, "summary": 1, "footer": 1}, plan.priorities)
+        self.assertEqual(["title", "outline", "summary"], plan.critical_path)
+
+    def test_levels_are_ordered_by_priority(self):
+        plan = compile_execution_plan(create_template_definition())
+
+        self.assertEqual([["topic", "footer"], ["title", "intro"], ["outline"], ["summary"]],
+                         [[field_def.id for field_def in level] for level in plan.levels])
+        self.assertEqual(["topic", "footer", "title", "intro", "outline", "summary"],
+                         [field_def.id for field_def in plan.sorted_fields])
+
+    def test_render_instructions(self):
+        plan = compile_execution_plan(create_template_definition())
+
+        self.assertEqual("summary of A and B", plan.render_instructions("summary", {"outline": "A", "intro": "B"}))
+        self.assertEqual("footer", plan.render_instructions("footer", {}))
+        self.assertNotIn("footer", plan.instruction_templates)
+
+    def test_plan_is_cached_per_definition(self):
+        template_definition = create_template_definition()
+
+        self.assertIs(get_execution_plan(template_definition), get_execution_plan(template_definition))
+        self.assertIsNot(get_execution_plan(template_definition), get_execution_plan(create_template_definition()))
+
+
+if __name__ == '__main__':
+    unittest.main()
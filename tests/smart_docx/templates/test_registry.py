@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from smart_docx.templates import registry
+from smart_docx.templates.definitions import SourceType
+from smart_docx.templates.registry import TemplateDefinitionRegistry
+
+DEFINITION = """
+name: {name}
+description: description ...
+instructions: instructions ...
+fields:
+  - id: topic
+    source: INPUT
+    value:
+      type: string
+    instructions: Topic
+  - id: title
+    source: AUTO
+    value:
+      type: string
+    instructions: title of {{{{ topic }}}}
+"""
+
+
+class TestTemplateDefinitionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.cache_directory)
+
+    def write_definition(self, file_name: str, content: str):
+        path = os.path.join(self.directory, file_name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        # make sure the change is visible even on filesystems with coarse timestamps
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_load_directory(self):
+        self.write_definition("first.yaml", DEFINITION.format(name="first"))
+        self.write_definition("second.yml", DEFINITION.format(name="second"))
+        self.write_definition("notes.txt", "not a definition")
+
+        definitions = TemplateDefinitionRegistry(self.directory, max_workers=1)
+
+        self.assertEqual(["first", "second"], definitions.names())
+        title = definitions.get("first").fields[1]
+        self.assertEqual(SourceType.AUTO, title.source)
+        self.assertEqual({"topic"}, title.dependencies)
+        with self.assertRaises(ValueError):
+            definitions.get("third")
+
+    def test_load_in_parallel(self):
+        for i in range(4):
+            self.write_definition(f"definition_{i}.yaml", DEFINITION.format(name=f"definition_{i}"))
+
+        with mock.patch("smart_docx.templates.registry.ProcessPoolExecutor", wraps=registry.ProcessPoolExecutor) as executor:
+            with TemplateDefinitionRegistry(self.directory, max_workers=2, parallel_threshold=2) as definitions:
+                self.assertEqual(4, len(definitions))
+
+                for i in range(2):
+                    self.write_definition(f"definition_{i}.yaml", DEFINITION.format(name=f"changed_{i}"))
+                self.assertEqual(["definition_0", "changed_0", "definition_1", "changed_1"], definitions.reload())
+
+        # workers are spawned, forking a process with running threads is not safe
+        self.assertEqual("spawn", executor.call_args.kwargs["mp_context"].get_start_method())
+        # the workers are started once and reused by reloads
+        executor.assert_called_once()
+
+    def test_small_batches_are_validated_in_process(self):
+        for i in range(2):
+            self.write_definition(f"definition_{i}.yaml", DEFINITION.format(name=f"definition_{i}"))
+
+        with mock.patch("smart_docx.templates.registry.ProcessPoolExecutor") as executor:
+            definitions = TemplateDefinitionRegistry(self.directory, max_workers=2)
+
+        self.assertEqual(2, len(definitions))
+        executor.assert_not_called()
+
+    def test_invalid_definitions_are_reported(self):
+        self.write_definition("valid.yaml", DEFINITION.format(name="valid"))
+        self.write_definition("invalid.yaml", DEFINITION.format(name="invalid").replace("string", "unknown"))
+        self.write_definition("duplicate.yaml", DEFINITION.format(name="valid"))
+
+        definitions = TemplateDefinitionRegistry(self.directory, max_workers=1)
+
+        self.assertEqual(["valid"], definitions.names())
+        self.assertEqual({os.path.join(self.directory, "invalid.yaml"), os.path.join(self.directory, "valid.yaml")},
+                         set(definitions.errors))
+
+    def test_validated_definitions_are_cached(self):
+        self.write_definition("first.yaml", DEFINITION.format(name="first"))
+        TemplateDefinitionRegistry(self.directory, cache_directory=self.cache_directory, max_workers=1)
+
+        with mock.patch.object(registry, "_validate_definition_content") as validate:
+            definitions = TemplateDefinitionRegistry(self.directory, cache_directory=self.cache_directory, max_workers=1)
+
+        validate.assert_not_called()
+        self.assertEqual({"topic"}, definitions.get("first").fields[1].dependencies)
+
+    def test_reload(self):
+        self.write_definition("first.yaml", DEFINITION.format(name="first"))
+        self.write_definition("second.yaml", DEFINITION.format(name="second"))
+        definitions = TemplateDefinitionRegistry(self.directory, max_workers=1)
+
+        self.assertEqual([], definitions.reload())
+
+        self.write_definition("first.yaml", DEFINITION.format(name="first").replace("instructions ...", "changed"))
+        os.remove(os.path.join(self.directory, "second.yaml"))
+        self.write_definition("third.yaml", DEFINITION.format(name="third"))
+
+        self.assertEqual(["second", "first", "third"], definitions.reload())
+        self.assertEqual(["first", "third"], definitions.names())
+        self.assertEqual("changed", definitions.get("first").instructions)
+
+        for i in range(2):
+            self.write_definition(f"d{i}.yaml", DEFINITION.format(name=f"d{i}"))
+        definitions.reload()
+        for i in range(2):
+            self.write_definition(f"d{i}.yaml", DEFINITION.format(name=f"d{i}").replace("instructions ...", "changed"))
+        self.assertEqual(["d0", "d1"], definitions.reload())
+
+    def test_reload_interval(self):
+        self.write_definition("first.yaml", DEFINITION.format(name="first"))
+        definitions = TemplateDefinitionRegistry(self.directory, max_workers=1, reload_interval=0)
+
+        self.write_definition("second.yaml", DEFINITION.format(name="second"))
+
+        self.assertIn("second", definitions)
+
+    def test_get_does_not_wait_for_a_running_reload(self):
+        self.write_definition("first.yaml", DEFINITION.format(name="first"))
+        definitions = TemplateDefinitionRegistry(self.directory, max_workers=1, reload_interval=0)
+        self.write_definition("second.yaml", DEFINITION.format(name="second"))
+
+        # another thread is reloading, the loaded definitions are served meanwhile
+        with definitions._reload_lock:
+            self.assertEqual("first", definitions.get("first").name)
+            self.assertNotIn("second", definitions)
+
+        self.assertIn("second", definitions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import io
+import typing
+import unittest
+
+from docx import Document
+from docxtpl import RichText
+from lxml import etree
+
+from smart_docx.templates.cache import TemplateCache, CachedTemplate
+
+
+def create_template(loop_rows: typing.List[typing.List[str]], for_row: str = "{%tr for item in items %}") -> CachedTemplate:
+    doc = Document()
+    doc.add_paragraph("Title: {{ title }}")
+    table = doc.add_table(rows=len(loop_rows) + 3, cols=2)
+    table.rows[0].cells[0].text = for_row
+    for row, texts in zip(table.rows[1:], loop_rows):
+        for cell, text in zip(row.cells, texts):
+            cell.text = text
+    table.rows[-2].cells[0].text = "{%tr endfor %}"
+    table.rows[-1].cells[0].text = "Total: {{ total }}"
+
+    output = io.BytesIO()
+    doc.save(output)
+    return TemplateCache().get(output)
+
+
+def render_with_docxtpl(template: CachedTemplate, context: typing.Dict[str, typing.Any]) -> bytes:
+    docx = template.new_docx()
+    docx.render(context)
+    return etree.tostring(docx.docx.element.body)
+
+
+def table_texts(body: bytes) -> typing.List[typing.List[str]]:
+    document = etree.fromstring(body)
+    namespace = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
+    return [["".join(cell.xpath(".//w:t/text()", namespaces=namespace)) for cell in row.xpath("w:tc", namespaces=namespace)]
+            for row in document.xpath(".//w:tr", namespaces=namespace)]
+
+
+class TestRowLoops(unittest.TestCase):
+    def test_finds_loops_with_placeholders_only(self):
+        template = create_template([["{{ item.name }}", "{{ item['qty'] }} {{ unit }}"]])
+
+        self.assertEqual(1, len(template.row_loops))
+        self.assertEqual("item", template.row_loops[0].item_name)
+        self.assertEqual("items", template.row_loops[0].iterable_name)
+
+    def test_skips_loops_with_tags_and_filters(self):
+        self.assertEqual([], create_template([["{{ item.name|upper }}", ""]]).row_loops)
+        self.assertEqual([], create_template([["{% if item.name %}x{% endif %}", ""]]).row_loops)
+        self.assertEqual([], create_template([["{{ item.name }}", ""]], for_row="{%tr for item in items|sort %}").row_loops)
+
+    def test_renders_same_document_as_docxtpl(self):
+        template = create_template([["{{ item.name }}", "{{ item['qty'] }} {{ unit }}"], ["{{ item.note }}", ""]])
+        context = {"title": "Report", "unit": "kg", "total": 3,
+                   "items": [{"name": f"Item {i}", "qty": i, "note": f"Line\n{i}"} for i in range(3)]}
+
+        expected = render_with_docxtpl(template, context)
+        docx = template.render_docx(context)
+
+        self.assertEqual(expected, etree.tostring(docx.docx.element.body))
+
+    def test_escapes_values(self):
+        template = create_template([["{{ item.name }}", "{{ item.missing }}"]])
+
+        docx = template.render_docx({"title": "Report", "total": 1, "items": [{"name": "A & B <c>"}]})
+
+        self.assertEqual(["A & B <c>", ""], table_texts(etree.tostring(docx.docx.element.body))[0])
+
+    def test_falls_back_to_docxtpl_for_rich_values(self):
+        template = create_template([["{{ item.name }}", ""]])
+        for value in [RichText("bold", bold=True), "a\tb", ["a", "b"]]:
+            context = {"title": "Report", "total": 1, "items": [{"name": value}]}
+
+            expected = render_with_docxtpl(template, context)
+            docx = template.render_docx(context)
+
+            self.assertEqual(expected, etree.tostring(docx.docx.element.body))
+
+    def test_empty_loop(self):
+        template = create_template([["{{ item.name }}", ""]])
+        context = {"title": "Report", "total": 0, "items": []}
+
+        self.assertEqual(render_with_docxtpl(template, context), etree.tostring(template.render_docx(context).docx.element.body))
+
+    def test_loop_inside_repeated_section(self):
+        doc = Document()
+        doc.add_paragraph("{%p for section in sections %}")
+        doc.add_paragraph("{{ section }}")
+        table = doc.add_table(rows=3, cols=1)
+        table.rows[0].cells[0].text = "{%tr for item in items %}"
+        table.rows[1].cells[0].text = "{{ section }}: {{ item }}"
+        table.rows[2].cells[0].text = "{%tr endfor %}"
+        doc.add_paragraph("{%p endfor %}")
+        output = io.BytesIO()
+        doc.save(output)
+        template = TemplateCache().get(output)
+        context = {"sections": ["A", "B"], "items": ["x", "y"]}
+
+        docx = template.render_docx(context)
+
+        # the outer loop variable is only known to jinja, so the loop is rendered by docxtpl
+        self.assertEqual([], template.row_loops)
+        self.assertEqual(render_with_docxtpl(template, context), etree.tostring(docx.docx.element.body))
+        self.assertEqual([["A: x"], ["A: y"], ["B: x"], ["B: y"]], table_texts(etree.tostring(docx.docx.element.body)))
+
+    def test_falls_back_to_docxtpl_for_names_outside_the_context(self):
+        template = create_template([["{{ item }}", "{{ unit }}"]])
+        context = {"title": "Report", "total": 1, "items": ["x"]}
+
+        self.assertEqual(render_with_docxtpl(template, context), etree.tostring(template.render_docx(context).docx.element.body))
+
+    def test_skips_loops_using_set_variables(self):
+        doc = Document()
+        doc.add_paragraph("{% set unit = 'kg' %}")
+        table = doc.add_table(rows=3, cols=1)
+        table.rows[0].cells[0].text = "{%tr for item in items %}"
+        table.rows[1].cells[0].text = "{{ item }} {{ unit }}"
+        table.rows[2].cells[0].text = "{%tr endfor %}"
+        output = io.BytesIO()
+        doc.save(output)
+        template = TemplateCache().get(output)
+        context = {"items": ["x"], "unit": "g"}
+
+        self.assertEqual([], template.row_loops)
+        self.assertEqual([["x kg"]], table_texts(etree.tostring(template.render_docx(context).docx.element.body)))